@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+import argparse
+import json
+from capri_tools.local_ai_benchmark import run_benchmarks, save_report, compare_reports
+
+def parse_int_list(value: str):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+def parse_str_list(value: str):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local models used by call_local_ai and llama-chat.")
+    parser.add_argument("--models", type=parse_str_list, help="Comma-separated registry model names (default: the registry's default model)")
+    parser.add_argument("--quantizations", type=parse_str_list, help="Comma-separated quantizations to include, e.g. Q8_0,Q4_K_M (default: all local files)")
+    parser.add_argument("--n-ctx", type=parse_int_list, default=[2048], help="Comma-separated context sizes (default: 2048)")
+    parser.add_argument("--threads", type=parse_int_list, help="Comma-separated thread counts (default: half the logical cores)")
+    parser.add_argument("--chat-formats", type=parse_str_list, help="Comma-separated chat formats, e.g. chatml,chatml-function-calling")
+    parser.add_argument("--n-batch", type=int, default=512, help="Batch size for prompt processing (default: 512)")
+    parser.add_argument("--gen-tokens", type=int, default=64, help="Tokens to generate per measurement (default: 64)")
+    parser.add_argument("--speculative", type=parse_str_list, help="Comma-separated speculative modes to compare against plain decoding: prompt_lookup,draft_model")
+    parser.add_argument("--draft-model", help="Registry model to use as the draft for --speculative draft_model (default: the entry's draft_model)")
+    parser.add_argument("--skip-tool", action="store_true", help="Don't benchmark the call_local_ai tool end to end")
+    parser.add_argument("--output", help="Where to write the JSON report (default: ~/Capri/.capri/benchmarks/)")
+    parser.add_argument("--compare", help="A previous JSON report to compare the results against")
+    args = parser.parse_args()
+
+    report = run_benchmarks(
+        model_names=args.models,
+        quantizations=args.quantizations,
+        n_ctx_values=args.n_ctx,
+        thread_values=args.threads,
+        chat_formats=args.chat_formats,
+        n_batch=args.n_batch,
+        gen_tokens=args.gen_tokens,
+        include_tool=not args.skip_tool,
+        speculative_modes=args.speculative,
+        draft_model_name=args.draft_model
+    )
+
+    output_path = save_report(report, args.output)
+    print(f"\nResults saved to: {output_path}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        print(f"\n=== Compared to {args.compare} ===")
+        for line in compare_reports(baseline, report) or ["No matching configurations"]:
+            print(line)
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
 from PyQt6.QtCore import Qt, pyqtSignal, QObject, QThread
 
 import anthropic
+import multiprocessing
 import os
 import sys
 import json
@@ -263,6 +264,8 @@ class ClaudeChat(QMainWindow):
             return {"type": "tool_result", "tool_use_id": id, "content": str(e)}
 
 if __name__ == "__main__":
+    # Needed for the search worker processes in the pyinstaller build
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     apply_dark_theme(app)
     window = ClaudeChat()
@@ -1,6 +1,10 @@
 from capri_tools.read_file import read_file_tool
 from capri_tools.edit_file import edit_file_tool
+from capri_tools.apply_patch import apply_patch_tool
 from capri_tools.list_files import list_files_tool
+from capri_tools.find_files import find_files_tool
+from capri_tools.search_files import search_files_tool
+from capri_tools.query_media import query_media_tool
 from capri_tools.download_from_youtube import download_from_youtube_tool
 from capri_tools.trim_video import trim_video_tool
 from capri_tools.copy_file_or_directory import copy_file_or_directory_tool
@@ -8,16 +12,26 @@ from capri_tools.move_file_or_directory import move_file_or_directory_tool
 from capri_tools.rescale_video import rescale_video_tool
 from capri_tools.create_directory import create_directory_tool
 from capri_tools.delete_directory import delete_directory_tool
+from capri_tools.restore import restore_tool
+from capri_tools.dedupe_report import dedupe_report_tool
+from capri_tools.find_similar_images import find_similar_images_tool
+from capri_tools.create_archive import create_archive_tool
+from capri_tools.extract_archive import extract_archive_tool
 from capri_tools.crop_resize_images import crop_resize_images_tool
 from capri_tools.execute_python_file import execute_python_file_tool
 from capri_tools.keep_segments_from_video import keep_segments_from_video_tool
+from capri_tools.tool_metrics import tool_metrics_tool
 
 def get_all_tools():
     """Return a list of all available tools. Add new items for Claude to use."""
     return [
         list_files_tool,
+        find_files_tool,
+        search_files_tool,
+        query_media_tool,
         read_file_tool,
         edit_file_tool,
+        apply_patch_tool,
         download_from_youtube_tool,
         trim_video_tool,
         copy_file_or_directory_tool,
@@ -25,7 +39,13 @@ def get_all_tools():
         rescale_video_tool,
         create_directory_tool,
         delete_directory_tool,
+        restore_tool,
+        dedupe_report_tool,
+        find_similar_images_tool,
+        create_archive_tool,
+        extract_archive_tool,
         crop_resize_images_tool,
         execute_python_file_tool,
-        keep_segments_from_video_tool
+        keep_segments_from_video_tool,
+        tool_metrics_tool
     ]
@@ -0,0 +1,418 @@
+import json
+import os
+import re
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Optional, List, Dict
+from capri_tools.tool_definition import ToolDefinition
+from capri_tools.get_capri_dir import get_capri_dir
+from capri_tools.atomic_write import stage_file, fsync_directory
+from capri_tools.file_cache import invalidate_path
+
+# Schema for apply_patch tool
+apply_patch_schema = {
+    "type": "object",
+    "properties": {
+        "patch": {
+            "type": "string",
+            "description": "A unified diff (as produced by 'diff -u' or 'git diff') that may cover many files. Paths are relative to the Capri data directory; a/ and b/ prefixes are accepted. Use /dev/null as the old path to create a file, or as the new path to delete one. git renames, copies and new or deleted empty files are supported; binary patches are not."
+        },
+        "dry_run": {
+            "type": "boolean",
+            "description": "If True, only check that every hunk applies, without changing any file.",
+            "default": False
+        }
+    },
+    "required": ["patch"]
+}
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+# How far (in lines) a hunk may have drifted from the line numbers in its header
+MAX_HUNK_OFFSET = 1000
+
+class Hunk:
+    """One @@ block of a unified diff"""
+    def __init__(self, old_start: int, old_count: int, new_start: int, new_count: int):
+        self.old_start = old_start
+        self.old_count = old_count
+        self.new_start = new_start
+        self.new_count = new_count
+        # (op, text) with op in ' ', '-', '+'
+        self.lines: List[Tuple[str, str]] = []
+        self.old_missing_newline = False
+        self.new_missing_newline = False
+
+    @property
+    def old_lines(self) -> List[str]:
+        return [text for op, text in self.lines if op != '+']
+
+    @property
+    def new_lines(self) -> List[str]:
+        return [text for op, text in self.lines if op != '-']
+
+class FilePatch:
+    """The hunks of a unified diff for one file; copy is set for git copies, which keep the old file"""
+    def __init__(self, old_path: Optional[str], new_path: Optional[str], copy: bool = False):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.copy = copy
+        self.hunks: List[Hunk] = []
+
+    @property
+    def path(self) -> str:
+        return self.new_path or self.old_path
+
+def _parse_path(header: str) -> Optional[str]:
+    # Drop the optional timestamp after a tab ("--- file.txt\t2024-01-01 10:00:00")
+    path = header.split("\t")[0].strip()
+    if path == "/dev/null":
+        return None
+    if path.startswith('"') and path.endswith('"'):
+        path = path[1:-1]
+    return path
+
+def _parse_git_paths(header: str) -> Tuple[Optional[str], Optional[str]]:
+    """Paths of a "diff --git a/x b/y" line; only unambiguous when both are the same (or quoted)"""
+    rest = header[len("diff --git "):]
+    quoted = re.match(r'^"a/(.*)" "b/(.*)"$', rest)
+    if quoted:
+        return quoted.group(1), quoted.group(2)
+    half = (len(rest) - 5) // 2
+    path = rest[2:2 + half]
+    if rest == f"a/{path} b/{path}":
+        return path, path
+    return None, None
+
+def _parse_git_header(lines: List[str], i: int) -> Tuple[FilePatch, int]:
+    """
+    Read the extended header lines after "diff --git" (renames, copies, new and deleted
+    files), returning the file they describe and the index of the first line after them.
+    """
+    old_path, new_path = _parse_git_paths(lines[i])
+    copy = False
+    i += 1
+    while i < len(lines) and not lines[i].startswith(("diff --git ", "--- ", "@@ ")):
+        line = lines[i]
+        if line.startswith(("rename from ", "copy from ")):
+            old_path = line.split(" ", 2)[2]
+            copy = line.startswith("copy")
+        elif line.startswith(("rename to ", "copy to ")):
+            new_path = line.split(" ", 2)[2]
+        elif line.startswith("new file mode"):
+            old_path = None
+        elif line.startswith("deleted file mode"):
+            new_path = None
+        elif line.startswith(("Binary files ", "GIT binary patch")):
+            raise ValueError(f"Binary patches are not supported: {new_path or old_path}")
+        i += 1
+    return FilePatch(old_path, new_path, copy), i
+
+def parse_unified_diff(patch: str) -> List[FilePatch]:
+    """
+    Parse a (possibly multi-file) unified diff.
+
+    git entries without ---/+++ lines (pure renames and copies, new or deleted empty files)
+    become file patches without hunks; changes to the file mode alone are ignored.
+    """
+    lines = patch.splitlines()
+    file_patches: List[FilePatch] = []
+    git_patch: Optional[FilePatch] = None
+    i = 0
+
+    while i < len(lines):
+        line = lines[i]
+
+        if line.startswith("diff --git "):
+            git_patch, i = _parse_git_header(lines, i)
+            if i < len(lines) and lines[i].startswith("--- "):
+                # The ---/+++ lines that follow name the same file
+                continue
+            if git_patch.old_path is None and git_patch.new_path is None:
+                raise ValueError(f"Can't tell the file paths from: {line}")
+            if git_patch.old_path != git_patch.new_path or git_patch.copy:
+                file_patches.append(git_patch)
+            git_patch = None
+            continue
+
+        if line.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ "):
+            old_path = _parse_path(line[4:])
+            new_path = _parse_path(lines[i + 1][4:])
+
+            # git-style a/ b/ prefixes
+            if (old_path is None or old_path.startswith("a/")) and (new_path is None or new_path.startswith("b/")):
+                old_path = old_path[2:] if old_path else None
+                new_path = new_path[2:] if new_path else None
+
+            file_patches.append(FilePatch(old_path, new_path, git_patch.copy if git_patch else False))
+            git_patch = None
+            i += 2
+            continue
+
+        match = HUNK_HEADER.match(line)
+        if match:
+            if not file_patches:
+                raise ValueError(f"Hunk without a file header at line {i + 1}")
+
+            old_count = int(match.group(2)) if match.group(2) is not None else 1
+            new_count = int(match.group(4)) if match.group(4) is not None else 1
+            hunk = Hunk(int(match.group(1)), old_count, int(match.group(3)), new_count)
+            old_remaining, new_remaining = old_count, new_count
+            i += 1
+
+            while i < len(lines) and (old_remaining > 0 or new_remaining > 0 or lines[i].startswith("\\")):
+                body = lines[i]
+                if body.startswith("\\"):
+                    # "\ No newline at end of file" refers to the line before it
+                    last_op = hunk.lines[-1][0] if hunk.lines else ' '
+                    if last_op in ' -':
+                        hunk.old_missing_newline = True
+                    if last_op in ' +':
+                        hunk.new_missing_newline = True
+                elif body.startswith("+"):
+                    hunk.lines.append(('+', body[1:]))
+                    new_remaining -= 1
+                elif body.startswith("-"):
+                    hunk.lines.append(('-', body[1:]))
+                    old_remaining -= 1
+                elif body.startswith(" ") or body == "":
+                    # Some tools strip the space of empty context lines
+                    hunk.lines.append((' ', body[1:]))
+                    old_remaining -= 1
+                    new_remaining -= 1
+                else:
+                    break
+                i += 1
+
+            if old_remaining != 0 or new_remaining != 0:
+                raise ValueError(f"Hunk @@ -{hunk.old_start},{old_count} +{hunk.new_start},{new_count} @@ in {file_patches[-1].path} has the wrong number of lines")
+
+            file_patches[-1].hunks.append(hunk)
+            continue
+
+        i += 1
+
+    return file_patches
+
+def _find_hunk(lines: List[str], old_lines: List[str], expected: int, earliest: int) -> int:
+    """Return where old_lines occur, searching outwards from the expected position"""
+    last_start = len(lines) - len(old_lines)
+    for offset in range(0, MAX_HUNK_OFFSET + 1):
+        for start in ((expected + offset, expected - offset) if offset else (expected,)):
+            if earliest <= start <= last_start and lines[start:start + len(old_lines)] == old_lines:
+                return start
+        if expected - offset < earliest and expected + offset > last_start:
+            break
+    return -1
+
+def apply_file_patch(file_patch: FilePatch, original: Optional[bytes]) -> Optional[bytes]:
+    """Apply the hunks of one file to its original contents. Returns None if the file is deleted."""
+    if not file_patch.hunks and original and file_patch.new_path is not None:
+        # Renamed or copied as-is, whatever the contents
+        return original
+
+    text = original.decode("utf-8") if original is not None else ""
+    eol = "\r\n" if "\r\n" in text[:text.find("\n") + 1] else "\n"
+    ends_with_newline = text.endswith("\n") or text == ""
+
+    # Split on newlines only (str.splitlines would also split on form feeds and the like)
+    lines = text.split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+    if eol == "\r\n":
+        lines = [line[:-1] if line.endswith("\r") else line for line in lines]
+
+    result: List[str] = []
+    position = 0
+    for number, hunk in enumerate(file_patch.hunks, start=1):
+        # For a pure insertion, old_start is the line *after which* to insert
+        expected = hunk.old_start - 1 if hunk.old_count else hunk.old_start
+        start = _find_hunk(lines, hunk.old_lines, max(expected, 0), position)
+        if start < 0:
+            raise ValueError(f"Hunk {number} (@@ -{hunk.old_start},{hunk.old_count} @@) does not apply to {file_patch.path}")
+
+        result.extend(lines[position:start])
+        result.extend(hunk.new_lines)
+        position = start + len(hunk.old_lines)
+
+        if position == len(lines):
+            if hunk.new_missing_newline:
+                ends_with_newline = False
+            elif hunk.old_missing_newline or not lines:
+                ends_with_newline = True
+
+    result.extend(lines[position:])
+
+    if file_patch.new_path is None:
+        if result:
+            raise ValueError(f"Patch deletes {file_patch.path} but doesn't remove all of its lines")
+        return None
+
+    content = eol.join(result) + (eol if result and ends_with_newline else "")
+    return content.encode("utf-8")
+
+def _resolve(capri_dir: str, path: str) -> str:
+    full_path = os.path.realpath(os.path.join(capri_dir, path))
+    if os.path.commonpath([full_path, os.path.realpath(capri_dir)]) != os.path.realpath(capri_dir):
+        raise ValueError(f"Path is outside the Capri data directory: {path}")
+    return full_path
+
+class _Change:
+    def __init__(self, path: str, full_path: str, content: Optional[bytes], kind: str):
+        self.path = path
+        self.full_path = full_path
+        self.content = content
+        self.kind = kind
+        self.temp_path: Optional[str] = None
+        self.backup_path: Optional[str] = None
+        self.applied = False
+
+def plan_patch(patch: str, capri_dir: str) -> List[_Change]:
+    """Parse the patch and compute every file's new contents, without writing anything"""
+    file_patches = parse_unified_diff(patch)
+    if not file_patches:
+        raise ValueError("No file changes found in patch")
+
+    changes: List[_Change] = []
+    targets: Dict[str, str] = {}
+
+    for file_patch in file_patches:
+        if file_patch.old_path is None and file_patch.new_path is None:
+            raise ValueError("A file header has /dev/null on both sides")
+
+        original = None
+        if file_patch.old_path is not None:
+            old_full_path = _resolve(capri_dir, file_patch.old_path)
+            if not os.path.isfile(old_full_path):
+                raise ValueError(f"File not found: {file_patch.old_path}")
+            with open(old_full_path, 'rb') as file:
+                original = file.read()
+
+        content = apply_file_patch(file_patch, original)
+
+        if file_patch.new_path is None:
+            change = _Change(file_patch.old_path, old_full_path, None, "deleted")
+        else:
+            new_full_path = _resolve(capri_dir, file_patch.new_path)
+            if file_patch.old_path is None and os.path.exists(new_full_path):
+                raise ValueError(f"File already exists: {file_patch.new_path}")
+            kind = "created" if file_patch.old_path is None else "modified"
+            change = _Change(file_patch.new_path, new_full_path, content, kind)
+
+            if file_patch.copy:
+                if os.path.exists(new_full_path):
+                    raise ValueError(f"File already exists: {file_patch.new_path}")
+                change.kind = "copied"
+            elif file_patch.old_path is not None and file_patch.old_path != file_patch.new_path:
+                # A rename also removes the old file
+                change.kind = "renamed"
+                changes.append(_Change(file_patch.old_path, old_full_path, None, "deleted"))
+
+        changes.append(change)
+
+    for change in changes:
+        if change.full_path in targets:
+            raise ValueError(f"Patch changes {change.path} more than once")
+        targets[change.full_path] = change.path
+
+    return changes
+
+def _rollback(changes: List[_Change]) -> None:
+    for change in reversed(changes):
+        if not change.applied:
+            continue
+        if change.backup_path:
+            os.replace(change.backup_path, change.full_path)
+        elif os.path.exists(change.full_path):
+            os.unlink(change.full_path)
+
+def commit_changes(changes: List[_Change], workers: int = 8) -> None:
+    """
+    Write all changes, or none of them.
+
+    New contents are first written to fsynced temp files in parallel. Then each original is
+    kept as a hard-linked backup while its temp file is renamed over it; if anything fails,
+    every file already swapped is restored from its backup.
+    """
+    writes = [change for change in changes if change.content is not None]
+    try:
+        errors = []
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(writes)))) as executor:
+            futures = {executor.submit(stage_file, change.full_path, change.content): change for change in writes}
+            for future, change in futures.items():
+                try:
+                    change.temp_path = future.result()
+                except Exception as e:
+                    errors.append(e)
+        if errors:
+            raise errors[0]
+
+        try:
+            for change in changes:
+                if os.path.exists(change.full_path):
+                    change.backup_path = f"{change.full_path}.{uuid.uuid4().hex[:8]}.bak"
+                    if change.content is None:
+                        os.replace(change.full_path, change.backup_path)
+                    else:
+                        try:
+                            os.link(change.full_path, change.backup_path)
+                        except OSError:
+                            shutil.copy2(change.full_path, change.backup_path)
+                if change.content is not None:
+                    os.replace(change.temp_path, change.full_path)
+                    change.temp_path = None
+                change.applied = True
+        except BaseException:
+            _rollback(changes)
+            raise
+
+        for directory in {os.path.dirname(change.full_path) for change in changes}:
+            fsync_directory(directory)
+    finally:
+        for change in changes:
+            for leftover in (change.temp_path, change.backup_path):
+                if leftover and os.path.exists(leftover):
+                    os.unlink(leftover)
+            invalidate_path(change.full_path)
+
+def apply_patch_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
+    """Apply a unified diff covering one or more files in the Capri data directory, all or nothing"""
+    try:
+        input_data = json.loads(input_bytes)
+        patch = input_data.get("patch", "")
+        dry_run = input_data.get("dry_run", False)
+
+        if not patch:
+            return "", Exception("No patch provided")
+
+        # Get the Capri data directory
+        capri_dir = get_capri_dir()
+
+        # Validate every hunk before touching any file
+        try:
+            changes = plan_patch(patch, capri_dir)
+        except (ValueError, UnicodeDecodeError) as e:
+            return "", Exception(f"Patch does not apply: {str(e)}")
+
+        summary = "\n".join(f"{change.kind}: {change.path}" for change in changes)
+
+        if dry_run:
+            return f"Patch applies cleanly to {len(changes)} file(s):\n{summary}", None
+
+        try:
+            commit_changes(changes)
+        except OSError as e:
+            return "", Exception(f"Error applying patch, no files were changed: {str(e)}")
+
+        return f"Patch applied to {len(changes)} file(s):\n{summary}", None
+    except Exception as e:
+        return "", e
+
+# Create the tool definition
+apply_patch_tool = ToolDefinition(
+    name="apply_patch",
+    description="Apply a unified diff that may change many files in the Capri data directory in one call. Every hunk is checked first; then all files are written, or none are. Use this instead of several edit_file calls.",
+    input_schema=apply_patch_schema,
+    function=apply_patch_function
+)
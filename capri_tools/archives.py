@@ -0,0 +1,333 @@
+import os
+import shutil
+import stat
+import subprocess
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Dict, List, Optional, Tuple
+from capri_tools.atomic_write import atomic_write
+from capri_tools.list_files import iter_entries
+from capri_tools.progress import ProgressReporter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Archive formats by file name suffix (longest suffixes first)
+FORMAT_SUFFIXES = [
+    (".tar.gz", "tar.gz"), (".tgz", "tar.gz"),
+    (".tar.zst", "tar.zst"), (".tzst", "tar.zst"),
+    (".tar", "tar"),
+    (".zip", "zip")
+]
+FORMATS = ("zip", "tar", "tar.gz", "tar.zst")
+
+# Buffer size for streaming member data
+BUFFER_SIZE = 1024 * 1024
+
+# Compression threads (pigz, zstd) and parallel zip extraction workers
+THREADS = os.cpu_count() or 1
+
+# Already-compressed media is stored in zip archives instead of deflated again, which
+# costs a lot of CPU for almost no gain
+STORED_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+    ".mp4", ".mov", ".mkv", ".webm", ".avi", ".m4v",
+    ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".flac",
+    ".zip", ".gz", ".tgz", ".zst", ".xz", ".bz2", ".7z", ".rar"
+}
+
+def detect_format(path: str) -> Optional[str]:
+    """Archive format implied by a file name, or None"""
+    lower = path.lower()
+    for suffix, archive_format in FORMAT_SUFFIXES:
+        if lower.endswith(suffix):
+            return archive_format
+    return None
+
+def strip_archive_suffix(path: str) -> str:
+    lower = path.lower()
+    for suffix, _archive_format in FORMAT_SUFFIXES:
+        if lower.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+def compression_backend(archive_format: str) -> str:
+    """What does the (de)compression for a format: 'pigz', 'gzip', 'zstandard', 'zstd' or 'none'"""
+    if archive_format == "tar.gz":
+        return "pigz" if shutil.which("pigz") else "gzip"
+    if archive_format == "tar.zst":
+        if zstandard is not None:
+            return "zstandard"
+        if shutil.which("zstd"):
+            return "zstd"
+        raise RuntimeError("zstd archives need the 'zstandard' Python package or the zstd command")
+    return "none"
+
+class _CompressedStream:
+    """
+    A writable or readable byte stream through a compressor running on several threads:
+    zstandard's multithreaded compressor, or pigz/zstd as a subprocess.
+    """
+    def __init__(self, file: IO[bytes], archive_format: str, mode: str, level: Optional[int] = None):
+        self.backend = compression_backend(archive_format)
+        self.process: Optional[subprocess.Popen] = None
+        self.file = file
+
+        if self.backend == "zstandard":
+            if mode == "w":
+                compressor = zstandard.ZstdCompressor(level=level or 3, threads=-1)
+                self.stream = compressor.stream_writer(file, closefd=False)
+            else:
+                self.stream = zstandard.ZstdDecompressor().stream_reader(file, closefd=False, read_size=BUFFER_SIZE)
+        elif self.backend in ("pigz", "zstd"):
+            if mode == "w":
+                command = [self.backend, "-c", f"-{level or (6 if self.backend == 'pigz' else 3)}"]
+                command += ["-p", str(THREADS)] if self.backend == "pigz" else [f"-T{THREADS}"]
+                self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=file)
+                self.stream = self.process.stdin
+            else:
+                command = [self.backend, "-dc"]
+                self.process = subprocess.Popen(command, stdin=file, stdout=subprocess.PIPE)
+                self.stream = self.process.stdout
+        else:
+            # Plain gzip: single-threaded, but still streamed
+            import gzip
+            self.stream = gzip.GzipFile(fileobj=file, mode=mode + "b", compresslevel=level or 6) if mode == "w" else gzip.GzipFile(fileobj=file, mode="rb")
+
+    def close(self) -> None:
+        self.stream.close()
+        if self.process is not None:
+            if self.process.wait() != 0:
+                raise RuntimeError(f"{self.backend} failed with exit code {self.process.returncode}")
+
+def _collect_sources(sources: List[str]) -> List[Tuple[str, str, os.stat_result]]:
+    """(full path, archive name, stat) for every file and directory to archive, named relative to each source's parent"""
+    members = []
+    for source in sources:
+        base_name = os.path.basename(os.path.normpath(source))
+        source_stat = os.lstat(source)
+        members.append((source, base_name, source_stat))
+        if stat.S_ISDIR(source_stat.st_mode):
+            for entry in iter_entries(source, recursive=True, include_hidden=True):
+                try:
+                    members.append((entry.path, f"{base_name}/{entry.relative_path}", os.lstat(entry.path)))
+                except FileNotFoundError:
+                    pass
+    return members
+
+def create_archive(sources: List[str], archive_path: str, archive_format: str, level: Optional[int] = None,
+                   progress_output=print) -> Dict[str, object]:
+    """
+    Write sources (files or directories) into a zip or tar archive, streaming file data.
+
+    The archive is written with atomic_write (a temp file renamed into place when complete,
+    with the usual permissions). Returns counts and the compression backend used.
+    """
+    members = _collect_sources(sources)
+    regular = [member for member in members if stat.S_ISREG(member[2].st_mode)]
+    progress = ProgressReporter(f"Archiving {os.path.basename(archive_path)}", total_items=len(regular),
+                                total_bytes=sum(member[2].st_size for member in regular), output=progress_output)
+
+    backend = "none" if archive_format in ("zip", "tar") else compression_backend(archive_format)
+
+    with atomic_write(archive_path, "wb") as output:
+        if archive_format == "zip":
+            _write_zip(members, output, level, progress)
+        else:
+            stream = _CompressedStream(output, archive_format, "w", level) if archive_format != "tar" else None
+            with tarfile.open(fileobj=stream.stream if stream else output, mode="w|", bufsize=BUFFER_SIZE) as tar:
+                for full_path, name, member_stat in members:
+                    info = tar.gettarinfo(full_path, arcname=name)
+                    if info is None:
+                        # Sockets can't be archived
+                        continue
+                    if info.isreg():
+                        with open(full_path, "rb") as file:
+                            tar.addfile(info, _ProgressReader(file, progress))
+                        progress.advance(items=1)
+                    else:
+                        tar.addfile(info)
+            if stream is not None:
+                stream.close()
+
+    progress.finish()
+    return {
+        "files": len(regular),
+        "bytes": progress.total_bytes,
+        "archive_bytes": os.path.getsize(archive_path),
+        "backend": backend
+    }
+
+def _write_zip(members, output: IO[bytes], level: Optional[int], progress: ProgressReporter) -> None:
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=level or 6, allowZip64=True) as archive:
+        for full_path, name, member_stat in members:
+            if stat.S_ISDIR(member_stat.st_mode):
+                archive.writestr(zipfile.ZipInfo.from_file(full_path, name), b"")
+                continue
+            if not stat.S_ISREG(member_stat.st_mode):
+                # zip has no portable way to store symlinks or devices
+                continue
+
+            info = zipfile.ZipInfo.from_file(full_path, name)
+            info.compress_type = zipfile.ZIP_STORED if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            with open(full_path, "rb") as source, archive.open(info, "w", force_zip64=member_stat.st_size > 2 ** 31) as destination:
+                while True:
+                    chunk = source.read(BUFFER_SIZE)
+                    if not chunk:
+                        break
+                    destination.write(chunk)
+                    progress.advance(size=len(chunk))
+            progress.advance(items=1)
+
+class _ProgressReader:
+    """File wrapper reporting bytes read, for tarfile.addfile"""
+    def __init__(self, file: IO[bytes], progress: ProgressReporter):
+        self.file = file
+        self.progress = progress
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.file.read(size)
+        self.progress.advance(size=len(data))
+        return data
+
+def safe_target(destination: str, name: str) -> str:
+    """
+    Resolve an archive member name inside destination, refusing anything that would land
+    outside it: absolute paths, drive letters, '..' components, or paths through symlinks
+    already in destination that point elsewhere.
+    """
+    normalized = name.replace("\\", "/")
+    if normalized.startswith("/") or (len(normalized) > 1 and normalized[1] == ":"):
+        raise ValueError(f"Archive member has an absolute path: {name}")
+    parts = [part for part in normalized.split("/") if part not in ("", ".")]
+    if ".." in parts:
+        raise ValueError(f"Archive member points outside the destination: {name}")
+
+    root = os.path.realpath(destination)
+    target = os.path.join(root, *parts) if parts else root
+    resolved = os.path.realpath(target)
+    if resolved != root and not resolved.startswith(root + os.sep):
+        raise ValueError(f"Archive member points outside the destination: {name}")
+    return target
+
+def _check_overwrite(target: str, overwrite: bool) -> None:
+    if not overwrite and os.path.lexists(target) and not os.path.isdir(target):
+        raise FileExistsError(f"File already exists: {target} (use overwrite to replace it)")
+
+def extract_archive(archive_path: str, destination: str, archive_format: str, overwrite: bool = False,
+                    progress_output=print) -> Dict[str, object]:
+    """Extract a zip or tar archive into destination, validating every member path first"""
+    os.makedirs(destination, exist_ok=True)
+    if archive_format == "zip":
+        return _extract_zip(archive_path, destination, overwrite, progress_output)
+    return _extract_tar(archive_path, destination, archive_format, overwrite, progress_output)
+
+def _extract_zip(archive_path: str, destination: str, overwrite: bool, progress_output) -> Dict[str, object]:
+    with zipfile.ZipFile(archive_path) as archive:
+        infos = archive.infolist()
+
+    # Validate everything before writing anything
+    plan = []
+    for info in infos:
+        target = safe_target(destination, info.filename)
+        if not info.is_dir():
+            _check_overwrite(target, overwrite)
+        plan.append((info, target))
+
+    for info, target in plan:
+        os.makedirs(target if info.is_dir() else os.path.dirname(target), exist_ok=True)
+
+    files = [(info, target) for info, target in plan if not info.is_dir()]
+    progress = ProgressReporter(f"Extracting {os.path.basename(archive_path)}", total_items=len(files),
+                                total_bytes=sum(info.file_size for info, _target in files), output=progress_output)
+
+    # Members are independent in a zip, so each worker reads its share through its own
+    # handle; decompression releases the GIL. Biggest first, so no worker is left with a
+    # huge file at the end.
+    files.sort(key=lambda member: member[0].file_size, reverse=True)
+    shares: List[List[Tuple[zipfile.ZipInfo, str]]] = [[] for _ in range(max(1, min(THREADS, len(files))))]
+    loads = [0] * len(shares)
+    for member in files:
+        smallest = loads.index(min(loads))
+        shares[smallest].append(member)
+        loads[smallest] += member[0].file_size
+
+    def extract_share(share: List[Tuple[zipfile.ZipInfo, str]]) -> None:
+        with zipfile.ZipFile(archive_path) as archive:
+            for info, target in share:
+                # Replace rather than write into an existing file, which may be a hard link shared with other paths
+                if os.path.lexists(target):
+                    os.unlink(target)
+                with archive.open(info) as source, open(target, "wb") as destination_file:
+                    while True:
+                        chunk = source.read(BUFFER_SIZE)
+                        if not chunk:
+                            break
+                        destination_file.write(chunk)
+                        progress.advance(size=len(chunk))
+                # Keep the archived modification time
+                timestamp = _zip_timestamp(info)
+                os.utime(target, (timestamp, timestamp))
+                mode = (info.external_attr >> 16) & 0o777
+                if mode:
+                    os.chmod(target, mode)
+                progress.advance(items=1)
+
+    with ThreadPoolExecutor(max_workers=len(shares), thread_name_prefix="capri-unzip") as executor:
+        for future in [executor.submit(extract_share, share) for share in shares if share]:
+            future.result()
+
+    progress.finish()
+    return {"files": len(files), "bytes": progress.total_bytes, "backend": "zip"}
+
+def _zip_timestamp(info: zipfile.ZipInfo) -> float:
+    import time
+    return time.mktime(info.date_time + (0, 0, -1))
+
+def _extract_tar(archive_path: str, destination: str, archive_format: str, overwrite: bool, progress_output) -> Dict[str, object]:
+    # The member count isn't known before the end of a streamed tar, so only progress so far is shown
+    progress = ProgressReporter(f"Extracting {os.path.basename(archive_path)}", output=progress_output)
+    backend = compression_backend(archive_format)
+    files = 0
+    size = 0
+
+    with open(archive_path, "rb") as raw:
+        stream = _CompressedStream(raw, archive_format, "r") if archive_format != "tar" else None
+        # Stream mode (r|): members are read in order without seeking or indexing the archive first
+        with tarfile.open(fileobj=stream.stream if stream else raw, mode="r|", bufsize=BUFFER_SIZE) as tar:
+            for member in tar:
+                target = safe_target(destination, member.name)
+                if member.issym() or member.islnk():
+                    # The link target must stay inside the destination too
+                    link_base = os.path.dirname(member.name) if member.issym() else ""
+                    safe_target(destination, os.path.join(link_base, member.linkname))
+                elif not (member.isreg() or member.isdir()):
+                    # Devices, FIFOs: never extracted
+                    continue
+                if not member.isdir():
+                    _check_overwrite(target, overwrite)
+                    if overwrite and os.path.lexists(target):
+                        os.unlink(target)
+
+                _extract_member(tar, member, destination)
+                if member.isreg():
+                    files += 1
+                    size += member.size
+                progress.add_total(items=1 if member.isreg() else 0)
+                progress.advance(items=1 if member.isreg() else 0, size=member.size if member.isreg() else 0)
+        if stream is not None:
+            stream.close()
+
+    progress.finish()
+    return {"files": files, "bytes": size, "backend": backend}
+
+def _extract_member(tar: tarfile.TarFile, member: tarfile.TarInfo, destination: str) -> None:
+    # Python 3.12+ (and security backports) have extraction filters; 'data' also strips
+    # setuid bits and refuses anything unsafe the checks above might have missed
+    if hasattr(tarfile, "data_filter"):
+        tar.extract(member, destination, filter="data")
+    else:
+        tar.extract(member, destination, set_attrs=not member.issym())
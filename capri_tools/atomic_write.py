@@ -0,0 +1,89 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+def fsync_directory(directory: str) -> None:
+    """Make a rename inside a directory durable (no-op where directories can't be opened, e.g. Windows)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _current_umask() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+# Read once at import: os.umask can only be read by setting it, which isn't thread-safe
+_UMASK = _current_umask()
+
+def _apply_target_mode(temp_path: str, path: str) -> None:
+    """Give a temp file the permissions of the file it will replace"""
+    if os.path.exists(path):
+        os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+    else:
+        # mkstemp creates files as 0600; use the usual umask-based mode instead
+        os.chmod(temp_path, 0o666 & ~_UMASK)
+
+@contextmanager
+def atomic_write(path: str, mode: str = 'w', encoding: str = 'utf-8', newline: str = ''):
+    """
+    Write a file through a temp file in the same directory, then fsync and rename it over the target.
+
+    Readers see either the old file or the complete new one, never a truncated file. If
+    the block raises, the target is left untouched and the temp file is removed. An
+    existing target's permissions are kept.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        if 'b' in mode:
+            file = os.fdopen(fd, mode)
+        else:
+            file = os.fdopen(fd, mode, encoding=encoding, newline=newline)
+
+        with file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+
+        _apply_target_mode(temp_path, path)
+
+        os.replace(temp_path, path)
+        fsync_directory(directory)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+def stage_file(path: str, data: bytes) -> str:
+    """
+    Write data to an fsynced temp file next to path and return the temp file's path.
+
+    The caller renames it into place with os.replace (or deletes it), which lets several
+    files be prepared first and then swapped in together.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+
+        _apply_target_mode(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+    return temp_path
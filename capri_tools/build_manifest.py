@@ -0,0 +1,131 @@
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional
+from capri_tools.atomic_write import atomic_write
+from capri_tools.copy_engine import file_digest, MTIME_TOLERANCE
+
+# Name of the manifest file kept in an output directory
+MANIFEST_FILE = ".capri_manifest.json"
+
+MANIFEST_VERSION = 1
+
+class BuildManifest:
+    """
+    Record of which inputs produced which outputs in an output directory, with what settings.
+
+    Each entry maps an input name to its path (relative to the output directory), size, mtime
+    and content hash, the parameters it was processed with and the output files it produced. An input is up to date while its
+    parameters match and its outputs exist, and either its size and mtime are unchanged or,
+    if only the mtime moved, its contents hash the same. So a re-run over a mostly unchanged
+    folder only stats the inputs.
+    """
+    def __init__(self, output_dir: str, params: Dict[str, Any]):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_FILE)
+        self.params = params
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == MANIFEST_VERSION:
+            self.entries = data.get("entries", {})
+
+    def save(self) -> None:
+        with atomic_write(self.path) as file:
+            json.dump({"version": MANIFEST_VERSION, "entries": self.entries}, file, separators=(",", ":"))
+
+    def is_current(self, name: str, input_path: str) -> bool:
+        """Whether the outputs recorded for input name are still valid for input_path"""
+        entry = self.entries.get(name)
+        if entry is None or entry.get("params") != self.params:
+            return False
+        if not all(os.path.exists(os.path.join(self.output_dir, output)) for output in entry.get("outputs", [])):
+            return False
+
+        try:
+            stat = os.stat(input_path)
+        except OSError:
+            return False
+        if stat.st_size != entry.get("size"):
+            return False
+        if abs(stat.st_mtime - entry.get("mtime", 0)) < MTIME_TOLERANCE:
+            return True
+
+        # Touched (or copied without keeping times) but possibly unchanged
+        try:
+            if file_digest(input_path).hex() != entry.get("hash"):
+                return False
+        except OSError:
+            return False
+        entry["mtime"] = stat.st_mtime
+        return True
+
+    def record(self, name: str, input_path: str, outputs: List[str]) -> None:
+        """
+        Remember that input_path (as name) produced outputs (paths relative to the output
+        directory). Outputs it produced before but no longer does are deleted.
+        """
+        for output in set(self.outputs_of(name)) - set(outputs):
+            try:
+                os.unlink(os.path.join(self.output_dir, output))
+            except FileNotFoundError:
+                pass
+        stat = os.stat(input_path)
+        self.entries[name] = {
+            "input": os.path.relpath(input_path, self.output_dir),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "hash": file_digest(input_path).hex(),
+            "params": self.params,
+            "outputs": outputs
+        }
+
+    def outputs_of(self, name: str) -> List[str]:
+        entry = self.entries.get(name)
+        return list(entry.get("outputs", [])) if entry else []
+
+    def input_of(self, name: str) -> Optional[str]:
+        """Full path of the input recorded for name (None for entries from before inputs were recorded)"""
+        entry = self.entries.get(name)
+        if not entry or not entry.get("input"):
+            return None
+        return os.path.normpath(os.path.join(self.output_dir, entry["input"]))
+
+    def remove_missing(self, input_dir: str, dropped: Iterable[str] = ()) -> List[str]:
+        """
+        Forget inputs from input_dir that no longer exist (or whose full paths are in dropped)
+        and delete their outputs, except outputs another entry still produces. Entries made
+        from other directories sharing this output directory are left alone. Returns the
+        deleted output paths.
+        """
+        input_dir = os.path.normpath(input_dir)
+        dropped = {os.path.normpath(path) for path in dropped}
+        gone = []
+        for name in self.entries:
+            input_path = self.input_of(name)
+            if input_path is None or os.path.dirname(input_path) != input_dir:
+                continue
+            if input_path in dropped or not os.path.exists(input_path):
+                gone.append(name)
+
+        removed_entries = [self.entries.pop(name) for name in gone]
+        still_used = set()
+        for name in self.entries:
+            still_used.update(self.outputs_of(name))
+
+        removed = []
+        for entry in removed_entries:
+            for output in entry.get("outputs", []):
+                if output in still_used:
+                    continue
+                try:
+                    os.unlink(os.path.join(self.output_dir, output))
+                    removed.append(output)
+                except FileNotFoundError:
+                    pass
+        return removed
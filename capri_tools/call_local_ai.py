@@ -3,7 +3,8 @@ import os
 from typing import Tuple, Optional, Dict, Any, Union
 from capri_tools.tool_definition import ToolDefinition
 from capri_tools.get_capri_dir import get_capri_dir
-from llama_cpp import Llama
+from capri_tools.local_model_registry import load_local_model
+from capri_tools.grammar_cache import get_grammar_for_response_format
 
 # Schema for call_local_ai tool
 call_local_ai_schema = {
@@ -17,6 +18,16 @@ call_local_ai_schema = {
             "type": "string",
             "description": "Optional. Path to a file containing a prompt template. The template should contain %PROMPT% which will be replaced with the prompt argument."
         },
+        "model": {
+            "type": "string",
+            "description": "Optional. The name of a model in the local model registry. Uses the registry's default model if not provided."
+        },
+        "speculative": {
+            "type": "string",
+            "description": "Optional. Speculative decoding mode: 'prompt_lookup' drafts tokens from n-grams in the prompt (fastest for extraction, where the output copies the input), 'draft_model' uses the small draft model configured in the registry. With temperature 0 the output is the same as plain decoding; when sampling it only differs as another sample would.",
+            "enum": ["none", "prompt_lookup", "draft_model"],
+            "default": "none"
+        },
         "system_prompt": {
             "type": "string",
             "description": "Optional. The system prompt to use.",
@@ -78,6 +89,8 @@ def call_local_ai_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]
         # Extract parameters with defaults
         prompt = input_data.get("prompt", "")
         prompt_template_path = input_data.get("prompt_template", "")
+        model_name = input_data.get("model", None)
+        speculative = input_data.get("speculative", "none")
         system_prompt = input_data.get("system_prompt", "You are a helpful assistant.")
         n_ctx = input_data.get("n_ctx", 2048)
         max_tokens = input_data.get("max_tokens", 2048)
@@ -108,13 +121,8 @@ def call_local_ai_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]
             except Exception as e:
                 return "", Exception(f"Error processing prompt template: {str(e)}")
         
-        # Initialize the Llama model
-        llm = Llama(
-            model_path="/home/sergiuf/.cache/huggingface/hub/models--bartowski--NousResearch_DeepHermes-3-Llama-3-3B-Preview-GGUF/snapshots/ff767d7602d37096a8593ce7e31d7a19cc9a7182/./NousResearch_DeepHermes-3-Llama-3-3B-Preview-Q8_0.gguf",
-            chat_format="chatml",
-            n_ctx=n_ctx,
-            verbose=False,
-        )
+        # Load the model from the local model registry (tuned for this machine, reused between calls)
+        llm = load_local_model(model_name, chat_format="chatml", n_ctx=n_ctx, speculative=speculative)
         
         # Prepare the messages for the chat completion
         messages = [
@@ -135,9 +143,14 @@ def call_local_ai_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]
             "max_tokens": max_tokens
         }
         
-        # Add response_format if provided
+        # Constrain the output with a cached grammar instead of passing response_format,
+        # so the schema isn't converted to a grammar again on every call
         if response_format:
-            completion_args["response_format"] = response_format
+            grammar = get_grammar_for_response_format(response_format)
+            if grammar is not None:
+                completion_args["grammar"] = grammar
+            else:
+                completion_args["response_format"] = response_format
         
         # Call the model
         response = llm.create_chat_completion(**completion_args)
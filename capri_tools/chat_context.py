@@ -0,0 +1,182 @@
+import json
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# Tokens the chat template adds around every message (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# When the history overflows, trim it down to this fraction of the budget so trimming
+# (and the prompt re-processing it causes) happens once in a while, not on every turn
+LOW_WATER_MARK = 0.7
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+SUMMARIZE_PROMPT = (
+    "Summarize the conversation below in a few sentences for your own future reference. "
+    "Keep names, file paths, decisions and open questions. Leave out pleasantries."
+)
+
+class ChatContext:
+    """
+    Token-aware sliding window over a llama.cpp chat history.
+
+    The system prompt and the tool definitions are pinned. When the rest of the history no
+    longer fits in the model's context window, the oldest whole turns (a user message and
+    the assistant/tool messages that answer it) are dropped and, optionally, folded into a
+    running summary written by the local model. Tool results are capped before they are
+    stored, so one large file read can't crowd out the conversation.
+    """
+    def __init__(self, model, tools: Optional[List[Dict[str, Any]]] = None, reserve_tokens: int = 512,
+                 max_tool_result_tokens: int = 1024, summarize: bool = True, summary_max_tokens: int = 256):
+        self.model = model
+        self.tools = tools or []
+        self.reserve_tokens = reserve_tokens
+        self.max_tool_result_tokens = max_tool_result_tokens
+        self.summarize = summarize
+        self.summary_max_tokens = summary_max_tokens
+        self.summary = ""
+        self._token_counts: "OrderedDict[str, int]" = OrderedDict()
+        self._tools_tokens = self.count_text_tokens(json.dumps(self.tools)) if self.tools else 0
+
+    def reset(self) -> None:
+        """Forget the running summary (e.g. when the conversation is cleared)"""
+        self.summary = ""
+
+    def count_text_tokens(self, text: str) -> int:
+        """Count tokens with the model's own tokenizer; results are memoized since history is re-counted every turn"""
+        if not text:
+            return 0
+
+        count = self._token_counts.get(text)
+        if count is not None:
+            self._token_counts.move_to_end(text)
+            return count
+
+        count = len(self.model.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+        self._token_counts[text] = count
+        if len(self._token_counts) > 4096:
+            self._token_counts.popitem(last=False)
+        return count
+
+    def count_message_tokens(self, message: Dict[str, Any]) -> int:
+        tokens = MESSAGE_OVERHEAD_TOKENS + self.count_text_tokens(message.get("content") or "")
+        if message.get("tool_calls"):
+            tokens += self.count_text_tokens(json.dumps(message["tool_calls"]))
+        return tokens
+
+    @property
+    def budget(self) -> int:
+        """Tokens available for the history after the pinned tool definitions and the reply"""
+        return self.model.n_ctx() - self.reserve_tokens - self._tools_tokens
+
+    def cap_tool_result(self, text: str) -> str:
+        """Shorten a tool result to max_tool_result_tokens, keeping its beginning and end"""
+        if not isinstance(text, str):
+            return text
+
+        tokens = self.model.tokenize(text.encode("utf-8"), add_bos=False, special=False)
+        if len(tokens) <= self.max_tool_result_tokens:
+            return text
+
+        head = self.max_tool_result_tokens * 3 // 4
+        tail = self.max_tool_result_tokens - head
+        head_text = self.model.detokenize(tokens[:head]).decode("utf-8", errors="ignore")
+        tail_text = self.model.detokenize(tokens[-tail:]).decode("utf-8", errors="ignore")
+        omitted = len(tokens) - head - tail
+        return f"{head_text}\n[... {omitted} tokens omitted ...]\n{tail_text}"
+
+    def _split_turns(self, messages: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        turns: List[List[Dict[str, Any]]] = []
+        for message in messages:
+            if message["role"] == "user" or not turns:
+                turns.append([message])
+            else:
+                turns[-1].append(message)
+        return turns
+
+    def _summary_message(self) -> List[Dict[str, Any]]:
+        if not self.summary:
+            return []
+        return [{"role": "system", "content": SUMMARY_PREFIX + self.summary}]
+
+    def _update_summary(self, dropped: List[Dict[str, Any]]) -> None:
+        transcript = []
+        for message in dropped:
+            content = message.get("content") or ""
+            if message.get("tool_calls"):
+                content += " [called: " + ", ".join(tc["function"]["name"] for tc in message["tool_calls"]) + "]"
+            transcript.append(f"{message['role']}: {content}")
+
+        text = "\n".join(transcript)
+        if self.summary:
+            text = f"Earlier summary: {self.summary}\n\n{text}"
+
+        # Never let the summarization prompt itself overflow the window
+        text = self.cap_text(text, self.budget - self.summary_max_tokens)
+
+        try:
+            response = self.model.create_chat_completion(
+                messages=[
+                    {"role": "system", "content": SUMMARIZE_PROMPT},
+                    {"role": "user", "content": text}
+                ],
+                max_tokens=self.summary_max_tokens,
+                temperature=0.2
+            )
+            self.summary = response["choices"][0]["message"]["content"].strip()
+        except Exception:
+            # Trimming must not fail the chat; fall back to plain truncation
+            pass
+
+    def cap_text(self, text: str, max_tokens: int) -> str:
+        """Keep the last max_tokens tokens of a text"""
+        tokens = self.model.tokenize(text.encode("utf-8"), add_bos=False, special=False)
+        if len(tokens) <= max_tokens:
+            return text
+        return self.model.detokenize(tokens[-max(max_tokens, 1):]).decode("utf-8", errors="ignore")
+
+    def fit(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Return the history trimmed to fit the context window.
+
+        messages[0] must be the system prompt. Any previous summary message is replaced by the
+        current one. The latest turn is always kept.
+        """
+        system = messages[0]
+        history = [
+            message for message in messages[1:]
+            if not (message["role"] == "system" and (message.get("content") or "").startswith(SUMMARY_PREFIX))
+        ]
+
+        def total(turns: List[List[Dict[str, Any]]]) -> int:
+            pinned = [system] + self._summary_message()
+            return sum(self.count_message_tokens(m) for m in pinned) + \
+                sum(self.count_message_tokens(m) for turn in turns for m in turn)
+
+        turns = self._split_turns(history)
+        if total(turns) <= self.budget:
+            return [system] + self._summary_message() + history
+
+        target = int(self.budget * LOW_WATER_MARK)
+        dropped: List[Dict[str, Any]] = []
+        while len(turns) > 1 and total(turns) > target:
+            dropped.extend(turns.pop(0))
+
+        if dropped and self.summarize:
+            self._update_summary(dropped)
+
+        # A single huge turn still has to fit; shorten its largest messages as a last resort
+        kept = [m for turn in turns for m in turn]
+        while total([kept]) > self.budget:
+            largest = max(range(len(kept)), key=lambda i: self.count_message_tokens(kept[i]))
+            message = dict(kept[largest])
+            excess = total([kept]) - self.budget
+            current = self.count_text_tokens(message.get("content") or "")
+            if current <= 1:
+                break
+            message["content"] = self.cap_text(message["content"], max(current - excess - 1, 1))
+            if message["content"] == kept[largest].get("content"):
+                break
+            kept[largest] = message
+
+        return [system] + self._summary_message() + kept
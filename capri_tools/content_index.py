@@ -0,0 +1,309 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from capri_tools.get_capri_dir import get_capri_dir, get_capri_state_dir
+from capri_tools.copy_engine import file_digest, link_file
+from capri_tools.list_files import iter_entries
+from capri_tools.tool_metrics import register_metrics
+
+# Name of the content index database inside the Capri state directory
+CONTENT_DATABASE_FILE = "content_index.sqlite3"
+
+# Relative paths under this directory are Capri's own state (trash, indexes) and never deduplicated
+STATE_DIR_NAME = ".capri"
+
+# Same-size files bigger than this are first compared on a hash of their first bytes,
+# so files that differ early are never read in full
+PREFIX_HASH_MIN_SIZE = 1024 * 1024
+PREFIX_HASH_BYTES = 64 * 1024
+
+# Files hashed at once; hashlib releases the GIL while hashing, so threads run in parallel
+HASH_WORKERS = os.cpu_count() or 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contents (
+    path TEXT PRIMARY KEY,
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS contents_digest ON contents(digest);
+"""
+
+class FileInfo:
+    """A regular file found while scanning, with the stat fields the index is keyed on"""
+    __slots__ = ("path", "relative_path", "device", "inode", "size", "mtime_ns", "digest")
+
+    def __init__(self, path: str, relative_path: str, stat: os.stat_result):
+        self.path = path
+        self.relative_path = relative_path
+        self.device = stat.st_dev
+        self.inode = stat.st_ino
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.digest: Optional[bytes] = None
+
+    @property
+    def key(self) -> Tuple[int, int, int, int]:
+        return (self.device, self.inode, self.size, self.mtime_ns)
+
+class DuplicateGroup:
+    """Files with identical contents; files[0] is the copy that is kept"""
+    def __init__(self, digest: bytes, size: int, files: List[FileInfo]):
+        self.digest = digest
+        self.size = size
+        self.files = files
+
+    @property
+    def reclaimable(self) -> int:
+        """Bytes freed by linking every other file to the first: one size per distinct inode beyond the first"""
+        inodes = {(file.device, file.inode) for file in self.files}
+        return (len(inodes) - 1) * self.size
+
+class ContentIndex:
+    """
+    Content digests of files in the Capri data directory, cached in SQLite.
+
+    A cached digest is reused while the file's (device, inode, size, mtime) is unchanged, so
+    rescanning a large library only reads files that are new or were modified.
+    """
+    def __init__(self, root: Optional[str] = None, database_path: Optional[str] = None):
+        self.root = root or get_capri_dir()
+        self.database_path = database_path or os.path.join(get_capri_state_dir(), CONTENT_DATABASE_FILE)
+        self.cache_hits = 0
+        self.hashed_files = 0
+        self.hashed_bytes = 0
+        self._lock = threading.Lock()
+
+        connection = self.connect()
+        try:
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.database_path, timeout=30, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def scan(self, directory: str, min_size: int = 1) -> List[FileInfo]:
+        """Regular files of at least min_size bytes below directory, skipping Capri's state directory"""
+        files = []
+        for entry in iter_entries(directory, recursive=True, include_hidden=True):
+            if entry.is_dir:
+                continue
+            full_path = entry.path
+            relative_path = os.path.relpath(full_path, self.root).replace(os.sep, "/")
+            if relative_path == STATE_DIR_NAME or relative_path.startswith(STATE_DIR_NAME + "/"):
+                continue
+            stat = entry.stat()
+            if stat is None or not os.path.isfile(full_path) or os.path.islink(full_path) or stat.st_size < min_size:
+                continue
+            files.append(FileInfo(full_path, relative_path, stat))
+        return files
+
+    def hash_files(self, files: List[FileInfo], workers: int = HASH_WORKERS) -> None:
+        """Fill in file.digest for every file, from the cache where it's still valid, hashing the rest in parallel"""
+        connection = self.connect()
+        try:
+            cached: Dict[str, Tuple[Tuple[int, int, int, int], bytes]] = {}
+            paths = [file.relative_path for file in files]
+            # Looked up in slices to stay under SQLite's variable limit
+            for start in range(0, len(paths), 500):
+                chunk = paths[start:start + 500]
+                for path, device, inode, size, mtime_ns, digest in connection.execute(
+                    f"SELECT path, device, inode, size, mtime_ns, digest FROM contents WHERE path IN ({', '.join('?' * len(chunk))})", chunk
+                ):
+                    cached[path] = ((device, inode, size, mtime_ns), digest)
+
+            # Hard links share contents: hash each inode once
+            by_inode: Dict[Tuple[int, int, int, int], List[FileInfo]] = {}
+            for file in files:
+                entry = cached.get(file.relative_path)
+                if entry is not None and entry[0] == file.key:
+                    file.digest = entry[1]
+                    self.cache_hits += 1
+                else:
+                    by_inode.setdefault(file.key, []).append(file)
+
+            # Another path to the same inode may already have a valid cached digest
+            known = {file.key: file.digest for file in files if file.digest is not None}
+            for key, linked in by_inode.items():
+                for file in linked:
+                    file.digest = known.get(key)
+
+            pending = [linked for linked in by_inode.values() if linked[0].digest is None]
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="capri-hash") as executor:
+                for linked, digest in zip(pending, executor.map(lambda linked: self._digest(linked[0]), pending)):
+                    for file in linked:
+                        file.digest = digest
+
+            rows = [
+                (file.relative_path, file.device, file.inode, file.size, file.mtime_ns, file.digest)
+                for linked in by_inode.values() for file in linked if file.digest is not None
+            ]
+            connection.executemany(
+                "INSERT OR REPLACE INTO contents (path, device, inode, size, mtime_ns, digest) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _digest(self, file: FileInfo) -> Optional[bytes]:
+        try:
+            digest = file_digest(file.path)
+        except OSError:
+            return None
+        with self._lock:
+            self.hashed_files += 1
+            self.hashed_bytes += file.size
+        return digest
+
+    def prune(self, directory: str, existing: List[FileInfo]) -> None:
+        """Forget cached digests of files below directory that no longer exist"""
+        prefix = os.path.relpath(directory, self.root).replace(os.sep, "/")
+        seen = {file.relative_path for file in existing}
+        connection = self.connect()
+        try:
+            if prefix == ".":
+                rows = connection.execute("SELECT path FROM contents")
+            else:
+                rows = connection.execute("SELECT path FROM contents WHERE path >= ? AND path < ?", (prefix + "/", prefix + "0"))
+            gone = [(path,) for (path,) in rows if path not in seen]
+            connection.executemany("DELETE FROM contents WHERE path = ?", gone)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def find_duplicates(self, directory: str, min_size: int = 1, workers: int = HASH_WORKERS) -> Tuple[List[DuplicateGroup], int]:
+        """
+        Find groups of identical files below directory. Returns (groups sorted by reclaimable
+        bytes, number of files scanned).
+
+        Only files sharing their size with another file can be duplicates, and large ones
+        must also share a hash of their first 64 KB, so most files are never read in full.
+        """
+        files = self.scan(directory, min_size)
+        self.prune(directory, files)
+
+        by_size: Dict[int, List[FileInfo]] = {}
+        for file in files:
+            by_size.setdefault(file.size, []).append(file)
+
+        candidates: List[FileInfo] = []
+        prefix_checks: List[List[FileInfo]] = []
+        for size, same_size in by_size.items():
+            if len({(file.device, file.inode) for file in same_size}) < 2:
+                continue
+            if size >= PREFIX_HASH_MIN_SIZE:
+                prefix_checks.append(same_size)
+            else:
+                candidates.extend(same_size)
+
+        if prefix_checks:
+            flat = [file for group in prefix_checks for file in group]
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="capri-hash") as executor:
+                prefixes = list(executor.map(lambda file: _prefix_digest(file.path), flat))
+            by_prefix: Dict[Tuple[int, Optional[bytes]], List[FileInfo]] = {}
+            for file, prefix in zip(flat, prefixes):
+                by_prefix.setdefault((file.size, prefix), []).append(file)
+            for (_size, prefix), same_prefix in by_prefix.items():
+                if prefix is not None and len({(file.device, file.inode) for file in same_prefix}) >= 2:
+                    candidates.extend(same_prefix)
+
+        self.hash_files(candidates, workers)
+
+        by_digest: Dict[Tuple[int, bytes], List[FileInfo]] = {}
+        for file in candidates:
+            if file.digest is not None:
+                by_digest.setdefault((file.size, file.digest), []).append(file)
+
+        groups = []
+        for (size, digest), same in by_digest.items():
+            # Keep the oldest copy; others are linked to it
+            same.sort(key=lambda file: (file.mtime_ns, file.relative_path))
+            group = DuplicateGroup(digest, size, same)
+            if group.reclaimable > 0:
+                groups.append(group)
+
+        groups.sort(key=lambda group: group.reclaimable, reverse=True)
+        return groups, len(files)
+
+    def stats(self) -> Dict[str, int]:
+        connection = self.connect()
+        try:
+            entries = connection.execute("SELECT COUNT(*) FROM contents").fetchone()[0]
+        finally:
+            connection.close()
+        return {
+            "entries": entries,
+            "cache_hits": self.cache_hits,
+            "hashed_files": self.hashed_files,
+            "hashed_bytes": self.hashed_bytes
+        }
+
+def _prefix_digest(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as file:
+            return hashlib.blake2b(file.read(PREFIX_HASH_BYTES), digest_size=16).digest()
+    except OSError:
+        return None
+
+def _unchanged(file: FileInfo) -> bool:
+    """Whether a file is still the one that was scanned: same inode, size and mtime"""
+    stat = os.stat(file.path)
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns) == (file.device, file.inode, file.size, file.mtime_ns)
+
+def deduplicate(groups: List[DuplicateGroup], mode: str) -> Tuple[int, int, List[Tuple[str, str]]]:
+    """
+    Replace duplicates with hard links or reflinks to the first file of their group.
+
+    Each replacement is an atomic rename, so a failure leaves the original file in place.
+    Files on another filesystem than the kept copy are left alone. Returns (files linked,
+    bytes reclaimed, errors).
+    """
+    linked = 0
+    reclaimed = 0
+    errors: List[Tuple[str, str]] = []
+    for group in groups:
+        keep = group.files[0]
+        for file in group.files[1:]:
+            if (file.device, file.inode) == (keep.device, keep.inode):
+                continue
+            if file.device != keep.device:
+                errors.append((file.relative_path, "on a different filesystem than the kept copy"))
+                continue
+            try:
+                # Check neither file was changed since it was hashed; the kept copy is checked
+                # before every link, since it is what the duplicate is replaced with
+                if not _unchanged(keep):
+                    errors.append((file.relative_path, f"kept copy {keep.relative_path} changed since it was scanned"))
+                    continue
+                if not _unchanged(file):
+                    errors.append((file.relative_path, "changed since it was scanned"))
+                    continue
+                link_file(keep.path, file.path, mode)
+                linked += 1
+                reclaimed += group.size
+            except OSError as e:
+                errors.append((file.relative_path, str(e)))
+    return linked, reclaimed, errors
+
+_content_index: Optional[ContentIndex] = None
+_content_index_lock = threading.Lock()
+
+def get_content_index() -> ContentIndex:
+    """Return the shared content index of the Capri data directory"""
+    global _content_index
+    with _content_index_lock:
+        if _content_index is None:
+            _content_index = ContentIndex()
+            register_metrics("content_index", _content_index.stats)
+        return _content_index
@@ -0,0 +1,363 @@
+import errno
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from capri_tools.list_files import iter_entries
+from capri_tools.progress import ProgressReporter
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+# ioctl number of FICLONE (Linux): share the source's extents instead of copying data
+FICLONE = 0x40049409
+
+# Files are copied into destination + PART_SUFFIX and renamed when complete
+PART_SUFFIX = ".part"
+
+# Bytes handed to copy_file_range/sendfile per call; also how often progress is updated
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Buffer for the plain read/write fallback
+BUFFER_SIZE = 1024 * 1024
+
+# Bytes at the end of a .part file compared with the source before resuming from it
+RESUME_CHECK_BYTES = 64 * 1024
+
+# Modification times closer than this count as equal; some filesystems (ext3, FAT, SMB)
+# store them with coarser precision than the source had
+MTIME_TOLERANCE = 1.0
+
+# Files copied at once; copies mostly wait on the kernel, so this can exceed the CPU count
+DEFAULT_WORKERS = min(8, 2 * (os.cpu_count() or 1))
+
+# Errors meaning "this kernel/filesystem can't do that", after which the next method is tried
+_UNSUPPORTED = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOTTY, errno.EBADF, errno.ENOTSOCK, errno.EPERM}
+
+# Environment variable making copies share storage with their source: "reflink"
+# (copy-on-write clones only, never a full copy), "hardlink" (copies become hard links, so
+# writing into either file changes both; most tools, Capri's image and FFmpeg ones included,
+# overwrite their output in place) or "off" (default)
+DEDUP_ENV = "CAPRI_DEDUP"
+DEDUP_MODES = ("off", "hardlink", "reflink")
+
+# (source device, destination device) pairs where reflinks failed, so they aren't retried per file
+_no_reflink: set = set()
+_no_reflink_lock = threading.Lock()
+
+class CopyStats:
+    """Counters for one copy operation"""
+    def __init__(self):
+        self.copied = 0
+        self.skipped = 0
+        self.resumed = 0
+        self.bytes_copied = 0
+        self.directories = 0
+        self.symlinks = 0
+        self.methods: Dict[str, int] = {}
+        self.errors: List[Tuple[str, str]] = []
+        self._lock = threading.Lock()
+
+    def record(self, method: str, size: int, resumed: bool) -> None:
+        with self._lock:
+            self.copied += 1
+            self.bytes_copied += size
+            self.resumed += int(resumed)
+            self.methods[method] = self.methods.get(method, 0) + 1
+
+    def record_skip(self) -> None:
+        with self._lock:
+            self.skipped += 1
+
+    def record_error(self, path: str, error: Exception) -> None:
+        with self._lock:
+            self.errors.append((path, str(error)))
+
+def dedup_mode() -> str:
+    mode = os.environ.get(DEDUP_ENV, "off").lower()
+    return mode if mode in DEDUP_MODES else "off"
+
+def link_file(source: str, destination: str, mode: str) -> None:
+    """
+    Atomically replace (or create) destination with a hard link to, or a reflink clone of,
+    source. Both must be on the same filesystem; raises OSError otherwise or if the
+    filesystem can't reflink.
+    """
+    directory = os.path.dirname(os.path.abspath(destination))
+    os.makedirs(directory, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(destination)}.", suffix=".tmp", dir=directory)
+    try:
+        if mode == "hardlink":
+            os.close(fd)
+            os.unlink(temp_path)
+            os.link(source, temp_path)
+        else:
+            with os.fdopen(fd, "wb") as clone, open(source, "rb") as original:
+                if fcntl is None:
+                    raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+                fcntl.ioctl(clone.fileno(), FICLONE, original.fileno())
+            shutil.copystat(source, temp_path)
+        os.replace(temp_path, destination)
+    except BaseException:
+        if os.path.lexists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+def file_digest(path: str) -> bytes:
+    """BLAKE2b digest of a file's contents"""
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as file:
+        buffer = bytearray(BUFFER_SIZE)
+        view = memoryview(buffer)
+        while True:
+            read = file.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+    return digest.digest()
+
+def is_unchanged(source_stat: os.stat_result, destination: str, checksum: bool = False, source: Optional[str] = None) -> bool:
+    """
+    Whether destination already matches the source, rsync-style: same size and mtime, or
+    with checksum, same size and contents (mtime ignored).
+    """
+    try:
+        destination_stat = os.stat(destination)
+    except OSError:
+        return False
+
+    if not stat.S_ISREG(destination_stat.st_mode) or destination_stat.st_size != source_stat.st_size:
+        return False
+
+    if checksum:
+        return file_digest(source) == file_digest(destination)
+
+    return abs(destination_stat.st_mtime - source_stat.st_mtime) < MTIME_TOLERANCE
+
+def _try_reflink(source_fd: int, destination_fd: int, devices: Tuple[int, int]) -> bool:
+    if fcntl is None or devices in _no_reflink:
+        return False
+    try:
+        fcntl.ioctl(destination_fd, FICLONE, source_fd)
+        return True
+    except OSError as e:
+        if e.errno in _UNSUPPORTED:
+            with _no_reflink_lock:
+                _no_reflink.add(devices)
+            return False
+        raise
+
+def _copy_range(source_fd: int, destination_fd: int, position: int, size: int, progress: Optional[ProgressReporter]) -> str:
+    """Copy bytes [position, size) with the fastest method that works here; returns its name"""
+    method = "copy_file_range"
+    while position < size:
+        count = min(COPY_CHUNK_SIZE, size - position)
+        try:
+            if method == "copy_file_range":
+                copied = os.copy_file_range(source_fd, destination_fd, count, position, position)
+            elif method == "sendfile":
+                # sendfile writes at the destination's file position
+                os.lseek(destination_fd, position, os.SEEK_SET)
+                copied = os.sendfile(destination_fd, source_fd, position, count)
+            else:
+                copied = _read_write(source_fd, destination_fd, position, count)
+        except (OSError, AttributeError) as e:
+            # AttributeError: no copy_file_range (Python < 3.8 or not Linux) or no sendfile
+            if isinstance(e, OSError) and e.errno not in _UNSUPPORTED:
+                raise
+            if method == "copy_file_range":
+                method = "sendfile"
+            elif method == "sendfile":
+                method = "read_write"
+            else:
+                raise
+            continue
+
+        if copied == 0:
+            # The source shrank while copying; the .part file would be truncated
+            raise OSError(errno.EIO, "Source file changed during the copy")
+        position += copied
+        if progress is not None:
+            progress.advance(size=copied)
+    return method
+
+def _read_write(source_fd: int, destination_fd: int, position: int, count: int) -> int:
+    os.lseek(source_fd, position, os.SEEK_SET)
+    os.lseek(destination_fd, position, os.SEEK_SET)
+    data = os.read(source_fd, min(count, BUFFER_SIZE))
+    view = memoryview(data)
+    while view:
+        written = os.write(destination_fd, view)
+        view = view[written:]
+    return len(data)
+
+def _resume_offset(source_file, part_path: str, source_stat: os.stat_result) -> int:
+    """Where an interrupted copy can continue, or 0 if the .part file can't be trusted"""
+    try:
+        part_stat = os.stat(part_path)
+    except OSError:
+        return 0
+
+    # The source changed after the partial copy was written, or the part is bigger than the source
+    if part_stat.st_size > source_stat.st_size or part_stat.st_mtime < source_stat.st_mtime:
+        return 0
+
+    offset = part_stat.st_size
+    check = min(RESUME_CHECK_BYTES, offset)
+    if check:
+        with open(part_path, "rb") as part:
+            part.seek(offset - check)
+            tail = part.read(check)
+        source_file.seek(offset - check)
+        if source_file.read(check) != tail:
+            return 0
+    return offset
+
+def copy_file(source: str, destination: str, progress: Optional[ProgressReporter] = None, resume: bool = True) -> Tuple[str, bool]:
+    """
+    Copy one file with its metadata, returning (method, resumed).
+
+    With CAPRI_DEDUP set, the copy becomes a hard link or reflink of the source when both are
+    on the same filesystem. Otherwise it tries a reflink first (instant, shares storage on
+    Btrfs/XFS), then copy_file_range and sendfile (copied in the kernel), then plain reads
+    and writes. Data goes into a .part file that is renamed over the destination when
+    complete; if a previous copy was interrupted, it continues from the end of the .part file.
+    """
+    directory = os.path.dirname(os.path.abspath(destination))
+    os.makedirs(directory, exist_ok=True)
+    part_path = destination + PART_SUFFIX
+
+    # With dedup on, a copy on the same filesystem is a link to the same data, which is instant
+    mode = dedup_mode()
+    if mode != "off" and os.stat(source).st_dev == os.stat(directory).st_dev:
+        try:
+            link_file(source, destination, mode)
+            if progress is not None:
+                progress.advance(size=os.stat(source).st_size)
+            return mode, False
+        except OSError:
+            pass
+
+    with open(source, "rb") as source_file:
+        source_fd = source_file.fileno()
+        source_stat = os.fstat(source_fd)
+        size = source_stat.st_size
+
+        offset = _resume_offset(source_file, part_path, source_stat) if resume else 0
+        resumed = offset > 0
+
+        with open(part_path, "r+b" if resumed else "wb") as part_file:
+            destination_fd = part_file.fileno()
+            devices = (source_stat.st_dev, os.fstat(destination_fd).st_dev)
+
+            if not resumed and size and _try_reflink(source_fd, destination_fd, devices):
+                method = "reflink"
+                if progress is not None:
+                    progress.advance(size=size)
+            else:
+                if progress is not None and offset:
+                    progress.advance(size=offset)
+                method = _copy_range(source_fd, destination_fd, offset, size, progress) if size else "empty"
+
+    shutil.copystat(source, part_path)
+    os.replace(part_path, destination)
+    return method, resumed
+
+def _copy_one(source: str, destination: str, source_stat: os.stat_result, incremental: bool, checksum: bool,
+              stats: CopyStats, progress: Optional[ProgressReporter], verify: bool = False) -> None:
+    try:
+        if incremental and is_unchanged(source_stat, destination, checksum, source):
+            stats.record_skip()
+            if progress is not None:
+                progress.advance(items=1, size=source_stat.st_size)
+            return
+
+        method, resumed = copy_file(source, destination, progress)
+        if verify and file_digest(source) != file_digest(destination):
+            os.unlink(destination)
+            raise OSError(errno.EIO, "Copy does not match the source after verification")
+        stats.record(method, source_stat.st_size, resumed)
+        if progress is not None:
+            progress.advance(items=1)
+    except OSError as e:
+        stats.record_error(source, e)
+
+def copy_path(source: str, destination: str, incremental: bool = False, checksum: bool = False,
+              workers: int = DEFAULT_WORKERS, progress_output=print, verify: bool = False,
+              label: str = "Copying") -> CopyStats:
+    """
+    Copy a file or a directory tree, many files at a time.
+
+    With incremental, files whose size and mtime (or contents, with checksum) already match
+    are skipped, which also makes an interrupted copy resumable by running it again. With
+    verify, every copied file is read back and compared with the source, and a mismatch is
+    deleted and reported as an error. Symlinks are recreated as symlinks. Per-file errors
+    are collected in the returned stats.
+    """
+    stats = CopyStats()
+
+    if not os.path.isdir(source) or os.path.islink(source):
+        source_stat = os.stat(source)
+        progress = ProgressReporter(f"{label} {os.path.basename(source)}", total_items=1, total_bytes=source_stat.st_size, output=progress_output)
+        _copy_one(source, destination, source_stat, incremental, checksum, stats, progress, verify)
+        progress.finish()
+        return stats
+
+    # Create the directory tree first (parents are always listed before their contents),
+    # then copy the files in parallel
+    os.makedirs(destination, exist_ok=True)
+    directories = [(source, destination)]
+    files: List[Tuple[str, str, os.stat_result]] = []
+    for entry in iter_entries(source, recursive=True, include_hidden=True):
+        target = os.path.join(destination, entry.relative_path)
+        try:
+            if os.path.islink(entry.path):
+                link = os.readlink(entry.path)
+                if os.path.islink(target) and os.readlink(target) == link:
+                    continue
+                if os.path.lexists(target):
+                    os.remove(target)
+                os.symlink(link, target)
+                stats.symlinks += 1
+            elif entry.is_dir:
+                os.makedirs(target, exist_ok=True)
+                directories.append((entry.path, target))
+                stats.directories += 1
+            else:
+                entry_stat = entry.stat()
+                if entry_stat is not None and stat.S_ISREG(entry_stat.st_mode):
+                    files.append((entry.path, target, entry_stat))
+        except OSError as e:
+            stats.record_error(entry.path, e)
+
+    progress = ProgressReporter(f"{label} {os.path.basename(os.path.normpath(source))}", total_items=len(files),
+                                total_bytes=sum(file_stat.st_size for _source, _target, file_stat in files), output=progress_output)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="capri-copy") as executor:
+        futures = [
+            (file_source, executor.submit(_copy_one, file_source, file_target, file_stat, incremental, checksum, stats, progress, verify))
+            for file_source, file_target, file_stat in files
+        ]
+    # _copy_one records OSErrors itself; anything else would otherwise be lost with its future
+    for file_source, future in futures:
+        error = future.exception()
+        if error is not None:
+            stats.record_error(file_source, error)
+
+    # Directory times last, since creating files inside them changed their mtime
+    for directory_source, directory_target in reversed(directories):
+        try:
+            shutil.copystat(directory_source, directory_target)
+        except OSError:
+            pass
+
+    progress.finish()
+    return stats
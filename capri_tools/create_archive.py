@@ -0,0 +1,96 @@
+import json
+import os
+from typing import Tuple, Optional
+from capri_tools.tool_definition import ToolDefinition
+from capri_tools.get_capri_dir import get_capri_dir
+from capri_tools.file_cache import invalidate_path
+from capri_tools.archives import FORMATS, detect_format, create_archive
+from capri_tools.progress import format_bytes
+
+# Schema for create_archive tool
+create_archive_schema = {
+    "type": "object",
+    "properties": {
+        "source_paths": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "Relative paths of the files and directories to put in the archive."
+        },
+        "archive_path": {
+            "type": "string",
+            "description": "Relative path of the archive to create, e.g. 'exports/clips.zip' or 'exports/project.tar.zst'."
+        },
+        "format": {
+            "type": "string",
+            "enum": list(FORMATS),
+            "description": "Optional. Archive format; by default it follows the archive_path extension (.zip, .tar, .tar.gz/.tgz, .tar.zst/.tzst)."
+        },
+        "level": {
+            "type": "integer",
+            "description": "Optional. Compression level (zip/gzip: 1-9, zstd: 1-19). Default: 6 for zip/gzip, 3 for zstd."
+        },
+        "overwrite": {
+            "type": "boolean",
+            "description": "Optional. Replace archive_path if it already exists (default: false)."
+        }
+    },
+    "required": ["source_paths", "archive_path"]
+}
+
+def create_archive_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
+    """Create a zip or tar archive from files and directories in the Capri data directory"""
+    try:
+        input_data = json.loads(input_bytes)
+        source_paths = input_data.get("source_paths") or []
+        archive_path = input_data.get("archive_path", "")
+        archive_format = input_data.get("format") or detect_format(archive_path)
+        level = input_data.get("level")
+        overwrite = input_data.get("overwrite", False)
+        
+        if isinstance(source_paths, str):
+            source_paths = [source_paths]
+        
+        if not source_paths:
+            return "", Exception("No source paths provided")
+        
+        if not archive_path:
+            return "", Exception("No archive path provided")
+        
+        if archive_format not in FORMATS:
+            return "", Exception(f"Unknown archive format for {archive_path}. Use one of: {', '.join(FORMATS)}")
+        
+        # Get the Capri data directory
+        capri_dir = get_capri_dir()
+        
+        full_sources = []
+        for source_path in source_paths:
+            full_source = os.path.join(capri_dir, source_path)
+            if not os.path.exists(full_source):
+                return "", Exception(f"Source not found: {source_path}")
+            full_sources.append(full_source)
+        
+        full_archive_path = os.path.join(capri_dir, archive_path)
+        if os.path.exists(full_archive_path) and not overwrite:
+            return "", Exception(f"Archive already exists: {archive_path} (use overwrite to replace it)")
+        
+        try:
+            result = create_archive(full_sources, full_archive_path, archive_format, level)
+        except RuntimeError as e:
+            return "", Exception(str(e))
+        invalidate_path(full_archive_path)
+        
+        backend = f", compressed with {result['backend']}" if result["backend"] != "none" else ""
+        return (
+            f"Created archive {archive_path}: {result['files']} files, "
+            f"{format_bytes(result['bytes'])} -> {format_bytes(result['archive_bytes'])}{backend}"
+        ), None
+    except Exception as e:
+        return "", e
+
+# Create the tool definition
+create_archive_tool = ToolDefinition(
+    name="create_archive",
+    description="Bundle files and directories from the Capri data directory into a zip, tar, tar.gz or tar.zst archive. Compression uses several threads where possible.",
+    input_schema=create_archive_schema,
+    function=create_archive_function
+)
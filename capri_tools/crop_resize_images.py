@@ -1,9 +1,33 @@
 import json
 import os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Tuple, Optional, List, Union
 from capri_tools.tool_definition import ToolDefinition
 from capri_tools.get_capri_dir import get_capri_dir
+from capri_tools.media_catalog import get_media_catalog, MediaProbeError
+from capri_tools.progress import ProgressReporter, format_bytes
+from capri_tools.find_files import parse_size
+from capri_tools import image_engine
+from capri_tools.build_manifest import BuildManifest
+from capri_tools.atomic_write import atomic_write
+from capri_tools.image_hashes import get_image_hash_index, group_similar, DEFAULT_THRESHOLD, MAX_THRESHOLD
+
+# Image backends: "auto" uses Pillow where it's installed and handles the format, else ffmpeg
+BACKENDS = ("auto", "pillow", "ffmpeg")
+
+# Image types the tool processes
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.webp')
+
+# JSON description of the responsive image set, written next to the renditions
+RENDITIONS_FILE = "renditions.json"
+
+# Targeted encodes listed individually in the result
+MAX_REPORTED_OUTPUTS = 20
+
+# Images processed at once. Each one is its own ffmpeg process, so a thread per core is
+# enough to keep every core busy
+DEFAULT_WORKERS = os.cpu_count() or 1
 
 # Schema for crop_resize_images tool
 crop_resize_images_schema = {
@@ -37,56 +61,277 @@ crop_resize_images_schema = {
             "type": "string",
             "description": "Format for output images (jpg, png, etc.).",
             "default": "jpg"
+        },
+        "renditions": {
+            "type": "array",
+            "description": "Optional. Several output sizes to make from each image in one pass (e.g. thumbnail, medium, large), instead of target_width/target_height. Files are named <image>_<name>.<format>, and a renditions.json with a srcset per image is written to the output directory.",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "width": {"type": "integer", "description": "Width in pixels."},
+                    "height": {"type": "integer", "description": "Height in pixels."},
+                    "format": {"type": "string", "description": "Optional. Output format (default: output_format)."},
+                    "quality": {"type": "integer", "description": "Optional. Quality as for the quality parameter (default: quality)."},
+                    "name": {"type": "string", "description": "Optional. File name suffix (default: <width>x<height>)."}
+                },
+                "required": ["width", "height"]
+            }
+        },
+        "max_size": {
+            "type": "string",
+            "description": "Optional. Size budget per output file, e.g. '150KB'. The encoder quality is searched to get the best quality that fits. Needs Pillow and a jpg, webp or avif output format; overrides quality."
+        },
+        "min_ssim": {
+            "type": "number",
+            "description": "Optional. Perceptual quality target per output, as SSIM (0-1, e.g. 0.95). The smallest file reaching it is written; with max_size too, the size budget wins when both can't be met. Needs Pillow and a jpg, webp or avif output format."
+        },
+        "workers": {
+            "type": "integer",
+            "description": "Number of images processed in parallel. Defaults to the number of CPU cores."
+        },
+        "backend": {
+            "type": "string",
+            "enum": list(BACKENDS),
+            "description": "Image engine: 'pillow' resizes in-process (much faster for JPEG/PNG/WebP), 'ffmpeg' runs ffmpeg per image, 'auto' uses Pillow when it is installed and falls back to ffmpeg for anything it can't handle.",
+            "default": "auto"
+        },
+        "incremental": {
+            "type": "boolean",
+            "description": "Only process images that are new or changed since the last run into the same output directory (tracked in a manifest there), and remove outputs of images that were deleted. Set to false to reprocess everything.",
+            "default": True
+        },
+        "skip_similar": {
+            "type": "boolean",
+            "description": "Optional. Process only one image of each group of near-duplicates in the input (the largest version), judged by perceptual hash as in find_similar_images (default: false).",
+            "default": False
+        },
+        "similarity_threshold": {
+            "type": "integer",
+            "description": f"Optional. With skip_similar, how many bits of the 64-bit perceptual hash two images may differ in and still count as near-duplicates (0-{MAX_THRESHOLD}, default: {DEFAULT_THRESHOLD})."
         }
     },
     "required": ["input_path"]
 }
 
 def get_image_dimensions(path: str) -> Tuple[int, int]:
-    """Get the width and height of an image using ffprobe."""
-    cmd = [
-        "ffprobe", "-v", "error",
-        "-select_streams", "v:0",
-        "-show_entries", "stream=width,height",
-        "-of", "json", path
-    ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    info = json.loads(result.stdout)
-    width = info['streams'][0]['width']
-    height = info['streams'][0]['height']
-    return width, height
-
-def process_image(input_path: str, output_path: str, target_width: int, target_height: int, quality: int) -> bool:
-    """Process a single image, resize and crop as needed."""
+    """Get the width and height of an image from the media catalog (probed with ffprobe if new or changed)."""
+    info = get_media_catalog().probe(path)
+    if not info.width or not info.height:
+        raise MediaProbeError(f"Could not read the dimensions of {path}")
+    return info.width, info.height
+
+class Rendition:
+    """One output size made for every image: dimensions, format, quality and file name suffix"""
+    def __init__(self, width: int, height: int, output_format: str, quality: int, name: str = ""):
+        self.width = width
+        self.height = height
+        self.format = output_format.lower()
+        self.quality = quality
+        self.name = name
+    
+    def output_name(self, basename: str) -> str:
+        suffix = f"_{self.name}" if self.name else ""
+        return f"{basename}{suffix}.{self.format}"
+    
+    def to_dict(self) -> dict:
+        return {"name": self.name, "width": self.width, "height": self.height, "format": self.format, "quality": self.quality}
+
+def parse_renditions(input_data: dict, target_width: int, target_height: int, quality: int, output_format: str) -> List[Rendition]:
+    """The renditions argument as Rendition objects, or the single target size when it's not given"""
+    specs = input_data.get("renditions")
+    if not specs:
+        return [Rendition(target_width, target_height, output_format, quality)]
+    
+    renditions = []
+    for spec in specs:
+        width = int(spec.get("width") or 0)
+        height = int(spec.get("height") or 0)
+        if width <= 0 or height <= 0:
+            raise ValueError(f"Each rendition needs a positive width and height: {json.dumps(spec)}")
+        renditions.append(Rendition(width, height, spec.get("format") or output_format, int(spec.get("quality") or quality),
+                                    spec.get("name") or f"{width}x{height}"))
+    
+    names = [rendition.output_name("") for rendition in renditions]
+    if len(set(names)) != len(names):
+        raise ValueError("Renditions must have distinct names (or sizes) for the same format")
+    return renditions
+
+def uses_pillow(input_path: str, output_formats: List[str], backend: str) -> bool:
+    """Whether an image goes through the in-process engine rather than ffmpeg"""
+    return backend != "ffmpeg" and all(image_engine.can_process(input_path, output_format) for output_format in output_formats)
+
+def _ffmpeg_scale_filter(width: int, height: int, target_width: int, target_height: int) -> str:
+    # If image is smaller than target size, scale it directly
+    if width < target_width or height < target_height:
+        return f"scale={target_width}:{target_height}"
+    # Step 1: Scale while preserving aspect ratio so that it fully covers target size
+    # Step 2: Crop the center portion to the target size
+    return (
+        f"scale='if(gt(a,{target_width}/{target_height}),"
+        f"{int(target_height)}*iw/ih,{target_width})':'if(gt(a,{target_width}/{target_height}),"
+        f"{target_height},{int(target_width)}*ih/iw)',"
+        f"crop={target_width}:{target_height}"
+    )
+
+def render_image(input_path: str, targets: List[Tuple[str, int, int, str, int]], threads: Optional[int] = None,
+                 backend: str = "auto", encode_target: Optional[image_engine.EncodeTarget] = None) -> Optional[List[dict]]:
+    """
+    Write one image at one or more sizes; targets are (output path, width, height, format, quality).
+    threads caps ffmpeg's own threads. Returns what was written for each target (path, bytes
+    and, from Pillow, the quality used), or None if the image failed.
+    
+    Every size comes from a single decode. With Pillow, sizes are scaled and cropped in
+    memory, each from the previous one, and encoded to encode_target if one is given; if
+    that fails (e.g. a variant of the format Pillow can't decode), ffmpeg is tried, splitting
+    the decoded frame into one filter chain per size. ffmpeg can't encode to a target, so
+    with encode_target such an image fails instead.
+    """
+    if uses_pillow(input_path, [target[3] for target in targets], backend):
+        try:
+            if len(targets) == 1:
+                output_path, target_width, target_height, output_format, quality = targets[0]
+                return [image_engine.crop_resize(input_path, output_path, target_width, target_height, quality, output_format, encode_target)]
+            return image_engine.render_renditions(input_path, targets, encode_target)
+        except Exception:
+            pass
+    
+    if encode_target is not None:
+        return None
+    
     try:
         width, height = get_image_dimensions(input_path)
         
-        # If image is smaller than target size, scale it directly
-        if width < target_width or height < target_height:
-            vf = f"scale={target_width}:{target_height}"
-        else:
-            # Step 1: Scale while preserving aspect ratio so that it fully covers target size
-            # Step 2: Crop the center portion to the target size
-            vf = (
-                f"scale='if(gt(a,{target_width}/{target_height}),"
-                f"{int(target_height)}*iw/ih,{target_width})':'if(gt(a,{target_width}/{target_height}),"
-                f"{target_height},{int(target_width)}*ih/iw)',"
-                f"crop={target_width}:{target_height}"
-            )
+        cmd = ["ffmpeg"]
+        if threads:
+            cmd += ["-threads", str(threads)]
+        cmd += ["-i", input_path]
         
-        cmd = [
-            "ffmpeg",
-            "-i", input_path,
-            "-vf", vf,
-            "-q:v", str(quality),
-            "-y",
-            output_path
-        ]
+        if len(targets) == 1:
+            output_path, target_width, target_height, _output_format, quality = targets[0]
+            cmd += [
+                "-vf", _ffmpeg_scale_filter(width, height, target_width, target_height),
+                "-q:v", str(quality),
+                "-y",
+                output_path
+            ]
+        else:
+            chains = [f"[0:v]split={len(targets)}" + "".join(f"[s{i}]" for i in range(len(targets)))]
+            for i, (_output_path, target_width, target_height, _output_format, _quality) in enumerate(targets):
+                chains.append(f"[s{i}]{_ffmpeg_scale_filter(width, height, target_width, target_height)}[o{i}]")
+            cmd += ["-filter_complex", ";".join(chains), "-y"]
+            for i, (output_path, _target_width, _target_height, _output_format, quality) in enumerate(targets):
+                cmd += ["-map", f"[o{i}]", "-q:v", str(quality), output_path]
         
         subprocess.run(cmd, check=True, capture_output=True)
-        return True
+        return [{"path": target[0], "bytes": os.path.getsize(target[0])} for target in targets]
     except Exception as e:
-        return False
+        return None
+
+def process_image(input_path: str, output_path: str, target_width: int, target_height: int, quality: int,
+                  threads: Optional[int] = None, backend: str = "auto") -> bool:
+    """Process a single image, resize and crop as needed."""
+    output_format = os.path.splitext(output_path)[1][1:]
+    return render_image(input_path, [(output_path, target_width, target_height, output_format, quality)], threads, backend) is not None
+
+def process_images(jobs: List[Tuple[str, List[Tuple[str, int, int, str, int]]]], workers: int = DEFAULT_WORKERS,
+                   backend: str = "auto", encode_target: Optional[image_engine.EncodeTarget] = None,
+                   outputs: Optional[dict] = None) -> Tuple[List[str], List[str]]:
+    """
+    Process (input path, targets) pairs on a pool of worker threads (see render_image).
+    
+    Results are collected as each image finishes, with progress printed along the way.
+    Returns the file names that were processed and those that failed; if outputs is given,
+    what was written for each processed file is stored in it by file name.
+    """
+    processed_files = []
+    failed_files = []
+    if not jobs:
+        return processed_files, failed_files
+    
+    # Probe every image going through ffmpeg in one parallel pass; already cataloged images
+    # aren't probed again. Pillow reads dimensions from the header itself
+    get_media_catalog().probe_paths(
+        input_path for input_path, targets in jobs if not uses_pillow(input_path, [target[3] for target in targets], backend)
+    )
+    
+    workers = max(1, min(workers, len(jobs)))
+    # With one ffmpeg per core, ffmpeg's own threads would only compete with each other
+    threads = 1 if workers > 1 else None
+    progress = ProgressReporter("Cropping images", unit="images", total_items=len(jobs))
+    
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="capri-crop") as executor:
+        futures = {
+            executor.submit(render_image, input_path, targets, threads, backend, encode_target): input_path
+            for input_path, targets in jobs
+        }
+        for future in as_completed(futures):
+            filename = os.path.basename(futures[future])
+            written = future.result()
+            if written is not None:
+                processed_files.append(filename)
+                if outputs is not None:
+                    outputs[filename] = written
+            else:
+                failed_files.append(filename)
+            progress.advance(items=1)
+    
+    progress.finish()
+    processed_files.sort()
+    failed_files.sort()
+    return processed_files, failed_files
+
+def describe_encodes(written: dict, output_dir: str) -> str:
+    """Report the size and quality each targeted output ended up with"""
+    results = [result for filename in sorted(written) for result in written[filename]]
+    missed = [result for result in results if result.get("target_met") is False]
+    total = sum(result["bytes"] for result in results)
+    lines = [f"\nEncoded {len(results)} outputs to target: {format_bytes(total)} in total, {format_bytes(total / len(results))} on average."]
+    if missed:
+        lines.append(f"{len(missed)} could not meet the target and were written at the closest setting.")
+    for result in results[:MAX_REPORTED_OUTPUTS]:
+        line = f"{os.path.relpath(result['path'], output_dir)}: {format_bytes(result['bytes'])}"
+        if "quality" in result:
+            line += f", quality {result['quality']}"
+        if "ssim" in result:
+            line += f", SSIM {result['ssim']:.3f}"
+        if result.get("target_met") is False:
+            line += " (target missed)"
+        lines.append(line)
+    if len(results) > MAX_REPORTED_OUTPUTS:
+        lines.append(f"... and {len(results) - MAX_REPORTED_OUTPUTS} more")
+    return "\n".join(lines)
+
+def write_renditions_manifest(output_dir: str, renditions: List[Rendition], input_files: List[str]) -> str:
+    """
+    Write renditions.json describing the responsive image set of each input, with a srcset
+    string per format. Returns its path.
+    """
+    images = {}
+    for input_file in input_files:
+        basename = os.path.splitext(os.path.basename(input_file))[0]
+        files = []
+        for rendition in renditions:
+            output_name = rendition.output_name(basename)
+            try:
+                size = os.path.getsize(os.path.join(output_dir, output_name))
+            except OSError:
+                continue
+            files.append({"path": output_name, "width": rendition.width, "height": rendition.height,
+                          "format": rendition.format, "bytes": size})
+        if not files:
+            continue
+        srcset = {}
+        for file in sorted(files, key=lambda file: file["width"]):
+            srcset.setdefault(file["format"], []).append(f"{file['path']} {file['width']}w")
+        images[os.path.basename(input_file)] = {
+            "files": files,
+            "srcset": {output_format: ", ".join(entries) for output_format, entries in srcset.items()}
+        }
+    
+    path = os.path.join(output_dir, RENDITIONS_FILE)
+    with atomic_write(path) as file:
+        json.dump({"renditions": [rendition.to_dict() for rendition in renditions], "images": images}, file, indent=2)
+    return path
 
 def crop_resize_images_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
     """
@@ -108,6 +353,39 @@ def crop_resize_images_function(input_bytes: bytes) -> Tuple[str, Optional[Excep
         target_height = input_data.get("target_height", 600)
         quality = input_data.get("quality", 2)
         output_format = input_data.get("output_format", "jpg").lower()
+        workers = int(input_data.get("workers") or DEFAULT_WORKERS)
+        backend = input_data.get("backend") or "auto"
+        incremental = input_data.get("incremental", True)
+        skip_similar = input_data.get("skip_similar", False)
+        similarity_threshold = input_data.get("similarity_threshold")
+        similarity_threshold = DEFAULT_THRESHOLD if similarity_threshold is None else int(similarity_threshold)
+        
+        if not 0 <= similarity_threshold <= MAX_THRESHOLD:
+            return "", Exception(f"Invalid similarity_threshold: {similarity_threshold}. Use a value from 0 to {MAX_THRESHOLD}")
+        
+        if backend not in BACKENDS:
+            return "", Exception(f"Invalid backend: {backend}. Use one of: {', '.join(BACKENDS)}")
+        
+        if backend == "pillow" and not image_engine.pillow_available():
+            return "", Exception("The pillow backend needs Pillow: pip install Pillow (or Pillow-SIMD)")
+        
+        try:
+            renditions = parse_renditions(input_data, target_width, target_height, quality, output_format)
+            max_size = parse_size(input_data["max_size"]) if input_data.get("max_size") else None
+        except ValueError as e:
+            return "", Exception(str(e))
+        
+        min_ssim = input_data.get("min_ssim")
+        encode_target = None
+        if max_size is not None or min_ssim is not None:
+            if min_ssim is not None and not 0 < float(min_ssim) <= 1:
+                return "", Exception(f"Invalid min_ssim: {min_ssim}. Use a value between 0 and 1, e.g. 0.95")
+            untargetable = sorted({rendition.format for rendition in renditions if not image_engine.can_target(rendition.format)})
+            if backend == "ffmpeg" or untargetable:
+                reason = "the ffmpeg backend" if backend == "ffmpeg" else f"format {', '.join(untargetable)}"
+                return "", Exception(f"max_size and min_ssim need Pillow and a jpg, webp or avif output, not {reason}"
+                                     + ("" if image_engine.pillow_available() else " (Pillow is not installed)"))
+            encode_target = image_engine.EncodeTarget(max_size, float(min_ssim) if min_ssim is not None else None)
         
         # Get the Capri data directory
         capri_dir = get_capri_dir()
@@ -128,43 +406,104 @@ def crop_resize_images_function(input_bytes: bytes) -> Tuple[str, Optional[Excep
         # Create output directory if it doesn't exist
         os.makedirs(full_output_dir, exist_ok=True)
         
-        processed_files = []
-        failed_files = []
-        
         # Determine if input is a directory or a single file
         if os.path.isdir(full_input_path):
             # Process all images in the directory
-            for filename in os.listdir(full_input_path):
-                if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.webp')):
-                    file_input_path = os.path.join(full_input_path, filename)
-                    basename = os.path.splitext(filename)[0]
-                    file_output_path = os.path.join(full_output_dir, f"{basename}.{output_format}")
-                    
-                    if process_image(file_input_path, file_output_path, target_width, target_height, quality):
-                        processed_files.append(filename)
-                    else:
-                        failed_files.append(filename)
+            input_files = [
+                os.path.join(full_input_path, filename) for filename in sorted(os.listdir(full_input_path))
+                if filename.lower().endswith(IMAGE_EXTENSIONS)
+            ]
         else:
             # Process a single file
             if os.path.isfile(full_input_path):
                 filename = os.path.basename(full_input_path)
-                if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.webp')):
-                    basename = os.path.splitext(filename)[0]
-                    file_output_path = os.path.join(full_output_dir, f"{basename}.{output_format}")
-                    
-                    if process_image(full_input_path, file_output_path, target_width, target_height, quality):
-                        processed_files.append(filename)
-                    else:
-                        failed_files.append(filename)
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
+                    input_files = [full_input_path]
                 else:
                     return "", Exception(f"File is not a supported image format: {filename}")
             else:
                 return "", Exception(f"Input path does not exist: {input_path}")
         
+        # Leave out all but the largest version of each group of near-duplicates; their
+        # outputs from earlier runs are removed below like those of deleted images
+        similar_files = []
+        if skip_similar and len(input_files) > 1:
+            hash_index = get_image_hash_index()
+            images = hash_index.images_for_paths(input_files)
+            hash_index.hash_images(images, workers, print)
+            for group in group_similar(images, similarity_threshold):
+                similar_files.extend(image.path for image in group.files[1:])
+            skipped = set(similar_files)
+            input_files = [input_file for input_file in input_files if input_file not in skipped]
+        
+        def output_names(input_file: str) -> List[str]:
+            basename = os.path.splitext(os.path.basename(input_file))[0]
+            return [rendition.output_name(basename) for rendition in renditions]
+        
+        # Skip images whose outputs the manifest shows are up to date for these settings
+        if input_data.get("renditions"):
+            params = {"renditions": [rendition.to_dict() for rendition in renditions]}
+        else:
+            params = {"width": target_width, "height": target_height, "quality": quality, "format": output_format}
+        if encode_target is not None:
+            params["target"] = {"max_size": max_size, "min_ssim": encode_target.min_ssim}
+        manifest = BuildManifest(full_output_dir, params)
+        pending = [input_file for input_file in input_files if not incremental or not manifest.is_current(os.path.basename(input_file), input_file)]
+        
+        jobs = [
+            (input_file, [
+                (os.path.join(full_output_dir, output_name), rendition.width, rendition.height, rendition.format, rendition.quality)
+                for rendition, output_name in zip(renditions, output_names(input_file))
+            ])
+            for input_file in pending
+        ]
+        written = {}
+        processed_files, failed_files = process_images(jobs, workers, backend, encode_target, written)
+        
+        pending_by_name = {os.path.basename(input_file): input_file for input_file in pending}
+        for filename in processed_files:
+            input_file = pending_by_name[filename]
+            manifest.record(filename, input_file, output_names(input_file))
+        for filename in failed_files:
+            manifest.entries.pop(filename, None)
+        
+        # In incremental mode, outputs of images deleted from this folder (or skipped as
+        # near-duplicates) go too; other folders writing to the same output_dir keep theirs
+        removed_files = []
+        if incremental and os.path.isdir(full_input_path):
+            removed_files = manifest.remove_missing(full_input_path, similar_files)
+        manifest.save()
+        
         # Generate result message
-        result = f"Processed {len(processed_files)} images to {target_width}x{target_height}."
+        if input_data.get("renditions"):
+            sizes = ", ".join(f"{rendition.width}x{rendition.height} {rendition.format}" for rendition in renditions)
+            result = f"Processed {len(processed_files)} images to {len(renditions)} renditions ({sizes})."
+        else:
+            result = f"Processed {len(processed_files)} images to {target_width}x{target_height}."
         result += f"\nOutput saved to: {output_dir}"
         
+        if input_data.get("renditions"):
+            # Every image in the output directory made with these renditions, from this run or earlier ones
+            manifest_path = write_renditions_manifest(
+                full_output_dir, renditions, sorted(name for name, entry in manifest.entries.items() if entry.get("params") == params)
+            )
+            result += f"\nResponsive image set: {os.path.relpath(manifest_path, capri_dir)}"
+        
+        if encode_target is not None and written:
+            result += describe_encodes(written, full_output_dir)
+        
+        if len(input_files) > len(pending):
+            result += f"\nSkipped {len(input_files) - len(pending)} unchanged images."
+        
+        if similar_files:
+            names = sorted(os.path.basename(similar_file) for similar_file in similar_files)
+            result += f"\nSkipped {len(names)} near-duplicate images: {', '.join(names[:5])}"
+            if len(names) > 5:
+                result += f" and {len(names) - 5} more"
+        
+        if removed_files:
+            result += f"\nRemoved {len(removed_files)} outputs of deleted or skipped images."
+        
         if processed_files:
             result += f"\nProcessed files: {', '.join(processed_files[:5])}"
             if len(processed_files) > 5:
@@ -180,7 +519,7 @@ def crop_resize_images_function(input_bytes: bytes) -> Tuple[str, Optional[Excep
 # Create the tool definition
 crop_resize_images_tool = ToolDefinition(
     name="crop_resize_images",
-    description="Resize and crop images to fit specified dimensions while maintaining aspect ratio.",
+    description="Resize and crop images to fit specified dimensions while maintaining aspect ratio. Directories are processed on all CPU cores in parallel. Can make several sizes (renditions) of each image in one pass, with a JSON manifest and srcset for responsive images.",
     input_schema=crop_resize_images_schema,
     function=crop_resize_images_function
 )
\ No newline at end of file
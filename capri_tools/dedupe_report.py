@@ -0,0 +1,104 @@
+import json
+import os
+from typing import Tuple, Optional
+from capri_tools.tool_definition import ToolDefinition
+from capri_tools.get_capri_dir import get_capri_dir
+from capri_tools.file_cache import invalidate_path
+from capri_tools.content_index import get_content_index, deduplicate
+from capri_tools.find_files import parse_size
+from capri_tools.progress import format_bytes
+
+# Duplicate groups listed in the report
+DEFAULT_MAX_GROUPS = 20
+
+# Schema for dedupe_report tool
+dedupe_report_schema = {
+    "type": "object",
+    "properties": {
+        "path": {
+            "type": "string",
+            "description": "Optional. Directory to check, relative to the Capri data directory (default: the whole Capri directory)."
+        },
+        "min_size": {
+            "type": "string",
+            "description": "Optional. Ignore files smaller than this, in bytes or with a unit, e.g. '1MB' (default: 1 byte)."
+        },
+        "max_groups": {
+            "type": "integer",
+            "description": f"Optional. Number of duplicate groups to list, largest savings first (default: {DEFAULT_MAX_GROUPS})."
+        },
+        "apply": {
+            "type": "boolean",
+            "description": "Optional. Replace the duplicates with links to one copy, freeing the space (default: false, report only)."
+        },
+        "mode": {
+            "type": "string",
+            "enum": ["hardlink", "reflink"],
+            "description": "Optional. With apply: 'reflink' (copy-on-write clones that stay independent files; needs Btrfs, XFS or APFS-like support) or 'hardlink' (works on any filesystem, but the copies become one file: writing to any of them, as most tools that overwrite their output do, changes all of them). Default: reflink."
+        }
+    }
+}
+
+def dedupe_report_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
+    """Report (and optionally remove) duplicate files in the Capri data directory"""
+    try:
+        input_data = json.loads(input_bytes)
+        path = input_data.get("path", "")
+        max_groups = int(input_data.get("max_groups") or DEFAULT_MAX_GROUPS)
+        apply = input_data.get("apply", False)
+        mode = input_data.get("mode") or "reflink"
+        
+        if mode not in ("hardlink", "reflink"):
+            return "", Exception(f"Invalid mode: {mode}. Use 'hardlink' or 'reflink'")
+        
+        try:
+            min_size = max(1, parse_size(input_data.get("min_size") or 1))
+        except ValueError as e:
+            return "", Exception(str(e))
+        
+        # Get the Capri data directory
+        capri_dir = get_capri_dir()
+        target_dir = os.path.join(capri_dir, path) if path else capri_dir
+        
+        if not os.path.isdir(target_dir):
+            return "", Exception(f"Directory not found: {path}")
+        
+        index = get_content_index()
+        groups, scanned = index.find_duplicates(target_dir, min_size)
+        
+        reclaimable = sum(group.reclaimable for group in groups)
+        duplicates = sum(len(group.files) - 1 for group in groups)
+        lines = [
+            f"Scanned {scanned} files: {duplicates} duplicate file(s) in {len(groups)} group(s), "
+            f"{format_bytes(reclaimable)} can be reclaimed"
+        ]
+        
+        for group in groups[:max_groups]:
+            lines.append(f"\n{format_bytes(group.size)} x {len(group.files)} ({format_bytes(group.reclaimable)} reclaimable):")
+            for number, file in enumerate(group.files):
+                lines.append(f"  {file.relative_path}{' (kept)' if number == 0 and apply else ''}")
+        if len(groups) > max_groups:
+            lines.append(f"\n[{len(groups) - max_groups} more group(s) not shown]")
+        
+        if apply and groups:
+            linked, reclaimed, errors = deduplicate(groups, mode)
+            for group in groups:
+                for file in group.files[1:]:
+                    invalidate_path(file.path)
+            lines.append(f"\nReplaced {linked} duplicate(s) with {mode}s, reclaimed {format_bytes(reclaimed)}")
+            if mode == "hardlink" and linked:
+                lines.append("Warning: hard-linked copies are one file now; overwriting any of them in place changes all of them")
+            for relative_path, error in errors[:20]:
+                lines.append(f"  not linked: {relative_path}: {error}")
+        
+        return "\n".join(lines), None
+    except Exception as e:
+        return "", e
+
+# Create the tool definition
+dedupe_report_tool = ToolDefinition(
+    name="dedupe_report",
+    description="Find byte-identical files in the Capri data directory and show how much space duplicates use. With apply, replaces the duplicates with hard links or reflinks to a single copy.",
+    input_schema=dedupe_report_schema,
+    function=dedupe_report_function
+)
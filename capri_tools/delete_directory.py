@@ -1,9 +1,10 @@
 import json
 import os
-import shutil
 from typing import Tuple, Optional
 from capri_tools.tool_definition import ToolDefinition
-from capri_tools.get_capri_dir import get_capri_dir
+from capri_tools.get_capri_dir import get_capri_dir, get_capri_state_dir
+from capri_tools.file_cache import invalidate_path
+from capri_tools.trash import get_trash, is_cross_device, remove_tree
 
 # Schema for delete_directory tool
 delete_directory_schema = {
@@ -17,6 +18,11 @@ delete_directory_schema = {
             "type": "boolean",
             "description": "If True, recursively remove directories and their contents.",
             "default": True
+        },
+        "permanent": {
+            "type": "boolean",
+            "description": "If True, the directory can't be restored afterwards; its space is reclaimed right away in the background.",
+            "default": False
         }
     },
     "required": ["path"]
@@ -28,6 +34,7 @@ def delete_directory_function(input_bytes: bytes) -> Tuple[str, Optional[Excepti
         input_data = json.loads(input_bytes)
         path = input_data.get("path", "")
         recursive = input_data.get("recursive", True)
+        permanent = input_data.get("permanent", False)
         
         if not path:
             return "", Exception("No directory path provided")
@@ -50,13 +57,34 @@ def delete_directory_function(input_bytes: bytes) -> Tuple[str, Optional[Excepti
         if not os.path.isdir(full_path):
             return "", Exception(f"The specified path is not a directory: {path}")
         
+        # Never trash the trash (or any other Capri state)
+        state_dir = os.path.realpath(get_capri_state_dir())
+        real_path = os.path.realpath(full_path)
+        if real_path == state_dir or real_path.startswith(state_dir + os.sep):
+            return "", Exception(f"Cannot delete Capri's own state directory: {path}")
+        
         # Delete the directory
-        if recursive:
-            shutil.rmtree(full_path)
-        else:
+        if not recursive:
             os.rmdir(full_path)  # Will only work if directory is empty
+            invalidate_path(full_path)
+            return f"Directory deleted successfully: {path}", None
+        
+        # Renaming into the trash takes the same time for any size of tree; the
+        # background reaper frees the space later
+        try:
+            trash_id = get_trash().move_to_trash(full_path, permanent=permanent)
+        except OSError as e:
+            if not is_cross_device(e):
+                raise
+            # On another filesystem (e.g. a mounted drive) the trash can't take it by rename
+            remove_tree(full_path)
+            invalidate_path(full_path)
+            return f"Directory deleted permanently: {path} (it is on a different drive than the trash)", None
+        invalidate_path(full_path)
         
-        return f"Directory deleted successfully: {path}", None
+        if permanent:
+            return f"Directory deleted permanently: {path}", None
+        return f"Directory deleted successfully: {path} (it can be brought back with the restore tool, trash id {trash_id})", None
     except OSError as e:
         if not recursive and len(os.listdir(full_path)) > 0:
             return "", Exception(f"Directory not empty and recursive is False: {path}")
@@ -67,7 +95,7 @@ def delete_directory_function(input_bytes: bytes) -> Tuple[str, Optional[Excepti
 # Create the tool definition
 delete_directory_tool = ToolDefinition(
     name="delete_directory",
-    description="Delete a directory from the Capri data directory, with option to recursively remove all contents.",
+    description="Delete a directory from the Capri data directory, with option to recursively remove all contents. Deleted directories are moved to the trash and can be brought back with the restore tool for a while.",
     input_schema=delete_directory_schema,
     function=delete_directory_function
 )
\ No newline at end of file
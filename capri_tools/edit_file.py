@@ -1,9 +1,12 @@
 import json
 import os
 import platform
-from typing import Tuple, Optional
+from typing import Tuple, Optional, List
 from capri_tools.tool_definition import ToolDefinition
 from capri_tools.get_capri_dir import get_capri_dir
+from capri_tools.file_cache import invalidate_path
+from capri_tools.atomic_write import atomic_write
+from capri_tools.stream_edit import Edit, stream_replace
 
 # Schema for edit_file tool
 edit_file_schema = {
@@ -20,9 +23,35 @@ edit_file_schema = {
         "new_str": {
             "type": "string",
             "description": "Text to replace old_str with"
+        },
+        "count": {
+            "type": "integer",
+            "description": "Optional. Replace at most this many occurrences of old_str (default: all)."
+        },
+        "edits": {
+            "type": "array",
+            "description": "Optional. Several replacements applied in a single pass over the file, instead of old_str/new_str. Each one is matched against the original text.",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "old_str": {
+                        "type": "string",
+                        "description": "Text to search for - must match exactly"
+                    },
+                    "new_str": {
+                        "type": "string",
+                        "description": "Text to replace old_str with"
+                    },
+                    "count": {
+                        "type": "integer",
+                        "description": "Optional. Replace at most this many occurrences (default: all)."
+                    }
+                },
+                "required": ["old_str", "new_str"]
+            }
         }
     },
-    "required": ["path", "old_str", "new_str"]
+    "required": ["path"]
 }
 
 def edit_file_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
@@ -30,14 +59,24 @@ def edit_file_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
     try:
         input_data = json.loads(input_bytes)
         path = input_data.get("path", "")
-        old_str = input_data.get("old_str", "").strip()
-        new_str = input_data.get("new_str", "").strip()
+        raw_edits = input_data.get("edits") or [{
+            "old_str": input_data.get("old_str", ""),
+            "new_str": input_data.get("new_str", ""),
+            "count": input_data.get("count")
+        }]
         
         if not path:
             return "", Exception("No file path provided")
         
-        if old_str == new_str:
-            return "", Exception("old_str and new_str must be different")
+        edits: List[Edit] = []
+        for raw_edit in raw_edits:
+            old_str = raw_edit.get("old_str", "").strip()
+            new_str = raw_edit.get("new_str", "").strip()
+            
+            if old_str == new_str:
+                return "", Exception("old_str and new_str must be different")
+            
+            edits.append(Edit(old_str, new_str, raw_edit.get("count")))
         
         # Resolve path to be within Capri data directory if not absolute
         if not os.path.isabs(path):
@@ -45,8 +84,11 @@ def edit_file_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
             path = os.path.join(capri_dir, path)
         
         # Create new file
-        if old_str == "":
-            return create_new_file(path, new_str)
+        if len(edits) == 1 and edits[0].old_str == "":
+            return create_new_file(path, edits[0].new_str)
+        
+        if any(edit.old_str == "" for edit in edits):
+            return "", Exception("old_str can only be empty when creating a new file with a single edit")
         
         # Edit existing file
         try:
@@ -54,26 +96,27 @@ def edit_file_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
             directory = os.path.dirname(path)
             if directory and not os.path.exists(directory):
                 os.makedirs(directory, exist_ok=True)
-                
+            
             if os.path.exists(path):
-                with open(path, 'r', encoding='utf-8') as file:
-                    content = file.read()
-                
-                # Replace content
-                new_content = content.replace(old_str, new_str)
-                
-                # Check if anything was replaced
-                if new_content == content:
-                    return "", Exception(f"Text '{old_str}' not found in file")
+                # Stream the file through all edits into a temp file that replaces the original
+                # only if every edit matched, so a failure never leaves a half-written file
+                with open(path, 'r', encoding='utf-8', newline='') as source:
+                    with atomic_write(path) as destination:
+                        replaced = stream_replace(source, destination, edits)
+                        
+                        # Check if anything was replaced
+                        missing = [edit.old_str for edit in edits if edit.replaced == 0]
+                        if missing:
+                            raise LookupError(f"Text '{missing[0]}' not found in file")
                 
-                # Write the modified content
-                with open(path, 'w', encoding='utf-8') as file:
-                    file.write(new_content)
+                invalidate_path(path)
                 
-                return f"File updated successfully: {path}", None
+                return f"File updated successfully: {path} ({replaced} replacement{'s' if replaced != 1 else ''})", None
             else:
                 return "", Exception(f"File not found: {path}")
         
+        except LookupError as e:
+            return "", Exception(str(e))
         except FileNotFoundError:
             return "", Exception(f"File not found: {path}")
         except Exception as e:
@@ -90,8 +133,9 @@ def create_new_file(file_path: str, content: str) -> Tuple[str, Optional[Excepti
             os.makedirs(directory, exist_ok=True)
         
         # Write content to file
-        with open(file_path, 'w', encoding='utf-8') as file:
+        with atomic_write(file_path) as file:
             file.write(content)
+        invalidate_path(file_path)
         
         return f"Created new file: {file_path}", None
     except Exception as e:
@@ -100,7 +144,7 @@ def create_new_file(file_path: str, content: str) -> Tuple[str, Optional[Excepti
 # Create the tool definition
 edit_file_tool = ToolDefinition(
     name="edit_file",
-    description="Make edits to a text file or create a new one. Use empty old_str to create a new file. Files use platform-specific Capri data directory by default.",
+    description="Make edits to a text file or create a new one. Use empty old_str to create a new file. Pass a list of edits to make several replacements in one call. Files use platform-specific Capri data directory by default.",
     input_schema=edit_file_schema,
     function=edit_file_function
-)
\ No newline at end of file
+)
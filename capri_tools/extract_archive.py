@@ -0,0 +1,75 @@
+import json
+import os
+from typing import Tuple, Optional
+from capri_tools.tool_definition import ToolDefinition
+from capri_tools.get_capri_dir import get_capri_dir
+from capri_tools.file_cache import invalidate_path
+from capri_tools.archives import FORMATS, detect_format, strip_archive_suffix, extract_archive
+from capri_tools.progress import format_bytes
+
+# Schema for extract_archive tool
+extract_archive_schema = {
+    "type": "object",
+    "properties": {
+        "archive_path": {
+            "type": "string",
+            "description": "Relative path of the zip, tar, tar.gz or tar.zst archive to extract."
+        },
+        "destination_path": {
+            "type": "string",
+            "description": "Optional. Relative directory to extract into. Default: a directory named after the archive, next to it."
+        },
+        "format": {
+            "type": "string",
+            "enum": list(FORMATS),
+            "description": "Optional. Archive format; by default it follows the archive_path extension."
+        },
+        "overwrite": {
+            "type": "boolean",
+            "description": "Optional. Replace files that already exist in the destination (default: false, which stops at the first existing file)."
+        }
+    },
+    "required": ["archive_path"]
+}
+
+def extract_archive_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
+    """Extract a zip or tar archive into the Capri data directory"""
+    try:
+        input_data = json.loads(input_bytes)
+        archive_path = input_data.get("archive_path", "")
+        destination_path = input_data.get("destination_path", "") or strip_archive_suffix(archive_path)
+        archive_format = input_data.get("format") or detect_format(archive_path)
+        overwrite = input_data.get("overwrite", False)
+        
+        if not archive_path:
+            return "", Exception("No archive path provided")
+        
+        if archive_format not in FORMATS:
+            return "", Exception(f"Unknown archive format for {archive_path}. Use one of: {', '.join(FORMATS)}")
+        
+        # Get the Capri data directory
+        capri_dir = get_capri_dir()
+        full_archive_path = os.path.join(capri_dir, archive_path)
+        full_destination_path = os.path.join(capri_dir, destination_path)
+        
+        if not os.path.isfile(full_archive_path):
+            return "", Exception(f"Archive not found: {archive_path}")
+        
+        try:
+            result = extract_archive(full_archive_path, full_destination_path, archive_format, overwrite)
+        except (ValueError, FileExistsError, RuntimeError) as e:
+            return "", Exception(f"Error extracting archive: {str(e)}")
+        finally:
+            invalidate_path(full_destination_path)
+        
+        return f"Extracted {result['files']} files ({format_bytes(result['bytes'])}) from {archive_path} to {destination_path}", None
+    except Exception as e:
+        return "", e
+
+# Create the tool definition
+extract_archive_tool = ToolDefinition(
+    name="extract_archive",
+    description="Extract a zip, tar, tar.gz or tar.zst archive into the Capri data directory. Entries that would end up outside the destination directory are refused.",
+    input_schema=extract_archive_schema,
+    function=extract_archive_function
+)
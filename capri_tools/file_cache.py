@@ -0,0 +1,102 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from capri_tools.line_index import invalidate_line_index
+from capri_tools.file_index import notify_index_changed
+from capri_tools.tool_metrics import register_metrics
+
+# Total size of cached file contents
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Files bigger than this are never cached; they're read in ranges anyway
+DEFAULT_MAX_ENTRY_BYTES = 4 * 1024 * 1024
+
+def file_signature(stat: os.stat_result) -> Tuple[int, int, int]:
+    """What has to be unchanged for cached contents to still be valid"""
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+class FileContentCache:
+    """LRU cache of decoded file contents with a byte-size cap, keyed by resolved path"""
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, max_entry_bytes: int = DEFAULT_MAX_ENTRY_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int, int], str, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remove(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self.current_bytes -= size
+
+    def get(self, path: str) -> Optional[str]:
+        """Return the cached contents of a file if they're still current"""
+        key = os.path.realpath(path)
+        try:
+            signature = file_signature(os.stat(key))
+        except OSError:
+            signature = None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, path: str, content: str, stat: os.stat_result) -> None:
+        """Cache the contents of a file as read with the given stat"""
+        size = stat.st_size
+        if size > self.max_entry_bytes:
+            return
+
+        key = os.path.realpath(path)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (file_signature(stat), content, size)
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, path: str) -> None:
+        """Drop a file, or every file under a directory, from the cache"""
+        key = os.path.realpath(path)
+        prefix = key.rstrip(os.sep) + os.sep
+        with self._lock:
+            for cached in [k for k in self._entries if k == key or k.startswith(prefix)]:
+                self._remove(cached)
+                self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+# Shared cache used by read_file
+file_cache = FileContentCache()
+
+register_metrics("file_cache", file_cache.stats)
+
+def invalidate_path(path: str) -> None:
+    """Forget everything cached about a path (file or directory) after a tool changed it"""
+    file_cache.invalidate(path)
+    invalidate_line_index(path)
+    notify_index_changed([path])
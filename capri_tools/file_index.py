@@ -0,0 +1,438 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import sqlite3
+import struct
+import threading
+import time
+from typing import Optional, Iterable, List, Dict, Any, Set
+from capri_tools.get_capri_dir import get_capri_dir, get_capri_state_dir
+from capri_tools.list_files import iter_entries
+from capri_tools.tool_metrics import register_metrics
+
+# Name of the index database inside the Capri state directory
+INDEX_DATABASE_FILE = "file_index.sqlite3"
+
+# Relative paths under this directory are Capri's own state and never indexed
+STATE_DIR_NAME = ".capri"
+
+# Seconds between full rescans when inotify isn't available (or ran out of watches)
+RESCAN_INTERVAL = 60.0
+
+# Seconds to let watcher events accumulate before writing them in one transaction
+EVENT_BATCH_DELAY = 0.25
+
+# Rows written per executemany during a scan
+SCAN_BATCH_SIZE = 5000
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+# IN_MODIFY is left out on purpose: it fires for every write() and IN_CLOSE_WRITE covers it
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+EVENT_HEADER = struct.Struct("iIII")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    extension TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    generation INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_name ON files(name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS files_extension ON files(extension);
+CREATE INDEX IF NOT EXISTS files_size ON files(size);
+CREATE INDEX IF NOT EXISTS files_mtime ON files(mtime);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+def _extension(name: str) -> str:
+    extension = os.path.splitext(name)[1]
+    return extension[1:].lower() if extension else ""
+
+def _is_state_path(relative_path: str) -> bool:
+    return relative_path == STATE_DIR_NAME or relative_path.startswith(STATE_DIR_NAME + "/")
+
+def _descendants_range(relative_path: str):
+    """Bounds of all paths below a directory: '/' + 1 is '0', so [dir/, dir0) covers exactly them"""
+    return relative_path + "/", relative_path + "0"
+
+class _Inotify:
+    """Minimal inotify binding through ctypes (Linux only)"""
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._add_watch.restype = ctypes.c_int
+
+        self.fd = libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def read_events(self, timeout: float):
+        """Yield (wd, mask, cookie, name) for events available within timeout seconds"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return
+
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            yield wd, mask, cookie, name
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+class FileIndex:
+    """
+    SQLite index of every file and directory under the Capri data directory.
+
+    A background thread does an incremental scan at startup (only changed rows are written)
+    and then follows inotify events. Without inotify, or when the kernel's watch limit is
+    reached, it falls back to rescanning every RESCAN_INTERVAL seconds.
+    """
+    def __init__(self, root: Optional[str] = None, database_path: Optional[str] = None):
+        self.root = root or get_capri_dir()
+        self.database_path = database_path or os.path.join(get_capri_state_dir(), INDEX_DATABASE_FILE)
+        self.mode = "stopped"
+        self.scans = 0
+        self.events = 0
+        self.last_scan_seconds = 0.0
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._pending: Set[str] = set()
+        self._pending_lock = threading.Lock()
+        self._watches: Dict[int, str] = {}
+        self._inotify: Optional[_Inotify] = None
+
+        connection = self.connect()
+        try:
+            connection.executescript(SCHEMA)
+            if self._meta(connection, "root") == self.root and self._meta(connection, "generation"):
+                # A previous session indexed this directory; serve it while the startup scan catches up
+                self._ready.set()
+        finally:
+            connection.close()
+
+    def connect(self) -> sqlite3.Connection:
+        """Open a connection to the index. WAL lets queries run while the indexer writes."""
+        connection = sqlite3.connect(self.database_path, timeout=30, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    @staticmethod
+    def _meta(connection: sqlite3.Connection, key: str) -> Optional[str]:
+        row = connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _set_meta(connection: sqlite3.Connection, key: str, value: str) -> None:
+        connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def start(self) -> None:
+        """Start the background indexer (once)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="capri-file-index", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """Block until the index holds at least one complete scan"""
+        self.start()
+        return self._ready.wait(timeout)
+
+    def scan(self, connection: sqlite3.Connection, subtree: str = "") -> int:
+        """
+        Walk the directory (or one subtree of it) and bring the index up to date.
+
+        Rows are only written for entries whose type, size or mtime changed; everything not
+        seen in this walk is deleted at the end. Returns the number of entries seen.
+        """
+        started = time.perf_counter()
+        generation = int(self._meta(connection, "generation") or 0) + 1
+        directory = os.path.join(self.root, subtree) if subtree else self.root
+        prefix = subtree + "/" if subtree else ""
+
+        if subtree:
+            low, high = _descendants_range(subtree)
+            existing = connection.execute("SELECT path, is_dir, size, mtime FROM files WHERE path >= ? AND path < ?", (low, high))
+        else:
+            existing = connection.execute("SELECT path, is_dir, size, mtime FROM files")
+        known = {path: (is_dir, size, mtime) for path, is_dir, size, mtime in existing}
+
+        changed = []
+        seen = 0
+        # Capri's own state (database, trash) is pruned from the walk, not read and then dropped
+        exclude = lambda item: _is_state_path(prefix + item.relative_path)
+        for entry in iter_entries(directory, recursive=True, include_hidden=True, exclude=exclude):
+            relative_path = prefix + entry.relative_path
+
+            stat = entry.stat()
+            if stat is None:
+                continue
+
+            seen += 1
+            row = (int(entry.is_dir), 0 if entry.is_dir else stat.st_size, stat.st_mtime)
+            if known.pop(relative_path, None) != row:
+                changed.append((relative_path, entry.name, _extension(entry.name), *row, generation))
+
+            if len(changed) >= SCAN_BATCH_SIZE:
+                self._upsert(connection, changed)
+                changed = []
+
+        self._upsert(connection, changed)
+        connection.executemany("DELETE FROM files WHERE path = ?", ((path,) for path in known))
+
+        if not subtree:
+            self._set_meta(connection, "root", self.root)
+            self._set_meta(connection, "generation", str(generation))
+            self.scans += 1
+            self.last_scan_seconds = time.perf_counter() - started
+        connection.commit()
+        return seen
+
+    @staticmethod
+    def _upsert(connection: sqlite3.Connection, rows: List[tuple]) -> None:
+        if rows:
+            connection.executemany(
+                "INSERT OR REPLACE INTO files (path, name, extension, is_dir, size, mtime, generation) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def notify_changed(self, path: str) -> None:
+        """Queue a path (file or directory) to be re-checked, e.g. after a tool wrote or deleted it"""
+        try:
+            relative_path = os.path.relpath(os.path.abspath(path), self.root)
+        except ValueError:
+            # On another drive (Windows)
+            return
+        if relative_path == "." or relative_path.startswith(".." + os.sep):
+            return
+        relative_path = relative_path.replace(os.sep, "/")
+        if _is_state_path(relative_path):
+            return
+        with self._pending_lock:
+            self._pending.add(relative_path)
+            # The parent's mtime changed too when an entry was added or removed
+            parent = os.path.dirname(relative_path)
+            if parent:
+                self._pending.add(parent)
+
+    def _apply_pending(self, connection: sqlite3.Connection) -> None:
+        """Re-stat every queued path and update (or delete) its rows, in one transaction"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, set()
+        if not pending:
+            return
+
+        generation = int(self._meta(connection, "generation") or 0)
+        rescan_dirs = []
+        for relative_path in sorted(pending):
+            full_path = os.path.join(self.root, relative_path)
+            try:
+                stat = os.lstat(full_path)
+            except OSError:
+                low, high = _descendants_range(relative_path)
+                connection.execute("DELETE FROM files WHERE path = ? OR (path >= ? AND path < ?)", (relative_path, low, high))
+                continue
+
+            is_dir = os.path.isdir(full_path) and not os.path.islink(full_path)
+            known = connection.execute("SELECT is_dir FROM files WHERE path = ?", (relative_path,)).fetchone()
+            name = os.path.basename(relative_path)
+            self._upsert(connection, [(relative_path, name, _extension(name), int(is_dir), 0 if is_dir else stat.st_size, stat.st_mtime, generation)])
+
+            # A directory that appeared (or was moved in) may already have contents
+            if is_dir and (known is None or not known[0]):
+                rescan_dirs.append(relative_path)
+
+        connection.commit()
+
+        for relative_path in rescan_dirs:
+            self.scan(connection, relative_path)
+            self._watch_tree(os.path.join(self.root, relative_path))
+
+    def _run(self) -> None:
+        connection = self.connect()
+        try:
+            inotify = None
+            try:
+                inotify = _Inotify()
+                self._watch_tree(self.root, inotify)
+                self.mode = "inotify"
+            except (OSError, AttributeError) as e:
+                # AttributeError: no inotify in this libc (not Linux); OSError: e.g. watch limit reached
+                if inotify is not None:
+                    inotify.close()
+                    inotify = None
+                self.mode = "polling"
+
+            # Watches are set before the scan, so nothing changed in between is missed
+            self.scan(connection)
+            self._ready.set()
+
+            if inotify is not None:
+                self._follow_events(connection, inotify)
+            else:
+                self._poll(connection)
+        finally:
+            self.mode = "stopped"
+            connection.close()
+
+    def _watch_tree(self, directory: str, inotify: Optional[_Inotify] = None) -> None:
+        inotify = inotify or self._inotify
+        if inotify is None:
+            return
+        self._inotify = inotify
+
+        self._add_watch(inotify, directory)
+        exclude = lambda item: _is_state_path(os.path.relpath(item.path, self.root).replace(os.sep, "/"))
+        for entry in iter_entries(directory, recursive=True, include_hidden=True, exclude=exclude):
+            if entry.is_dir:
+                self._add_watch(inotify, entry.path)
+
+    def _add_watch(self, inotify: _Inotify, directory: str) -> None:
+        try:
+            self._watches[inotify.add_watch(directory)] = directory
+        except FileNotFoundError:
+            pass
+
+    def _follow_events(self, connection: sqlite3.Connection, inotify: _Inotify) -> None:
+        try:
+            while not self._stop.is_set():
+                overflow = False
+                for wd, mask, _cookie, name in inotify.read_events(1.0):
+                    self.events += 1
+                    if mask & IN_Q_OVERFLOW:
+                        overflow = True
+                        continue
+                    if mask & IN_IGNORED:
+                        self._watches.pop(wd, None)
+                        continue
+
+                    directory = self._watches.get(wd)
+                    if directory is None:
+                        continue
+                    self.notify_changed(os.path.join(directory, name) if name else directory)
+
+                try:
+                    if overflow:
+                        # The kernel dropped events; only a rescan can tell what changed, and
+                        # directories created meanwhile need watches too
+                        with self._pending_lock:
+                            self._pending.clear()
+                        self._watch_tree(self.root, inotify)
+                        self.scan(connection)
+                        continue
+
+                    if self._pending:
+                        time.sleep(EVENT_BATCH_DELAY)
+                        # Drain what arrived during the delay too, so a burst is one transaction
+                        for wd, mask, _cookie, name in inotify.read_events(0):
+                            directory = self._watches.get(wd)
+                            if directory is not None and not mask & (IN_Q_OVERFLOW | IN_IGNORED):
+                                self.notify_changed(os.path.join(directory, name) if name else directory)
+                        self._apply_pending(connection)
+                except OSError:
+                    # Out of watches for new directories: keep the index right by polling instead
+                    self.mode = "polling"
+                    self._poll(connection)
+                    return
+        finally:
+            self._inotify = None
+            inotify.close()
+
+    def _poll(self, connection: sqlite3.Connection) -> None:
+        last_scan = time.monotonic()
+        while not self._stop.wait(1.0):
+            self._apply_pending(connection)
+            if time.monotonic() - last_scan >= RESCAN_INTERVAL:
+                self.scan(connection)
+                last_scan = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the indexer state and entry counts"""
+        connection = self.connect()
+        try:
+            files, directories = connection.execute("SELECT COALESCE(SUM(is_dir = 0), 0), COALESCE(SUM(is_dir), 0) FROM files").fetchone()
+        finally:
+            connection.close()
+        return {
+            "mode": self.mode,
+            "files": files,
+            "directories": directories,
+            "watches": len(self._watches),
+            "scans": self.scans,
+            "events": self.events,
+            "last_scan_seconds": round(self.last_scan_seconds, 3)
+        }
+
+_file_index: Optional[FileIndex] = None
+_file_index_lock = threading.Lock()
+
+def get_file_index(start: bool = True) -> FileIndex:
+    """Return the shared index of the Capri data directory, starting its indexer on first use"""
+    global _file_index
+    with _file_index_lock:
+        if _file_index is None:
+            _file_index = FileIndex()
+            register_metrics("file_index", _file_index.stats)
+    if start:
+        _file_index.start()
+    return _file_index
+
+def notify_index_changed(paths: Iterable[str]) -> None:
+    """Tell the index (if it's running) that tools changed these paths"""
+    if _file_index is None:
+        return
+    for path in paths:
+        _file_index.notify_changed(path)
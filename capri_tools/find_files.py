@@ -0,0 +1,230 @@
+import json
+import os
+import re
+from datetime import datetime
+from typing import Tuple, Optional, List, Any
+from capri_tools.tool_definition import ToolDefinition
+from capri_tools.file_index import get_file_index
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 5000
+
+SORT_COLUMNS = {
+    "path": "path",
+    "name": "name COLLATE NOCASE",
+    "size": "size",
+    "mtime": "mtime"
+}
+
+SIZE_UNITS = {"": 1, "B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "TB": 1024 ** 4}
+SIZE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?B?)\s*$", re.IGNORECASE)
+
+# Schema for find_files tool
+find_files_schema = {
+    "type": "object",
+    "properties": {
+        "name": {
+            "type": "string",
+            "description": "Optional. Text the file name must contain (case-insensitive)."
+        },
+        "pattern": {
+            "type": "string",
+            "description": "Optional. Glob pattern such as '*.mp4' or 'clips/*/final_*'. Matched against the name, or the relative path if it contains '/'."
+        },
+        "extensions": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "Optional. Only files with these extensions, e.g. ['mp4', 'mov']."
+        },
+        "path": {
+            "type": "string",
+            "description": "Optional. Only search below this directory (relative to the Capri data directory)."
+        },
+        "type": {
+            "type": "string",
+            "enum": ["file", "directory", "any"],
+            "description": "Optional. What to find (default: file)."
+        },
+        "min_size": {
+            "type": "string",
+            "description": "Optional. Minimum size, in bytes or with a unit, e.g. '500KB', '2GB'."
+        },
+        "max_size": {
+            "type": "string",
+            "description": "Optional. Maximum size, in bytes or with a unit."
+        },
+        "modified_after": {
+            "type": "string",
+            "description": "Optional. Only entries modified after this date/time (ISO format, e.g. '2024-05-01' or '2024-05-01T13:30')."
+        },
+        "modified_before": {
+            "type": "string",
+            "description": "Optional. Only entries modified before this date/time (ISO format)."
+        },
+        "sort": {
+            "type": "string",
+            "enum": list(SORT_COLUMNS),
+            "description": "Optional. Sort by path (default), name, size or mtime."
+        },
+        "reverse": {
+            "type": "boolean",
+            "description": "Optional. Reverse the sort order, e.g. newest or largest first (default: false)."
+        },
+        "format": {
+            "type": "string",
+            "enum": ["json", "compact"],
+            "description": "Optional. 'json' (default) or 'compact': one 'path<TAB>size<TAB>mtime' line per entry."
+        },
+        "limit": {
+            "type": "integer",
+            "description": f"Optional. Maximum number of results (default: {DEFAULT_LIMIT}, max: {MAX_LIMIT})."
+        }
+    }
+}
+
+def parse_size(value: Any) -> int:
+    """Parse a size given as a number of bytes or a string like '500KB' or '1.5 GB'"""
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    match = SIZE_PATTERN.match(str(value))
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+
+    unit = match.group(2).upper()
+    if unit and not unit.endswith("B"):
+        unit += "B"
+    return int(float(match.group(1)) * SIZE_UNITS[unit])
+
+def _parse_time(value: str) -> float:
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid date: {value}. Use ISO format, e.g. 2024-05-01 or 2024-05-01T13:30")
+
+def _glob_to_sqlite(pattern: str) -> str:
+    """fnmatch negates a set with [!...], SQLite's GLOB with [^...]"""
+    return pattern.replace("[!", "[^")
+
+def _escape_like(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def build_query(input_data: dict) -> Tuple[str, List[Any]]:
+    """Turn find_files arguments into a WHERE clause and its parameters"""
+    conditions: List[str] = []
+    parameters: List[Any] = []
+
+    entry_type = input_data.get("type") or "file"
+    if entry_type == "file":
+        conditions.append("is_dir = 0")
+    elif entry_type == "directory":
+        conditions.append("is_dir = 1")
+    elif entry_type != "any":
+        raise ValueError(f"Invalid type: {entry_type}. Use 'file', 'directory' or 'any'")
+
+    path = (input_data.get("path") or "").strip("/").replace(os.sep, "/")
+    if path:
+        # Range on the primary key: everything below path/ sorts between 'path/' and 'path0'
+        conditions.append("path >= ? AND path < ?")
+        parameters.extend([path + "/", path + "0"])
+
+    name = input_data.get("name")
+    if name:
+        conditions.append("name LIKE ? ESCAPE '\\'")
+        parameters.append(f"%{_escape_like(name)}%")
+
+    pattern = input_data.get("pattern")
+    if pattern:
+        conditions.append(f"{'path' if '/' in pattern else 'name'} GLOB ?")
+        parameters.append(_glob_to_sqlite(pattern))
+
+    extensions = input_data.get("extensions")
+    if extensions:
+        conditions.append(f"extension IN ({', '.join('?' * len(extensions))})")
+        parameters.extend(extension.lower().lstrip(".") for extension in extensions)
+
+    if input_data.get("min_size") is not None:
+        conditions.append("size >= ?")
+        parameters.append(parse_size(input_data["min_size"]))
+
+    if input_data.get("max_size") is not None:
+        conditions.append("size <= ?")
+        parameters.append(parse_size(input_data["max_size"]))
+
+    if input_data.get("modified_after"):
+        conditions.append("mtime > ?")
+        parameters.append(_parse_time(input_data["modified_after"]))
+
+    if input_data.get("modified_before"):
+        conditions.append("mtime < ?")
+        parameters.append(_parse_time(input_data["modified_before"]))
+
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    return where, parameters
+
+def find_files_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
+    """Find files in the Capri data directory using the file index"""
+    try:
+        input_data = json.loads(input_bytes)
+        sort = input_data.get("sort") or "path"
+        reverse = input_data.get("reverse", False)
+        output_format = input_data.get("format") or "json"
+        limit = max(1, min(int(input_data.get("limit") or DEFAULT_LIMIT), MAX_LIMIT))
+
+        if sort not in SORT_COLUMNS:
+            return "", Exception(f"Invalid sort: {sort}. Use one of: {', '.join(SORT_COLUMNS)}")
+
+        if output_format not in ("json", "compact"):
+            return "", Exception(f"Invalid format: {output_format}. Use 'json' or 'compact'")
+
+        try:
+            where, parameters = build_query(input_data)
+        except ValueError as e:
+            return "", Exception(str(e))
+
+        # Only the very first search ever waits for a full scan; later ones use the stored index
+        index = get_file_index()
+        index.wait_until_ready()
+
+        order = f" ORDER BY {SORT_COLUMNS[sort]}{' DESC' if reverse else ''}, path"
+        connection = index.connect()
+        try:
+            total = connection.execute(f"SELECT COUNT(*) FROM files{where}", parameters).fetchone()[0]
+            rows = connection.execute(f"SELECT path, is_dir, size, mtime FROM files{where}{order} LIMIT ?", parameters + [limit]).fetchall()
+        finally:
+            connection.close()
+
+        if output_format == "compact":
+            lines = [
+                f"{path}/" if is_dir else f"{path}\t{size}\t{datetime.fromtimestamp(mtime).isoformat(timespec='seconds')}"
+                for path, is_dir, size, mtime in rows
+            ]
+            if total > len(rows):
+                lines.append(f"[{len(rows)} of {total} matches shown]")
+            return "\n".join(lines) if lines else "No matching files", None
+
+        result = {
+            "results": [
+                {
+                    "path": path,
+                    "type": "directory" if is_dir else "file",
+                    "size": size,
+                    "mtime": datetime.fromtimestamp(mtime).isoformat(timespec="seconds")
+                }
+                for path, is_dir, size, mtime in rows
+            ],
+            "total": total,
+            "truncated": total > len(rows)
+        }
+        return json.dumps(result, separators=(",", ":"), ensure_ascii=False), None
+
+    except Exception as e:
+        return "", e
+
+# Create the tool definition
+find_files_tool = ToolDefinition(
+    name="find_files",
+    description="Quickly find files anywhere in the Capri data directory by name, glob pattern, extension, size or modification date. Uses an index kept up to date in the background, so it is much faster than listing directories.",
+    input_schema=find_files_schema,
+    function=find_files_function
+)
@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+from typing import Tuple, Optional
+from capri_tools.tool_definition import ToolDefinition
+from capri_tools.get_capri_dir import get_capri_dir
+from capri_tools.image_hashes import get_image_hash_index, DEFAULT_THRESHOLD, MAX_THRESHOLD, HASH_WORKERS
+from capri_tools.progress import format_bytes
+from capri_tools import image_engine
+
+# Similar groups listed in the report
+DEFAULT_MAX_GROUPS = 20
+
+# Schema for find_similar_images tool
+find_similar_images_schema = {
+    "type": "object",
+    "properties": {
+        "path": {
+            "type": "string",
+            "description": "Optional. Directory to check, relative to the Capri data directory (default: the whole Capri directory)."
+        },
+        "threshold": {
+            "type": "integer",
+            "description": f"Optional. How different two images may be and still count as near-duplicates, in bits of their 64-bit perceptual hash (0-{MAX_THRESHOLD}; 0 means visually identical, default: {DEFAULT_THRESHOLD})."
+        },
+        "max_groups": {
+            "type": "integer",
+            "description": f"Optional. Number of groups to list, largest first (default: {DEFAULT_MAX_GROUPS})."
+        },
+        "workers": {
+            "type": "integer",
+            "description": "Optional. Number of images decoded in parallel. Defaults to the number of CPU cores."
+        }
+    }
+}
+
+def find_similar_images_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
+    """Report groups of near-duplicate images in the Capri data directory"""
+    try:
+        input_data = json.loads(input_bytes)
+        path = input_data.get("path", "")
+        threshold = input_data.get("threshold")
+        threshold = DEFAULT_THRESHOLD if threshold is None else int(threshold)
+        max_groups = int(input_data.get("max_groups") or DEFAULT_MAX_GROUPS)
+        workers = int(input_data.get("workers") or HASH_WORKERS)
+
+        if not 0 <= threshold <= MAX_THRESHOLD:
+            return "", Exception(f"Invalid threshold: {threshold}. Use a value from 0 to {MAX_THRESHOLD}")
+
+        if not image_engine.pillow_available() and shutil.which("ffmpeg") is None:
+            return "", Exception("Decoding images needs Pillow (pip install Pillow) or FFmpeg")
+
+        # Get the Capri data directory
+        capri_dir = get_capri_dir()
+        target_dir = os.path.join(capri_dir, path) if path else capri_dir
+
+        if not os.path.isdir(target_dir):
+            return "", Exception(f"Directory not found: {path}")
+
+        index = get_image_hash_index()
+        groups, images = index.find_similar(target_dir, threshold, workers)
+
+        unreadable = sum(1 for image in images if image.hash is None)
+        similar = sum(len(group.files) - 1 for group in groups)
+        reclaimable = sum(group.reclaimable for group in groups)
+        lines = [
+            f"Scanned {len(images)} images: {similar} near-duplicate(s) in {len(groups)} group(s), "
+            f"{format_bytes(reclaimable)} used by the copies that aren't kept"
+        ]
+        if unreadable:
+            lines.append(f"{unreadable} image(s) could not be decoded and were left out")
+
+        for group in groups[:max_groups]:
+            lines.append(f"\n{len(group.files)} images:")
+            for number, (image, distance) in enumerate(zip(group.files, group.distances)):
+                dimensions = f"{image.width}x{image.height}, " if image.width and image.height else ""
+                note = "keep" if number == 0 else f"distance {distance}"
+                lines.append(f"  {image.relative_path} ({dimensions}{format_bytes(image.size)}, {note})")
+        if len(groups) > max_groups:
+            lines.append(f"\n[{len(groups) - max_groups} more group(s) not shown]")
+
+        return "\n".join(lines), None
+    except Exception as e:
+        return "", e
+
+# Create the tool definition
+find_similar_images_tool = ToolDefinition(
+    name="find_similar_images",
+    description="Find near-duplicate images (resized, recompressed or lightly edited copies of the same picture) in the Capri data directory, using perceptual hashes. Hashes are cached per file, so only new or changed images are decoded on later runs. Suggests the largest version of each group to keep.",
+    input_schema=find_similar_images_schema,
+    function=find_similar_images_function
+)
@@ -19,4 +19,14 @@ def get_capri_dir() -> str:
     if not os.path.exists(base_dir):
         os.makedirs(base_dir, exist_ok=True)
     
-    return base_dir
\ No newline at end of file
+    return base_dir
+
+def get_capri_state_dir(*parts: str) -> str:
+    """Get (and create) a hidden directory inside the Capri data directory for Capri's own state"""
+    state_dir = os.path.join(get_capri_dir(), ".capri", *parts)
+    
+    # Create the directory if it doesn't exist
+    if not os.path.exists(state_dir):
+        os.makedirs(state_dir, exist_ok=True)
+    
+    return state_dir
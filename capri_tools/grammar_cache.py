@@ -0,0 +1,95 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from capri_tools.tool_metrics import register_metrics
+
+# Maximum number of compiled grammars kept in memory
+DEFAULT_MAX_ENTRIES = 64
+
+class GrammarCache:
+    """LRU cache of llama.cpp grammars compiled from JSON schemas, keyed by a hash of the canonical schema"""
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def schema_key(schema: Optional[Dict[str, Any]]) -> str:
+        """Hash the canonical JSON form of a schema, so key order and whitespace don't matter"""
+        canonical = json.dumps(schema, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, schema: Optional[Dict[str, Any]]):
+        """Return the compiled grammar for a schema, compiling it on a miss. A None schema means any JSON object."""
+        key = self.schema_key(schema)
+
+        with self._lock:
+            grammar = self._entries.get(key)
+            if grammar is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return grammar
+            self.misses += 1
+
+        # Compile outside the lock; two threads racing on the same schema just compile it twice
+        grammar = self._compile(schema)
+
+        with self._lock:
+            self._entries[key] = grammar
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        return grammar
+
+    @staticmethod
+    def _compile(schema: Optional[Dict[str, Any]]):
+        from llama_cpp import LlamaGrammar
+        from llama_cpp.llama_grammar import JSON_GBNF
+
+        if schema is None:
+            return LlamaGrammar.from_string(JSON_GBNF, verbose=False)
+        return LlamaGrammar.from_json_schema(json.dumps(schema), verbose=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counts for the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+# Shared cache used by all local inference paths
+grammar_cache = GrammarCache()
+
+register_metrics("grammar_cache", grammar_cache.stats)
+
+def get_grammar_for_response_format(response_format: Dict[str, Any]):
+    """
+    Return a cached grammar for an OpenAI-style response_format, or None if it doesn't constrain output.
+
+    Passing the grammar to create_chat_completion instead of response_format skips the
+    schema-to-grammar conversion llama.cpp would otherwise redo on every call.
+    """
+    if not response_format or response_format.get("type") != "json_object":
+        return None
+    return grammar_cache.get(response_format.get("schema"))
+
+def grammar_cache_stats() -> Dict[str, Any]:
+    """Return hit/miss counts for the shared grammar cache"""
+    return grammar_cache.stats()
@@ -0,0 +1,303 @@
+import io
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    # Pillow-SIMD installs under the same name and is picked up the same way
+    from PIL import Image, ImageMath
+except ImportError:
+    Image = None
+
+# Input types decoded in-process; anything else goes through ffmpeg
+PILLOW_INPUT_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tiff", ".tif"}
+
+# Output formats Pillow writes, by the tool's output_format value (AVIF needs a Pillow
+# built with libavif, or the pillow-avif-plugin)
+PILLOW_OUTPUT_FORMATS = {"jpg": "JPEG", "jpeg": "JPEG", "png": "PNG", "webp": "WEBP", "bmp": "BMP", "tiff": "TIFF", "avif": "AVIF"}
+
+# Formats with a quality setting, which can be encoded to a size or quality target
+LOSSY_FORMATS = {"JPEG", "WEBP", "AVIF"}
+
+# Pillow quality range searched when encoding to a target
+TARGET_QUALITY_MIN = 10
+TARGET_QUALITY_MAX = 95
+
+# SSIM is computed over non-overlapping tiles of this many pixels square
+SSIM_TILE = 8
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+# Downscale by whole factors first (cheap box reduce) until within this factor of the target,
+# then resample the rest with Lanczos; 3.0 is indistinguishable from a full Lanczos resize
+REDUCING_GAP = 3.0
+
+def _resampling():
+    # Image.Resampling exists since Pillow 9.1; older versions have the constants on Image
+    return getattr(Image, "Resampling", Image)
+
+def _lanczos():
+    return _resampling().LANCZOS
+
+def pillow_available() -> bool:
+    return Image is not None
+
+def can_write(output_format: str) -> bool:
+    """Whether this Pillow build can write the output format"""
+    if Image is None or output_format.lower() not in PILLOW_OUTPUT_FORMATS:
+        return False
+    Image.init()
+    return PILLOW_OUTPUT_FORMATS[output_format.lower()] in Image.SAVE
+
+def can_target(output_format: str) -> bool:
+    """Whether the output format can be encoded to a size or quality target"""
+    return can_write(output_format) and PILLOW_OUTPUT_FORMATS[output_format.lower()] in LOSSY_FORMATS
+
+def can_process(input_path: str, output_format: str) -> bool:
+    """Whether the in-process engine handles this input file and output format"""
+    return os.path.splitext(input_path)[1].lower() in PILLOW_INPUT_EXTENSIONS and can_write(output_format)
+
+def read_dimensions(path: str) -> Tuple[int, int]:
+    """Width and height from the image header; the pixel data isn't decoded"""
+    with Image.open(path) as image:
+        return image.size
+
+def pillow_quality(ffmpeg_quality: int) -> int:
+    """Map ffmpeg's JPEG qscale (1-31, lower is better, 2 is high) to Pillow's quality (1-95)"""
+    return max(10, min(95, round(95 - (ffmpeg_quality - 2) * 3)))
+
+def cover_box(width: int, height: int, target_width: int, target_height: int) -> Tuple[float, float, float, float]:
+    """The centred region of a width x height image with the target's aspect ratio"""
+    scale = max(target_width / width, target_height / height)
+    crop_width = target_width / scale
+    crop_height = target_height / scale
+    left = (width - crop_width) / 2
+    top = (height - crop_height) / 2
+    return (left, top, left + crop_width, top + crop_height)
+
+def open_for_size(path: str, target_width: int, target_height: int):
+    """
+    Open an image for scaling to cover target_width x target_height.
+
+    JPEGs are decoded in draft mode: the decoder scales by 1/2, 1/4 or 1/8 while
+    decoding, to the smallest size that still covers the target, which skips most of
+    the work for large photos.
+    """
+    image = Image.open(path)
+    if image.format == "JPEG":
+        width, height = image.size
+        scale = max(target_width / width, target_height / height)
+        if scale < 1:
+            image.draft(image.mode, (math.ceil(width * scale), math.ceil(height * scale)))
+    return image
+
+def can_read(input_path: str) -> bool:
+    """Whether the in-process engine decodes this input file"""
+    return Image is not None and os.path.splitext(input_path)[1].lower() in PILLOW_INPUT_EXTENSIONS
+
+def grayscale_thumbnail(path: str, width: int, height: int) -> Tuple[bytes, Tuple[int, int]]:
+    """
+    The image squashed to width x height grayscale pixels (row-major bytes), and its
+    original size. JPEGs are decoded at 1/8 scale, so only a fraction of the file's
+    pixels are ever reconstructed.
+    """
+    with Image.open(path) as image:
+        size = image.size
+        if image.format == "JPEG":
+            image.draft("L", (width, height))
+        thumbnail = _resamplable(image).convert("L").resize((width, height), _resampling().BOX)
+        return thumbnail.tobytes(), size
+
+def _resamplable(image):
+    """Palette and bilevel images can only be resized with nearest-neighbour; expand them first"""
+    if image.mode in ("1", "P"):
+        return image.convert("RGBA" if "transparency" in image.info else "RGB")
+    return image
+
+def cover_resize(image, target_width: int, target_height: int):
+    """
+    Scale an image to cover the target size and crop the centre, in one resample.
+
+    Images smaller than the target in either dimension are stretched to it, as the
+    ffmpeg path does.
+    """
+    image = _resamplable(image)
+    width, height = image.size
+    if width < target_width or height < target_height:
+        return image.resize((target_width, target_height), _lanczos())
+    box = cover_box(width, height, target_width, target_height)
+    return image.resize((target_width, target_height), _lanczos(), box=box, reducing_gap=REDUCING_GAP)
+
+class EncodeTarget:
+    """What an encode must achieve: at most max_bytes, and/or an SSIM of at least min_ssim"""
+    def __init__(self, max_bytes: Optional[int] = None, min_ssim: Optional[float] = None):
+        self.max_bytes = max_bytes
+        self.min_ssim = min_ssim
+
+def _encodable(image, pillow_format: str):
+    if pillow_format == "JPEG" and image.mode not in ("RGB", "L", "CMYK"):
+        return image.convert("RGB")
+    if pillow_format == "BMP" and image.mode not in ("RGB", "L", "1", "P"):
+        return image.convert("RGB")
+    return image
+
+def encode(image, pillow_format: str, quality: Optional[int]) -> bytes:
+    """Encode an image in memory; quality is Pillow's (1-95), for lossy formats"""
+    buffer = io.BytesIO()
+    options = {"quality": quality} if pillow_format in LOSSY_FORMATS and quality is not None else {}
+    _encodable(image, pillow_format).save(buffer, pillow_format, **options)
+    return buffer.getvalue()
+
+def ssim(reference, image) -> float:
+    """
+    Mean SSIM of the luma of two same-size images, over SSIM_TILE x SSIM_TILE tiles.
+
+    Tile means of x, y, x², y² and xy come from box-resizing float images to the tile grid,
+    so the whole computation runs inside Pillow.
+    """
+    # ImageMath.eval was renamed unsafe_eval in Pillow 10.3; the expressions below are constants
+    evaluate = getattr(ImageMath, "unsafe_eval", None) or ImageMath.eval
+    width, height = reference.size
+    columns, rows = max(1, width // SSIM_TILE), max(1, height // SSIM_TILE)
+    box = (0, 0, min(width, columns * SSIM_TILE), min(height, rows * SSIM_TILE))
+
+    x = reference.convert("L").convert("F")
+    y = image.convert("L").convert("F")
+
+    def tile_means(plane):
+        return plane.resize((columns, rows), _resampling().BOX, box=box)
+
+    means = {
+        "mx": tile_means(x), "my": tile_means(y),
+        "sxx": tile_means(evaluate("a * a", a=x)), "syy": tile_means(evaluate("a * a", a=y)),
+        "sxy": tile_means(evaluate("a * b", a=x, b=y))
+    }
+    ssim_map = evaluate(
+        f"((2 * mx * my + {SSIM_C1}) * (2 * (sxy - mx * my) + {SSIM_C2}))"
+        f" / ((mx * mx + my * my + {SSIM_C1}) * ((sxx - mx * mx) + (syy - my * my) + {SSIM_C2}))",
+        **means
+    )
+    # ImageStat bins float images into a histogram; a box resize to one pixel is the exact mean
+    return ssim_map.resize((1, 1), _resampling().BOX).getpixel((0, 0))
+
+def encode_to_target(image, pillow_format: str, target: EncodeTarget) -> Tuple[bytes, int, Optional[float], bool]:
+    """
+    Binary-search the encoder quality for a target; returns (data, quality, SSIM, target met).
+
+    With max_bytes, the highest quality that fits is used; with min_ssim, the lowest quality
+    that reaches it (the smallest file that looks good enough). With both, the SSIM target
+    is met if the budget allows it, and the budget wins otherwise. The SSIM is reported
+    whenever min_ssim is set.
+    """
+    encodes: Dict[int, bytes] = {}
+    scores: Dict[int, float] = {}
+    reference = _encodable(image, pillow_format)
+
+    def encoded(quality: int) -> bytes:
+        if quality not in encodes:
+            encodes[quality] = encode(reference, pillow_format, quality)
+        return encodes[quality]
+
+    def score(quality: int) -> float:
+        if quality not in scores:
+            with Image.open(io.BytesIO(encoded(quality))) as decoded:
+                scores[quality] = ssim(reference, decoded)
+        return scores[quality]
+
+    def search(fits, prefer_high: bool) -> Optional[int]:
+        """Highest (or lowest) quality for which fits(quality) holds, assuming it is monotonic"""
+        low, high = TARGET_QUALITY_MIN, TARGET_QUALITY_MAX
+        best = None
+        while low <= high:
+            middle = (low + high) // 2
+            if fits(middle):
+                best = middle
+                if prefer_high:
+                    low = middle + 1
+                else:
+                    high = middle - 1
+            elif prefer_high:
+                high = middle - 1
+            else:
+                low = middle + 1
+        return best
+
+    met = True
+    budget_quality = TARGET_QUALITY_MAX
+    if target.max_bytes is not None:
+        budget_quality = search(lambda quality: len(encoded(quality)) <= target.max_bytes, prefer_high=True)
+        if budget_quality is None:
+            budget_quality, met = TARGET_QUALITY_MIN, False
+
+    quality = budget_quality
+    if target.min_ssim is not None:
+        quality_needed = search(lambda quality: score(quality) >= target.min_ssim, prefer_high=False)
+        if quality_needed is None or quality_needed > budget_quality:
+            met = False
+        else:
+            quality = quality_needed
+
+    return encoded(quality), quality, score(quality) if target.min_ssim is not None else None, met
+
+def save_image(image, output_path: str, output_format: str, quality: int, target: Optional[EncodeTarget] = None) -> Dict[str, Any]:
+    """
+    Write an image; quality is ffmpeg's qscale, as the tools take it. With a target, the
+    quality is searched instead (see encode_to_target). Returns what was written: bytes,
+    the Pillow quality used and, for quality targets, the SSIM and whether the target was met.
+    """
+    pillow_format = PILLOW_OUTPUT_FORMATS[output_format.lower()]
+    result: Dict[str, Any] = {"path": output_path}
+    if target is not None and pillow_format in LOSSY_FORMATS:
+        data, used_quality, score, met = encode_to_target(image, pillow_format, target)
+        result.update(quality=used_quality, target_met=met)
+        if score is not None:
+            result["ssim"] = round(score, 4)
+    else:
+        used_quality = pillow_quality(quality) if pillow_format in LOSSY_FORMATS else None
+        data = encode(image, pillow_format, used_quality)
+        if used_quality is not None:
+            result["quality"] = used_quality
+    with open(output_path, "wb") as file:
+        file.write(data)
+    result["bytes"] = len(data)
+    return result
+
+def crop_resize(input_path: str, output_path: str, target_width: int, target_height: int, quality: int,
+                output_format: Optional[str] = None, target: Optional[EncodeTarget] = None) -> Dict[str, Any]:
+    """
+    Cover-scale and centre-crop one image in-process; returns what save_image wrote.
+    Raises on anything Pillow can't read or write.
+    """
+    output_format = output_format or os.path.splitext(output_path)[1][1:]
+    with open_for_size(input_path, target_width, target_height) as image:
+        resized = cover_resize(image, target_width, target_height)
+    return save_image(resized, output_path, output_format, quality, target)
+
+def render_renditions(input_path: str, targets: List[Tuple[str, int, int, str, int]],
+                      target: Optional[EncodeTarget] = None) -> List[Dict[str, Any]]:
+    """
+    Write several cover-cropped sizes of one image from a single decode.
+
+    targets are (output path, width, height, format, quality). The image is decoded once,
+    at the draft size the largest target needs, and sizes are produced largest first. Between
+    them the full frame is box-reduced by whole factors, so each size is resampled from the
+    previous, smaller intermediate rather than from the original pixels. Returns what
+    save_image wrote for each target, in the order given.
+    """
+    def cover_scale(size: Tuple[int, int], width: int, height: int) -> float:
+        return max(width / size[0], height / size[1])
+
+    size = read_dimensions(input_path)
+    ordered = sorted(targets, key=lambda target: cover_scale(size, target[1], target[2]), reverse=True)
+    with open_for_size(input_path, ordered[0][1], ordered[0][2]) as image:
+        # Copied so the pixels outlive the file handle
+        working = _resamplable(image).copy()
+
+    results = {}
+    for output_path, width, height, output_format, quality in ordered:
+        # Whole-factor reduce keeps the intermediate at least as large as this target needs
+        factor = int(1 / cover_scale(working.size, width, height))
+        if factor >= 2:
+            working = working.reduce(factor)
+        results[output_path] = save_image(cover_resize(working, width, height), output_path, output_format, quality, target)
+    return [results[output_path] for output_path, _width, _height, _output_format, _quality in targets]
@@ -0,0 +1,386 @@
+import os
+import sqlite3
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional, Tuple
+from capri_tools.get_capri_dir import get_capri_dir, get_capri_state_dir
+from capri_tools.list_files import iter_entries
+from capri_tools.media_catalog import IMAGE_EXTENSIONS
+from capri_tools.progress import ProgressReporter
+from capri_tools.tool_metrics import register_metrics
+from capri_tools import image_engine
+
+# Name of the image hash database inside the Capri state directory
+HASH_DATABASE_FILE = "image_hashes.sqlite3"
+
+# dHash compares neighbouring pixels of a 9x8 grayscale thumbnail: 8 comparisons per row,
+# 8 rows, 64 bits
+HASH_WIDTH = 9
+HASH_HEIGHT = 8
+
+# Images that differ in at most this many of the 64 bits are near-duplicates: the same
+# picture resized, recompressed or lightly edited
+DEFAULT_THRESHOLD = 6
+
+# Past this, unrelated images start matching, and searches have to probe thousands of buckets
+MAX_THRESHOLD = 16
+
+# Hashes are indexed by 4 chunks of 16 bits for near-duplicate search (see MultiIndex)
+HASH_CHUNKS = 4
+CHUNK_BITS = 16
+
+# Images hashed at once; Pillow and ffmpeg both decode outside the GIL
+HASH_WORKERS = os.cpu_count() or 1
+
+# Hashes written per transaction, so an interrupted scan of a large library keeps its work
+WRITE_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash INTEGER,
+    width INTEGER,
+    height INTEGER
+);
+"""
+
+# int.bit_count needs Python 3.10
+_popcount = getattr(int, "bit_count", None) or (lambda value: bin(value).count("1"))
+
+class ImageHashError(Exception):
+    pass
+
+def hamming_distance(a: int, b: int) -> int:
+    return _popcount(a ^ b)
+
+def _to_signed(value: int) -> int:
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+def _ffmpeg_thumbnail(path: str) -> bytes:
+    result = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", path, "-frames:v", "1",
+         "-vf", f"scale={HASH_WIDTH}:{HASH_HEIGHT}:flags=area,format=gray", "-f", "rawvideo", "-"],
+        capture_output=True
+    )
+    if result.returncode != 0 or len(result.stdout) != HASH_WIDTH * HASH_HEIGHT:
+        raise ImageHashError(result.stderr.decode("utf-8", "replace").strip() or f"ffmpeg could not decode {path}")
+    return result.stdout
+
+def compute_dhash(path: str) -> Tuple[int, Optional[Tuple[int, int]]]:
+    """
+    Difference hash of an image, and its dimensions when they come for free.
+
+    Each bit says whether a pixel of the 9x8 grayscale thumbnail is brighter than its right
+    neighbour, so the hash follows the image's structure and survives resizing, recompression
+    and small colour changes. Pillow decodes where it can; ffmpeg does the rest (HEIC, GIF,
+    files Pillow rejects).
+    """
+    pixels = None
+    size = None
+    if image_engine.can_read(path):
+        try:
+            pixels, size = image_engine.grayscale_thumbnail(path, HASH_WIDTH, HASH_HEIGHT)
+        except Exception:
+            pixels = None
+    if pixels is None:
+        pixels = _ffmpeg_thumbnail(path)
+
+    value = 0
+    for row in range(HASH_HEIGHT):
+        start = row * HASH_WIDTH
+        for column in range(HASH_WIDTH - 1):
+            value = (value << 1) | (pixels[start + column] > pixels[start + column + 1])
+    return value, size
+
+class ImageHash:
+    """An image file with its perceptual hash (None if it couldn't be decoded)"""
+    __slots__ = ("path", "relative_path", "size", "mtime_ns", "hash", "width", "height")
+
+    def __init__(self, path: str, relative_path: str, size: int, mtime_ns: int):
+        self.path = path
+        self.relative_path = relative_path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.hash: Optional[int] = None
+        self.width: Optional[int] = None
+        self.height: Optional[int] = None
+
+    @property
+    def pixels(self) -> int:
+        return (self.width or 0) * (self.height or 0)
+
+class SimilarGroup:
+    """Near-duplicate images; files[0] is the one to keep and distances[i] is how far files[i] is from it"""
+    def __init__(self, files: List[ImageHash]):
+        # Keep the largest version: most pixels, then most bytes
+        files.sort(key=lambda file: (-file.pixels, -file.size, file.relative_path))
+        self.files = files
+        self.distances = [hamming_distance(files[0].hash, file.hash) for file in files]
+
+    @property
+    def reclaimable(self) -> int:
+        return sum(file.size for file in self.files[1:])
+
+class MultiIndex:
+    """
+    Multi-index hashing over 64-bit hashes, for finding every stored hash within a Hamming
+    distance of a query without comparing against all of them.
+
+    Hashes are split into HASH_CHUNKS chunks, each indexed in its own table. If two hashes
+    differ in at most t bits, one of their chunks differs in at most t // HASH_CHUNKS bits
+    (pigeonhole), so a search only looks in the buckets of each query chunk with up to that
+    many bits flipped: 4 exact lookups for t < 4, 68 for the default threshold. A bucket
+    of 16-bit chunks holds about n / 65536 hashes, so a search costs a few dozen distance
+    checks even with hundreds of thousands of images stored.
+    """
+    def __init__(self, threshold: int):
+        self.threshold = threshold
+        radius = threshold // HASH_CHUNKS
+        # Every way of flipping up to radius bits of a chunk
+        self.masks = [sum(1 << bit for bit in bits) for flips in range(radius + 1)
+                      for bits in combinations(range(CHUNK_BITS), flips)]
+        self.tables: List[Dict[int, List[int]]] = [{} for _ in range(HASH_CHUNKS)]
+
+    @staticmethod
+    def _chunks(value: int) -> List[int]:
+        mask = (1 << CHUNK_BITS) - 1
+        return [(value >> (chunk * CHUNK_BITS)) & mask for chunk in range(HASH_CHUNKS)]
+
+    def add(self, value: int) -> None:
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            table.setdefault(chunk, []).append(value)
+
+    def search(self, value: int) -> List[Tuple[int, int]]:
+        """(hash, distance) of every stored hash within the threshold of value"""
+        found = []
+        checked = set()
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            for mask in self.masks:
+                for candidate in table.get(chunk ^ mask, ()):
+                    if candidate in checked:
+                        continue
+                    checked.add(candidate)
+                    distance = hamming_distance(value, candidate)
+                    if distance <= self.threshold:
+                        found.append((candidate, distance))
+        return found
+
+def group_similar(images: Iterable[ImageHash], threshold: int = DEFAULT_THRESHOLD) -> List[SimilarGroup]:
+    """
+    Group images whose hashes are within threshold of each other, largest groups first.
+
+    Identical hashes are merged up front, then each distinct hash is looked up in a
+    multi-index of the hashes before it and linked to its matches with union-find. Grouping is
+    transitive: A and C end up together if both are close to B.
+    """
+    by_hash: Dict[int, List[ImageHash]] = {}
+    for image in images:
+        if image.hash is not None:
+            by_hash.setdefault(image.hash, []).append(image)
+
+    parent = {value: value for value in by_hash}
+
+    def find(value: int) -> int:
+        while parent[value] != value:
+            parent[value] = parent[parent[value]]
+            value = parent[value]
+        return value
+
+    if threshold > 0:
+        index = MultiIndex(threshold)
+        for value in by_hash:
+            for match, _distance in index.search(value):
+                root, other = find(value), find(match)
+                if root != other:
+                    parent[other] = root
+            index.add(value)
+
+    components: Dict[int, List[ImageHash]] = {}
+    for value, same in by_hash.items():
+        components.setdefault(find(value), []).extend(same)
+
+    groups = [SimilarGroup(files) for files in components.values() if len(files) > 1]
+    groups.sort(key=lambda group: (-len(group.files), -group.reclaimable, group.files[0].relative_path))
+    return groups
+
+class ImageHashIndex:
+    """
+    Perceptual hashes of the images in the Capri data directory, cached in SQLite.
+
+    A cached hash is reused while the file's size and mtime are unchanged, so only new or
+    edited images are decoded when a library is checked again. Files that can't be decoded
+    are remembered too (with no hash) until they change.
+    """
+    def __init__(self, root: Optional[str] = None, database_path: Optional[str] = None):
+        self.root = root or get_capri_dir()
+        self.database_path = database_path or os.path.join(get_capri_state_dir(), HASH_DATABASE_FILE)
+        self.cache_hits = 0
+        self.hashed_images = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+        connection = self.connect()
+        try:
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.database_path, timeout=30, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def relative_path(self, path: str) -> str:
+        return os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, "/")
+
+    def scan(self, directory: str) -> List[ImageHash]:
+        """Image files below directory; hidden files and directories (Capri's own state among them) are skipped"""
+        images = []
+        for entry in iter_entries(directory, recursive=True):
+            if entry.is_dir or os.path.splitext(entry.name)[1][1:].lower() not in IMAGE_EXTENSIONS:
+                continue
+            stat = entry.stat()
+            if stat is None:
+                continue
+            images.append(ImageHash(entry.path, self.relative_path(entry.path), stat.st_size, stat.st_mtime_ns))
+        return images
+
+    def images_for_paths(self, paths: Iterable[str]) -> List[ImageHash]:
+        """ImageHash entries (not yet hashed) for full paths; files that are gone are left out"""
+        images = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            images.append(ImageHash(path, self.relative_path(path), stat.st_size, stat.st_mtime_ns))
+        return images
+
+    def hash_images(self, images: List[ImageHash], workers: int = HASH_WORKERS, progress_output=None) -> None:
+        """Fill in the hash of every image, from the cache where it's still valid, decoding the rest in parallel"""
+        connection = self.connect()
+        try:
+            cached: Dict[str, Tuple[int, int, Optional[int], Optional[int], Optional[int]]] = {}
+            paths = [image.relative_path for image in images]
+            # Looked up in slices to stay under SQLite's variable limit
+            for start in range(0, len(paths), 500):
+                chunk = paths[start:start + 500]
+                for path, size, mtime_ns, value, width, height in connection.execute(
+                    f"SELECT path, size, mtime_ns, hash, width, height FROM image_hashes WHERE path IN ({', '.join('?' * len(chunk))})", chunk
+                ):
+                    cached[path] = (size, mtime_ns, value, width, height)
+
+            pending = []
+            for image in images:
+                entry = cached.get(image.relative_path)
+                if entry is not None and entry[:2] == (image.size, image.mtime_ns):
+                    image.hash = _to_unsigned(entry[2]) if entry[2] is not None else None
+                    image.width, image.height = entry[3], entry[4]
+                    self.cache_hits += 1
+                else:
+                    pending.append(image)
+
+            if not pending:
+                return
+
+            progress = ProgressReporter("Hashing images", unit="images", total_items=len(pending), output=progress_output)
+
+            def hash_one(image: ImageHash) -> Tuple[ImageHash, bool]:
+                cacheable = True
+                try:
+                    image.hash, dimensions = compute_dhash(image.path)
+                    if dimensions:
+                        image.width, image.height = dimensions
+                    self._count("hashed_images")
+                except ImageHashError:
+                    self._count("failures")
+                except OSError:
+                    # Unreadable right now (or ffmpeg missing): try again next time
+                    self._count("failures")
+                    cacheable = False
+                progress.advance(items=1)
+                return image, cacheable
+
+            batch = []
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="capri-phash") as executor:
+                for image, cacheable in executor.map(hash_one, pending):
+                    if not cacheable:
+                        continue
+                    batch.append((image.relative_path, image.size, image.mtime_ns,
+                                  _to_signed(image.hash) if image.hash is not None else None, image.width, image.height))
+                    if len(batch) >= WRITE_BATCH_SIZE:
+                        self._write(connection, batch)
+                        batch = []
+            if batch:
+                self._write(connection, batch)
+            progress.finish()
+        finally:
+            connection.close()
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _write(self, connection: sqlite3.Connection, rows: List[Tuple]) -> None:
+        connection.executemany(
+            "INSERT OR REPLACE INTO image_hashes (path, size, mtime_ns, hash, width, height) VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+        connection.commit()
+
+    def prune(self, directory: str, existing: List[ImageHash]) -> None:
+        """Forget cached hashes of images below directory that no longer exist"""
+        prefix = self.relative_path(directory)
+        seen = {image.relative_path for image in existing}
+        connection = self.connect()
+        try:
+            if prefix == ".":
+                rows = connection.execute("SELECT path FROM image_hashes")
+            else:
+                rows = connection.execute("SELECT path FROM image_hashes WHERE path >= ? AND path < ?", (prefix + "/", prefix + "0"))
+            gone = [(path,) for (path,) in rows if path not in seen]
+            connection.executemany("DELETE FROM image_hashes WHERE path = ?", gone)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def find_similar(self, directory: str, threshold: int = DEFAULT_THRESHOLD, workers: int = HASH_WORKERS,
+                     progress_output=print) -> Tuple[List[SimilarGroup], List[ImageHash]]:
+        """Groups of near-duplicate images below directory, and every image scanned"""
+        images = self.scan(directory)
+        self.prune(directory, images)
+        self.hash_images(images, workers, progress_output)
+        return group_similar(images, threshold), images
+
+    def stats(self) -> Dict[str, int]:
+        connection = self.connect()
+        try:
+            entries = connection.execute("SELECT COUNT(*) FROM image_hashes").fetchone()[0]
+        finally:
+            connection.close()
+        return {
+            "entries": entries,
+            "cache_hits": self.cache_hits,
+            "hashed_images": self.hashed_images,
+            "failures": self.failures
+        }
+
+_image_hash_index: Optional[ImageHashIndex] = None
+_image_hash_index_lock = threading.Lock()
+
+def get_image_hash_index() -> ImageHashIndex:
+    """Return the shared image hash index of the Capri data directory"""
+    global _image_hash_index
+    with _image_hash_index_lock:
+        if _image_hash_index is None:
+            _image_hash_index = ImageHashIndex()
+            register_metrics("image_hashes", _image_hash_index.stats)
+        return _image_hash_index
@@ -4,6 +4,11 @@ import subprocess
 from typing import Tuple, Optional, List
 from capri_tools.tool_definition import ToolDefinition
 from capri_tools.get_capri_dir import get_capri_dir
+from capri_tools.media_catalog import get_media_catalog, MediaProbeError
+from capri_tools import smart_render
+
+# "exact" re-encodes everything kept; "fast" stream-copies whole GOPs and re-encodes only at the cuts
+MODES = ("exact", "fast")
 
 # Schema for keep_segments_from_video tool
 keep_segments_from_video_schema = {
@@ -29,11 +34,73 @@ keep_segments_from_video_schema = {
                     "description": "Time in seconds."
                 }
             }
+        },
+        "mode": {
+            "type": "string",
+            "enum": list(MODES),
+            "description": "Optional. 'exact' (default) re-encodes all kept video. 'fast' copies the video between keyframes untouched and re-encodes only the few frames around each cut, so it runs at disk speed and keeps the original quality; it falls back to 'exact' for files it can't handle.",
+            "default": "exact"
         }
     },
     "required": ["input_path", "segments_to_keep"]
 }
 
+def render_with_filters(full_input_path: str, full_output_path: str, segments_to_keep: List[List[float]], has_audio: bool) -> Optional[str]:
+    """Cut and join segments with a trim/atrim + concat filter graph, re-encoding everything; returns an error or None"""
+    # Build ffmpeg filter complex command
+    filter_parts = []
+    video_parts = []
+    audio_parts = []
+    
+    for i, (start_time, end_time) in enumerate(segments_to_keep):
+        # Create trim filter for video
+        filter_parts.append(
+            f"[0:v]trim=start={start_time}:end={end_time},setpts=PTS-STARTPTS[v{i}]"
+        )
+        video_parts.append(f"[v{i}]")
+        
+        # Create trim filter for audio if it exists
+        if has_audio:
+            filter_parts.append(
+                f"[0:a]atrim=start={start_time}:end={end_time},asetpts=PTS-STARTPTS[a{i}]"
+            )
+            audio_parts.append(f"[a{i}]")
+    
+    # Add concat filter - properly format the input streams
+    if has_audio:
+        # Create the string of inputs for concat filter; concat takes each segment's
+        # streams together: [v0][a0][v1][a1]...
+        concat_inputs = "".join(video + audio for video, audio in zip(video_parts, audio_parts))
+        filter_parts.append(
+            f"{concat_inputs}concat=n={len(segments_to_keep)}:v=1:a=1[outv][outa]"
+        )
+        mapping = ["-map", "[outv]", "-map", "[outa]"]
+    else:
+        # Create the string of inputs for concat filter
+        concat_inputs = "".join(video_parts)
+        filter_parts.append(
+            f"{concat_inputs}concat=n={len(segments_to_keep)}:v=1:a=0[outv]"
+        )
+        mapping = ["-map", "[outv]"]
+    
+    # Combine all filter parts
+    filter_complex = "; ".join(filter_parts)
+    
+    # Build ffmpeg command
+    cmd = ["ffmpeg", "-i", full_input_path, "-filter_complex", filter_complex] + mapping + [full_output_path]
+    
+    # For debugging, print the command
+    cmd_str = " ".join(cmd)
+    print(f"Executing command: {cmd_str}")
+    
+    # Run ffmpeg command
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    
+    if result.returncode != 0:
+        return f"FFmpeg error: {result.stderr}"
+    
+    return None
+
 def keep_segments_from_video_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
     """Keep specified segments from a video and concatenate them using ffmpeg"""
     try:
@@ -41,6 +108,10 @@ def keep_segments_from_video_function(input_bytes: bytes) -> Tuple[str, Optional
         input_path = input_data.get("input_path", "")
         output_path = input_data.get("output_path", "")
         segments_to_keep = input_data.get("segments_to_keep", [])
+        mode = input_data.get("mode") or "exact"
+        
+        if mode not in MODES:
+            return "", Exception(f"Invalid mode: {mode}. Use 'exact' or 'fast'")
         
         if not input_path:
             return "", Exception("No input file path provided")
@@ -71,78 +142,36 @@ def keep_segments_from_video_function(input_bytes: bytes) -> Tuple[str, Optional
             
         full_output_path = os.path.join(capri_dir, output_path)
         
-        # First, check if the input file has audio
-        probe_cmd = [
-            "ffprobe", 
-            "-v", "error", 
-            "-select_streams", "a", 
-            "-show_entries", "stream=codec_type", 
-            "-of", "json", 
-            full_input_path
-        ]
-        
-        probe_result = subprocess.run(probe_cmd, capture_output=True, text=True)
-        has_audio = '"codec_type": "audio"' in probe_result.stdout
-        
-        # Build ffmpeg filter complex command
-        filter_parts = []
-        video_parts = []
-        audio_parts = []
-        
-        for i, (start_time, end_time) in enumerate(segments_to_keep):
-            # Create trim filter for video
-            filter_parts.append(
-                f"[0:v]trim=start={start_time}:end={end_time},setpts=PTS-STARTPTS[v{i}]"
-            )
-            video_parts.append(f"[v{i}]")
-            
-            # Create trim filter for audio if it exists
-            if has_audio:
-                filter_parts.append(
-                    f"[0:a]atrim=start={start_time}:end={end_time},asetpts=PTS-STARTPTS[a{i}]"
-                )
-                audio_parts.append(f"[a{i}]")
-        
-        # Add concat filter - properly format the input streams
-        if has_audio:
-            # Create the string of inputs for concat filter
-            concat_inputs = "".join(video_parts) + "".join(audio_parts)
-            filter_parts.append(
-                f"{concat_inputs}concat=n={len(segments_to_keep)}:v=1:a=1[outv][outa]"
-            )
-            mapping = ["-map", "[outv]", "-map", "[outa]"]
-        else:
-            # Create the string of inputs for concat filter
-            concat_inputs = "".join(video_parts)
-            filter_parts.append(
-                f"{concat_inputs}concat=n={len(segments_to_keep)}:v=1:a=0[outv]"
-            )
-            mapping = ["-map", "[outv]"]
-        
-        # Combine all filter parts
-        filter_complex = "; ".join(filter_parts)
-        
-        # Build ffmpeg command
-        cmd = ["ffmpeg", "-i", full_input_path, "-filter_complex", filter_complex] + mapping + [full_output_path]
-        
-        # For debugging, print the command
-        cmd_str = " ".join(cmd)
-        print(f"Executing command: {cmd_str}")
-        
-        # Run ffmpeg command
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            return "", Exception(f"FFmpeg error: {result.stderr}")
-        
-        return f"Successfully created edited video at {output_path}", None
+        # First, check if the input file has audio (from the media catalog, probed once per file
+        # version; fast mode also needs the keyframe positions, which are cataloged the same way)
+        info = get_media_catalog().probe(full_input_path, keyframes=mode == "fast")
+        has_audio = info.has_audio
+        
+        note = ""
+        if mode == "fast":
+            reason = smart_render.unsupported_reason(info)
+            if reason is None:
+                try:
+                    segments = [(float(start_time), float(end_time)) for start_time, end_time in segments_to_keep]
+                    stats = smart_render.smart_render(full_input_path, full_output_path, segments, info)
+                    return (f"Successfully created edited video at {output_path} "
+                            f"({stats.copied_seconds:.1f}s copied, {stats.encoded_seconds:.1f}s re-encoded at the cuts)"), None
+                except (smart_render.SmartRenderError, MediaProbeError, OSError) as e:
+                    reason = str(e).splitlines()[-1] if str(e) else type(e).__name__
+            note = f" (fast mode was not possible: {reason}; re-encoded instead)"
+        
+        error = render_with_filters(full_input_path, full_output_path, segments_to_keep, has_audio)
+        if error:
+            return "", Exception(error + note)
+        
+        return f"Successfully created edited video at {output_path}{note}", None
     except Exception as e:
         return "", e
 
 # Create the tool definition
 keep_segments_from_video_tool = ToolDefinition(
     name="keep_segments_from_video",
-    description="Keep specified segments from a video and concatenate them together. Provide the input video path and a list of time segments to keep.",
+    description="Keep specified segments from a video and concatenate them together. Provide the input video path and a list of time segments to keep. In fast mode, video between keyframes is copied without re-encoding.",
     input_schema=keep_segments_from_video_schema,
     function=keep_segments_from_video_function
 )
\ No newline at end of file
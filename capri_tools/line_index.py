@@ -0,0 +1,219 @@
+import bisect
+import hashlib
+import mmap
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# The index stores one newline count per block, so its memory is a few bytes per megabyte
+# of file. Finding a line means a binary search over blocks plus a scan of at most one block.
+BLOCK_SIZE = 1 << 20
+
+# Pieces of the indexed contents (bytes each, and how many, spread from the start to the
+# end) that must be unchanged for a larger file to count as appended to
+SAMPLE_BYTES = 4096
+SAMPLE_COUNT = 8
+
+# Maximum number of files whose index is kept in memory
+MAX_CACHED_INDEXES = 64
+
+class LineIndex:
+    """Newline counts per fixed-size block of a file, valid for one (path, size, mtime)"""
+    def __init__(self, path: str):
+        self.path = path
+        self.size = 0
+        self.mtime_ns = 0
+        # block_newlines[i] = number of newlines before offset i * BLOCK_SIZE
+        self.block_newlines = array('Q', [0])
+        self.newlines = 0
+        # (device, inode) and sampled digest of the indexed contents, to tell appends from rewrites
+        self.file_id: Tuple[int, int] = (0, 0)
+        self.sample_digest = b""
+        self.last_byte = b""
+
+    @property
+    def line_count(self) -> int:
+        """Number of lines, counting a last line without a trailing newline"""
+        if self.size == 0:
+            return 0
+        return self.newlines + (0 if self.last_byte == b"\n" else 1)
+
+    @staticmethod
+    def _sample_digest(mm, size: int) -> bytes:
+        """Digest of SAMPLE_COUNT evenly spaced SAMPLE_BYTES pieces of the first size bytes, from the start to the very end"""
+        hasher = hashlib.blake2b(digest_size=16)
+        length = min(SAMPLE_BYTES, size)
+        for i in range(SAMPLE_COUNT):
+            offset = (size - length) * i // (SAMPLE_COUNT - 1)
+            hasher.update(mm[offset:offset + length])
+        return hasher.digest()
+
+    def update(self, mm, size: int, mtime_ns: int, file_id: Tuple[int, int] = (0, 0)) -> None:
+        """
+        Index the file up to size, continuing from the previous size if the file was only
+        appended to: same file (device and inode), strictly larger, and samples of the
+        previously indexed bytes, including the last ones, unchanged. Anything else is
+        indexed again from the start.
+        """
+        appended = (self.size > 0 and size > self.size and file_id == self.file_id
+                    and self._sample_digest(mm, self.size) == self.sample_digest)
+
+        if appended:
+            # Recount from the start of the last (partial) block
+            start_block = self.size // BLOCK_SIZE
+            del self.block_newlines[start_block + 1:]
+            newlines = self.block_newlines[start_block]
+        else:
+            start_block = 0
+            self.block_newlines = array('Q', [0])
+            newlines = 0
+
+        offset = start_block * BLOCK_SIZE
+        while offset < size:
+            end = min(offset + BLOCK_SIZE, size)
+            newlines += mm[offset:end].count(b"\n")
+            if end - offset == BLOCK_SIZE:
+                self.block_newlines.append(newlines)
+            offset = end
+
+        self.newlines = newlines
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.file_id = file_id
+        self.sample_digest = self._sample_digest(mm, size) if size else b""
+        self.last_byte = mm[size - 1:size] if size else b""
+
+    def line_start(self, mm, line: int) -> int:
+        """Byte offset where a 1-based line starts (the file size if past the end)"""
+        if line <= 1:
+            return 0
+
+        # The line starts right after the (line - 1)th newline
+        target = line - 1
+        if target > self.newlines:
+            return self.size
+
+        block = bisect.bisect_left(self.block_newlines, target) - 1
+        position = block * BLOCK_SIZE
+        remaining = target - self.block_newlines[block]
+
+        while remaining > 0:
+            position = mm.find(b"\n", position) + 1
+            remaining -= 1
+
+        return position
+
+_indexes: "OrderedDict[str, LineIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def get_line_index(path: str, mm, stat: os.stat_result) -> LineIndex:
+    """Return an up-to-date line index for an open, memory-mapped file"""
+    key = os.path.realpath(path)
+
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = LineIndex(key)
+            _indexes[key] = index
+        _indexes.move_to_end(key)
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+
+        if index.size != stat.st_size or index.mtime_ns != stat.st_mtime_ns:
+            index.update(mm, stat.st_size, stat.st_mtime_ns, (stat.st_dev, stat.st_ino))
+
+        return index
+
+def invalidate_line_index(path: str) -> None:
+    """Drop the cached index for a file (or every file under a directory)"""
+    key = os.path.realpath(path)
+    with _indexes_lock:
+        for cached in list(_indexes):
+            if cached == key or cached.startswith(key.rstrip(os.sep) + os.sep):
+                del _indexes[cached]
+
+class MappedFile:
+    """Read-only memory map of a file, usable as a context manager. Empty files map to b''."""
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+        self.mm = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'rb')
+        self.stat = os.fstat(self.file.fileno())
+        if self.stat.st_size > 0:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.mm = b""
+        return self
+
+    def __exit__(self, *exc_info):
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+        self.file.close()
+
+def count_lines(path: str) -> int:
+    """Number of lines in a file, from the cached index"""
+    with MappedFile(path) as mapped:
+        return get_line_index(path, mapped.mm, mapped.stat).line_count
+
+def read_line_range(path: str, start_line: int, end_line: Optional[int],
+                    max_bytes: Optional[int] = None) -> Tuple[bytes, int, int, int]:
+    """
+    Read 1-based lines start_line..end_line (inclusive) of a file, copying at most max_bytes.
+
+    Returns (data, first line, last line, total lines). The last line reported is the
+    requested one; when max_bytes cuts the range short, the data ends mid-range.
+    """
+    with MappedFile(path) as mapped:
+        index = get_line_index(path, mapped.mm, mapped.stat)
+        total = index.line_count
+        start_line = max(1, start_line)
+        end_line = total if end_line is None else min(end_line, total)
+        if start_line > end_line:
+            return b"", start_line, end_line, total
+
+        start = index.line_start(mapped.mm, start_line)
+        end = index.line_start(mapped.mm, end_line + 1)
+        if max_bytes is not None:
+            end = min(end, start + max_bytes)
+        return mapped.mm[start:end], start_line, end_line, total
+
+def read_head(path: str, lines: int, max_bytes: Optional[int] = None) -> bytes:
+    """Read the first N lines of a file (at most max_bytes) without indexing it"""
+    with MappedFile(path) as mapped:
+        limit = mapped.stat.st_size if max_bytes is None else min(mapped.stat.st_size, max_bytes)
+        position = 0
+        for _ in range(lines):
+            position = mapped.mm.find(b"\n", position, limit) + 1
+            if position == 0:
+                return mapped.mm[:limit]
+        return mapped.mm[:position]
+
+def read_tail(path: str, lines: int, max_bytes: Optional[int] = None) -> bytes:
+    """Read the last N lines of a file (at most max_bytes), scanning backwards from the end"""
+    with MappedFile(path) as mapped:
+        size = mapped.stat.st_size
+        if size == 0 or lines <= 0:
+            return b""
+
+        floor = 0 if max_bytes is None else max(0, size - max_bytes)
+
+        # A trailing newline ends the last line; it doesn't start a new one
+        position = size - 1 if mapped.mm[size - 1:size] == b"\n" else size
+        for _ in range(lines):
+            position = mapped.mm.rfind(b"\n", floor, position)
+            if position == -1:
+                return mapped.mm[floor:]
+        return mapped.mm[position + 1:]
+
+def read_byte_range(path: str, offset: int, length: Optional[int]) -> Tuple[bytes, int]:
+    """Read length bytes starting at offset (to the end of the file if length is None). Returns (data, file size)."""
+    with MappedFile(path) as mapped:
+        size = mapped.stat.st_size
+        offset = max(0, offset if offset >= 0 else size + offset)
+        end = size if length is None else min(size, offset + length)
+        return mapped.mm[offset:end], size
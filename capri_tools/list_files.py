@@ -1,9 +1,16 @@
+import fnmatch
+import heapq
 import json
 import os
-from typing import Tuple, Optional, Dict, List
+from typing import Tuple, Optional, Dict, List, Iterator, Any, Callable
 from capri_tools.tool_definition import ToolDefinition
 from capri_tools.get_capri_dir import get_capri_dir
 
+# Largest page that can be asked for; without a limit the whole listing is returned
+MAX_LIMIT = 10000
+
+SORT_KEYS = ("name", "size", "mtime", "none")
+
 # Schema for list_files tool
 list_files_schema = {
     "type": "object",
@@ -11,52 +18,307 @@ list_files_schema = {
         "path": {
             "type": "string",
             "description": "The relative path of a directory in the Capri data directory. Leave empty to list files in the root Capri directory."
+        },
+        "recursive": {
+            "type": "boolean",
+            "description": "Optional. Also list the contents of subdirectories (default: false)."
+        },
+        "max_depth": {
+            "type": "integer",
+            "description": "Optional. With recursive, how many directory levels to descend (1 = only the given directory; default: no limit)."
+        },
+        "pattern": {
+            "type": "string",
+            "description": "Optional. Glob pattern such as '*.mp4' or 'clips/*_final.*'. Matched against the name, or the relative path if it contains '/'."
+        },
+        "extensions": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "Optional. Only list files with these extensions, e.g. ['mp4', 'mov']. Directories are left out."
+        },
+        "include_hidden": {
+            "type": "boolean",
+            "description": "Optional. Include entries whose name starts with '.' (default: true)."
+        },
+        "sort": {
+            "type": "string",
+            "enum": list(SORT_KEYS),
+            "description": "Optional. Sort by name (default), size or mtime, or 'none' for directory order, which is fastest on huge directories."
+        },
+        "reverse": {
+            "type": "boolean",
+            "description": "Optional. Reverse the sort order, e.g. newest or largest first (default: false)."
+        },
+        "details": {
+            "type": "boolean",
+            "description": "Optional. Include size in bytes and modification time for each file (default: false)."
+        },
+        "format": {
+            "type": "string",
+            "enum": ["json", "compact"],
+            "description": "Optional. 'json' (default) or 'compact': one entry per line, directories ending in '/'."
+        },
+        "limit": {
+            "type": "integer",
+            "description": f"Optional. Maximum number of entries to return, up to {MAX_LIMIT}; the rest can be fetched with next_cursor (default: no limit)."
+        },
+        "cursor": {
+            "type": "string",
+            "description": "Optional. The next_cursor value from a previous call with the same arguments, to get the next page."
         }
     }
 }
 
+class ListedEntry:
+    """A directory entry found by iter_entries, with its path relative to the listed directory"""
+    __slots__ = ("path", "relative_path", "name", "is_dir", "_entry", "_stat")
+
+    def __init__(self, entry: os.DirEntry, relative_path: str, is_dir: bool):
+        self.path = entry.path
+        self.relative_path = relative_path
+        self.name = entry.name
+        self.is_dir = is_dir
+        self._entry = entry
+        self._stat = None
+
+    def stat(self) -> Optional[os.stat_result]:
+        """Stat the entry on first use (None if it vanished); listings that don't need it never pay for it"""
+        if self._stat is None:
+            try:
+                self._stat = self._entry.stat()
+            except OSError:
+                return None
+        return self._stat
+
+    @property
+    def size(self) -> int:
+        stat = self.stat()
+        return stat.st_size if stat is not None and not self.is_dir else 0
+
+    @property
+    def mtime(self) -> float:
+        stat = self.stat()
+        return stat.st_mtime if stat is not None else 0.0
+
+def iter_entries(root: str, recursive: bool = False, max_depth: Optional[int] = None, include_hidden: bool = False,
+                 exclude: Optional[Callable[[ListedEntry], bool]] = None) -> Iterator[ListedEntry]:
+    """
+    Walk a directory with os.scandir, yielding entries as they are read.
+
+    The file type comes from the d_type scandir already returned, so no stat is made per
+    entry. Symlinked directories are listed but not descended into, which rules out loops.
+    Subdirectories that can't be read are skipped, as are entries exclude returns True for
+    (directories without being read).
+    """
+    if not recursive:
+        max_depth = 1
+
+    # Stack of (absolute dir, relative prefix, depth); depth 1 is the root itself
+    stack = [(root, "", 1)]
+    while stack:
+        directory, prefix, depth = stack.pop()
+        try:
+            iterator = os.scandir(directory)
+        except OSError:
+            if directory == root:
+                raise
+            continue
+
+        subdirectories = []
+        with iterator:
+            for entry in iterator:
+                if not include_hidden and entry.name.startswith("."):
+                    continue
+
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+
+                relative_path = prefix + entry.name
+                item = ListedEntry(entry, relative_path, is_dir)
+                if exclude is not None and exclude(item):
+                    continue
+                yield item
+
+                if is_dir and (max_depth is None or depth < max_depth):
+                    try:
+                        if not entry.is_symlink():
+                            subdirectories.append((entry.path, relative_path + "/", depth + 1))
+                    except OSError:
+                        pass
+
+        # Reversed so subdirectories are visited in the order they were read
+        stack.extend(reversed(subdirectories))
+
+def _build_filter(pattern: str, extensions: Optional[List[str]]):
+    suffixes = tuple("." + extension.lower().lstrip(".") for extension in extensions or [])
+    match_path = "/" in pattern
+
+    def accept(item: ListedEntry) -> bool:
+        if suffixes and (item.is_dir or not item.name.lower().endswith(suffixes)):
+            return False
+        if pattern and not fnmatch.fnmatch(item.relative_path if match_path else item.name, pattern):
+            return False
+        return True
+
+    return accept
+
+def _sort_key(sort: str):
+    if sort == "size":
+        return lambda item: (item.size, item.relative_path)
+    if sort == "mtime":
+        return lambda item: (item.mtime, item.relative_path)
+    return lambda item: item.relative_path
+
+def _parse_cursor(cursor: str) -> int:
+    try:
+        offset = int(cursor)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if offset < 0:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return offset
+
+def _select_page(entries: Iterator[ListedEntry], sort: str, reverse: bool, offset: int, limit: Optional[int]) -> Tuple[List[ListedEntry], bool, Optional[int]]:
+    """Return (page, has_more, total). total is None when the listing stopped early."""
+    if limit is None:
+        items = list(entries)
+        if sort != "none":
+            items.sort(key=_sort_key(sort), reverse=reverse)
+        return items[offset:], False, len(items)
+
+    if sort == "none":
+        # Directory order: stop reading as soon as the page (plus one to detect more) is filled
+        page = []
+        for index, item in enumerate(entries):
+            if index >= offset + limit:
+                return page, True, None
+            if index >= offset:
+                page.append(item)
+        return page, False, None
+
+    key = _sort_key(sort)
+    wanted = offset + limit + 1
+    total = 0
+
+    def counted():
+        nonlocal total
+        for item in entries:
+            total += 1
+            yield item
+
+    # Keep only the first pages in memory instead of sorting the whole listing
+    if reverse:
+        top = heapq.nlargest(wanted, counted(), key=key)
+    else:
+        top = heapq.nsmallest(wanted, counted(), key=key)
+
+    page = top[offset:offset + limit]
+    return page, total > offset + limit, total
+
+def _format_time(timestamp: float) -> str:
+    from datetime import datetime
+    return datetime.fromtimestamp(timestamp).isoformat(timespec="seconds")
+
+def _format_json(page: List[ListedEntry], details: bool, has_more: bool, next_cursor: Optional[str], total: Optional[int]) -> str:
+    result: Dict[str, Any] = {
+        "directories": [],
+        "files": []
+    }
+
+    for item in page:
+        if item.is_dir:
+            result["directories"].append(item.relative_path)
+        elif details:
+            result["files"].append({
+                "name": item.relative_path,
+                "size": item.size,
+                "mtime": _format_time(item.mtime)
+            })
+        else:
+            result["files"].append(item.relative_path)
+
+    if total is not None:
+        result["total"] = total
+    if has_more:
+        result["next_cursor"] = next_cursor
+
+    return json.dumps(result, separators=(",", ":"), ensure_ascii=False)
+
+def _format_compact(page: List[ListedEntry], details: bool, has_more: bool, next_cursor: Optional[str], total: Optional[int]) -> str:
+    lines = []
+    for item in page:
+        if item.is_dir:
+            lines.append(item.relative_path + "/")
+        elif details:
+            lines.append(f"{item.relative_path}\t{item.size}\t{_format_time(item.mtime)}")
+        else:
+            lines.append(item.relative_path)
+
+    if has_more:
+        shown = f"{len(page)} of {total}" if total is not None else str(len(page))
+        lines.append(f"[{shown} entries shown, next_cursor: {next_cursor}]")
+
+    return "\n".join(lines)
+
 def list_files_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
     """List files and directories in the specified path within the Capri data directory"""
     try:
         input_data = json.loads(input_bytes)
         path = input_data.get("path", "")
-        
+        recursive = input_data.get("recursive", False)
+        max_depth = input_data.get("max_depth")
+        pattern = input_data.get("pattern") or ""
+        extensions = input_data.get("extensions")
+        include_hidden = input_data.get("include_hidden", True)
+        sort = input_data.get("sort") or "name"
+        reverse = input_data.get("reverse", False)
+        details = input_data.get("details", False)
+        output_format = input_data.get("format") or "json"
+        limit = input_data.get("limit")
+        cursor = input_data.get("cursor")
+
+        if sort not in SORT_KEYS:
+            return "", Exception(f"Invalid sort: {sort}. Use one of: {', '.join(SORT_KEYS)}")
+
+        if output_format not in ("json", "compact"):
+            return "", Exception(f"Invalid format: {output_format}. Use 'json' or 'compact'")
+
+        if max_depth is not None and max_depth < 1:
+            return "", Exception("max_depth must be at least 1")
+
+        if limit is not None:
+            limit = max(1, min(int(limit), MAX_LIMIT))
+        offset = _parse_cursor(cursor) if cursor else 0
+
         # Get the Capri data directory
         capri_dir = get_capri_dir()
-        
+
         # Join the Capri directory with the provided path (if any)
         target_dir = os.path.join(capri_dir, path) if path else capri_dir
-        
+
         # Check if the directory exists
         if not os.path.isdir(target_dir):
             return "", Exception(f"Directory not found: {path}")
-        
-        # List files and directories
-        items = os.listdir(target_dir)
-        
-        # Separate files and directories and add type information
-        result = {
-            "directories": [],
-            "files": []
-        }
-        
-        for item in items:
-            item_path = os.path.join(target_dir, item)
-            if os.path.isdir(item_path):
-                result["directories"].append(item)
-            else:
-                result["files"].append(item)
-        
-        # Convert to JSON string for output
-        return json.dumps(result, indent=2), None
-    
+
+        accept = _build_filter(pattern, extensions)
+        entries = (item for item in iter_entries(target_dir, recursive, max_depth, include_hidden) if accept(item))
+
+        page, has_more, total = _select_page(entries, sort, reverse, offset, limit)
+        next_cursor = str(offset + len(page)) if has_more else None
+
+        if output_format == "compact":
+            return _format_compact(page, details, has_more, next_cursor, total), None
+        return _format_json(page, details, has_more, next_cursor, total), None
+
     except Exception as e:
         return "", e
 
 # Create the tool definition
 list_files_tool = ToolDefinition(
     name="list_files",
-    description="List all files and directories in a specified path within the Capri data directory. Returns separate lists of files and directories.",
+    description="List files and directories in a path within the Capri data directory. Returns separate lists of files and directories. Can list recursively, filter by glob pattern or extension, sort by name, size or time, and include sizes. Pass a limit to page through large listings, then next_cursor back as cursor to continue.",
     input_schema=list_files_schema,
     function=list_files_function
-)
\ No newline at end of file
+)
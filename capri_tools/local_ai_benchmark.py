@@ -0,0 +1,368 @@
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from typing import Dict, Any, List, Optional
+from capri_tools.get_capri_dir import get_capri_state_dir
+from capri_tools.local_model_registry import (
+    LocalModel, build_llama, calibrate, get_machine_key, list_local_model_files, load_registry_config,
+    load_tuned_settings, resolve_local_model
+)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Prompt used for prompt-processing and generation measurements
+BENCHMARK_PROMPT = (
+    "The following is a review of a small guesthouse on the shore of Lake Sevan. "
+    "The rooms were clean and quiet, the breakfast was generous, and the owner "
+    "recommended a walk to the monastery at sunset, which turned out to be the best "
+    "part of the trip. The only downside was the long drive from Yerevan. "
+) * 4
+
+# Schema used to measure structured-output overhead (same shape as call_local_ai's example)
+BENCHMARK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "place_title": {"type": "string"},
+        "date": {"type": "string"},
+        "review": {"type": "string"},
+        "rating": {"type": "integer"}
+    },
+    "required": ["place_title", "date", "review", "rating"]
+}
+
+def _peak_rss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes everywhere else
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def run_single_benchmark(model_path: str, chat_format: str, n_ctx: int, n_threads: int, n_batch: int,
+                         gen_tokens: int = 64) -> Dict[str, Any]:
+    """
+    Benchmark one (model file, context size, thread count) configuration.
+
+    Meant to run in a fresh process so that peak RSS and load time aren't skewed by
+    models loaded earlier in the same run.
+    """
+    from llama_cpp import LlamaGrammar
+
+    config = load_registry_config()
+    model = LocalModel(os.path.basename(model_path), model_path, chat_format, None, os.path.getsize(model_path))
+    settings = {"n_threads": n_threads, "n_batch": n_batch}
+
+    # Model load time
+    start = time.perf_counter()
+    llm = build_llama(model, chat_format, n_ctx, settings, config)
+    load_seconds = time.perf_counter() - start
+
+    # Prompt processing: evaluate the whole prompt in batches, no sampling
+    prompt_tokens = llm.tokenize(BENCHMARK_PROMPT.encode("utf-8"))[:max(n_ctx - gen_tokens - 8, 8)]
+    llm.reset()
+    start = time.perf_counter()
+    llm.eval(prompt_tokens)
+    prompt_seconds = time.perf_counter() - start
+
+    # Generation: stream so time to first token and decode speed can be separated. A chunk
+    # can hold more or less than one token, so tokens are counted from the generated text
+    llm.reset()
+    text = []
+    first_token_at = None
+    start = time.perf_counter()
+    for chunk in llm.create_completion(BENCHMARK_PROMPT, max_tokens=gen_tokens, temperature=0.0, stream=True):
+        text.append(chunk["choices"][0]["text"])
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+    end = time.perf_counter()
+    generated = len(llm.tokenize("".join(text).encode("utf-8"), add_bos=False, special=True))
+
+    ttft_seconds = (first_token_at - start) if first_token_at else None
+    decode_seconds = (end - first_token_at) if first_token_at else 0.0
+
+    # Structured output: same request with and without a JSON schema grammar
+    messages = [
+        {"role": "system", "content": "Extract the review as JSON."},
+        {"role": "user", "content": BENCHMARK_PROMPT}
+    ]
+
+    start = time.perf_counter()
+    grammar = LlamaGrammar.from_json_schema(json.dumps(BENCHMARK_SCHEMA), verbose=False)
+    grammar_compile_seconds = time.perf_counter() - start
+
+    llm.reset()
+    start = time.perf_counter()
+    plain = llm.create_chat_completion(messages=messages, max_tokens=gen_tokens, temperature=0.0)
+    plain_seconds = time.perf_counter() - start
+
+    llm.reset()
+    start = time.perf_counter()
+    structured = llm.create_chat_completion(messages=messages, max_tokens=gen_tokens, temperature=0.0, grammar=grammar)
+    structured_seconds = time.perf_counter() - start
+
+    plain_tokens = plain["usage"]["completion_tokens"] or 1
+    structured_tokens = structured["usage"]["completion_tokens"] or 1
+
+    return {
+        "model": os.path.basename(model_path),
+        "size_bytes": model.size_bytes,
+        "chat_format": chat_format,
+        "n_ctx": n_ctx,
+        "n_threads": n_threads,
+        "n_batch": n_batch,
+        "load_seconds": round(load_seconds, 4),
+        "prompt_tokens": len(prompt_tokens),
+        "prompt_tokens_per_second": round(len(prompt_tokens) / prompt_seconds, 2) if prompt_seconds else None,
+        "generated_tokens": generated,
+        "time_to_first_token_seconds": round(ttft_seconds, 4) if ttft_seconds is not None else None,
+        "generation_tokens_per_second": round((generated - 1) / decode_seconds, 2) if decode_seconds and generated > 1 else None,
+        "grammar_compile_seconds": round(grammar_compile_seconds, 4),
+        "plain_seconds_per_token": round(plain_seconds / plain_tokens, 5),
+        "structured_seconds_per_token": round(structured_seconds / structured_tokens, 5),
+        "structured_overhead_ratio": round((structured_seconds / structured_tokens) / (plain_seconds / plain_tokens), 3),
+        "peak_rss_bytes": _peak_rss_bytes()
+    }
+
+def run_speculative_benchmark(model_path: str, chat_format: str, n_ctx: int, n_threads: int, n_batch: int,
+                              mode: str, draft_model_name: Optional[str] = None, gen_tokens: int = 128) -> Dict[str, Any]:
+    """
+    Time a greedy structured-extraction completion with a speculative decoding mode ("none" for plain decoding).
+
+    The generated text is returned too, so the caller can check that speculative output
+    matches plain decoding.
+    """
+    from llama_cpp import LlamaGrammar
+    from capri_tools.speculative_decoding import create_draft_model
+
+    config = load_registry_config()
+    model = LocalModel(os.path.basename(model_path), model_path, chat_format, None, os.path.getsize(model_path))
+    settings = {"n_threads": n_threads, "n_batch": n_batch}
+
+    draft = create_draft_model(mode, n_ctx=n_ctx, draft_model_name=draft_model_name)
+    llm = build_llama(model, chat_format, n_ctx, settings, config, draft_model=draft)
+    grammar = LlamaGrammar.from_json_schema(json.dumps(BENCHMARK_SCHEMA), verbose=False)
+
+    messages = [
+        {"role": "system", "content": "Extract the review as JSON. Copy the review text verbatim."},
+        {"role": "user", "content": BENCHMARK_PROMPT}
+    ]
+
+    start = time.perf_counter()
+    response = llm.create_chat_completion(messages=messages, max_tokens=gen_tokens, temperature=0.0, grammar=grammar)
+    elapsed = time.perf_counter() - start
+
+    completion_tokens = response["usage"]["completion_tokens"]
+    return {
+        "scenario": "speculative",
+        "model": os.path.basename(model_path),
+        "chat_format": chat_format,
+        "n_ctx": n_ctx,
+        "n_threads": n_threads,
+        "speculative": mode,
+        "completion_tokens": completion_tokens,
+        "seconds": round(elapsed, 4),
+        "generation_tokens_per_second": round(completion_tokens / elapsed, 2) if elapsed else None,
+        "output": response["choices"][0]["message"]["content"]
+    }
+
+def run_call_local_ai_benchmark(model_name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    End-to-end latency of the call_local_ai tool: first (cold) call and a repeated (warm) call.
+
+    If the model has no tuned settings yet, auto-tuning runs first and is timed on its own,
+    so the cold call only covers loading the model and answering.
+    """
+    from capri_tools.call_local_ai import call_local_ai_function
+
+    auto_tune_seconds = None
+    model = resolve_local_model(model_name)
+    if model.model_path and load_tuned_settings(model) is None and load_registry_config().get("auto_tune", True):
+        start = time.perf_counter()
+        calibrate(model)
+        auto_tune_seconds = time.perf_counter() - start
+
+    request = {
+        "prompt": BENCHMARK_PROMPT,
+        "max_tokens": 64,
+        "temperature": 0.0,
+        "response_format": {"type": "json_object", "schema": BENCHMARK_SCHEMA}
+    }
+    if model_name:
+        request["model"] = model_name
+    input_bytes = json.dumps(request).encode()
+
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        _, error = call_local_ai_function(input_bytes)
+        timings.append(time.perf_counter() - start)
+        if error:
+            return {"scenario": "call_local_ai", "error": str(error)}
+
+    return {
+        "scenario": "call_local_ai",
+        "model": model_name,
+        "auto_tune_seconds": round(auto_tune_seconds, 4) if auto_tune_seconds is not None else None,
+        "cold_call_seconds": round(timings[0], 4),
+        "warm_call_seconds": round(timings[1], 4),
+        "peak_rss_bytes": _peak_rss_bytes()
+    }
+
+def _in_fresh_process(function, *args):
+    # One process per configuration, so memory and load time are measured from a clean start
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(function, *args).result()
+
+def run_benchmarks(model_names: Optional[List[str]] = None, quantizations: Optional[List[str]] = None,
+                   n_ctx_values: Optional[List[int]] = None, thread_values: Optional[List[int]] = None,
+                   chat_formats: Optional[List[str]] = None, n_batch: int = 512, gen_tokens: int = 64,
+                   include_tool: bool = True, speculative_modes: Optional[List[str]] = None,
+                   draft_model_name: Optional[str] = None, progress=print) -> Dict[str, Any]:
+    """Run the benchmark grid and return the report (see save_report)"""
+    config = load_registry_config()
+    model_names = model_names or [config["default_model"]]
+    n_ctx_values = n_ctx_values or [2048]
+    thread_values = thread_values or [max(1, (os.cpu_count() or 1) // 2)]
+
+    results = []
+    for model_name in model_names:
+        model_files = list_local_model_files(model_name)
+        if quantizations:
+            wanted = {q.upper() for q in quantizations}
+            model_files = [m for m in model_files if m.quantization in wanted]
+
+        if not model_files:
+            results.append({"model": model_name, "error": "No local GGUF files found"})
+            continue
+
+        # The entry's own chat format, unless others are asked for to compare
+        formats = chat_formats or [model_files[0].chat_format]
+
+        for model in model_files:
+            for chat_format in formats:
+                for n_ctx in n_ctx_values:
+                    for n_threads in thread_values:
+                        progress(f"{os.path.basename(model.model_path)} format={chat_format} n_ctx={n_ctx} n_threads={n_threads}")
+                        try:
+                            result = _in_fresh_process(run_single_benchmark, model.model_path, chat_format,
+                                                       n_ctx, n_threads, n_batch, gen_tokens)
+                        except Exception as e:
+                            result = {"model": os.path.basename(model.model_path), "chat_format": chat_format,
+                                      "n_ctx": n_ctx, "n_threads": n_threads, "error": str(e)}
+                        result["registry_model"] = model_name
+                        result["quantization"] = model.quantization
+                        results.append(result)
+
+                        if speculative_modes:
+                            results.extend(_speculative_results(model, model_name, chat_format, n_ctx, n_threads,
+                                                                n_batch, speculative_modes, draft_model_name, progress))
+
+        if include_tool:
+            progress(f"call_local_ai model={model_name}")
+            try:
+                results.append(_in_fresh_process(run_call_local_ai_benchmark, model_name))
+            except Exception as e:
+                results.append({"scenario": "call_local_ai", "model": model_name, "error": str(e)})
+
+    try:
+        import llama_cpp
+        llama_cpp_version = llama_cpp.__version__
+    except Exception:
+        llama_cpp_version = None
+
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "machine": get_machine_key(),
+        "python": platform.python_version(),
+        "llama_cpp_version": llama_cpp_version,
+        "results": results
+    }
+
+def _speculative_results(model: LocalModel, model_name: str, chat_format: str, n_ctx: int, n_threads: int,
+                         n_batch: int, modes: List[str], draft_model_name: Optional[str], progress) -> List[Dict[str, Any]]:
+    """Benchmark plain decoding and each speculative mode on the same request, and compare their outputs"""
+    draft_model_name = draft_model_name or load_registry_config()["models"][model_name].get("draft_model")
+
+    runs = []
+    for mode in ["none"] + [m for m in modes if m != "none"]:
+        progress(f"{os.path.basename(model.model_path)} speculative={mode}")
+        try:
+            runs.append(_in_fresh_process(run_speculative_benchmark, model.model_path, chat_format, n_ctx,
+                                          n_threads, n_batch, mode, draft_model_name))
+        except Exception as e:
+            runs.append({"scenario": "speculative", "model": os.path.basename(model.model_path), "chat_format": chat_format,
+                         "n_ctx": n_ctx, "n_threads": n_threads, "speculative": mode, "error": str(e)})
+
+    baseline = runs[0]
+    for run in runs:
+        run["registry_model"] = model_name
+        run["quantization"] = model.quantization
+        if run is baseline or "error" in run or "error" in baseline:
+            continue
+        run["speedup"] = round(baseline["seconds"] / run["seconds"], 3) if run["seconds"] else None
+        run["identical_output"] = run["output"] == baseline["output"]
+
+    return runs
+
+def save_report(report: Dict[str, Any], output_path: Optional[str] = None) -> str:
+    """Write a report as JSON (by default into the Capri state directory) and return its path"""
+    if not output_path:
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_path = os.path.join(get_capri_state_dir("benchmarks"), f"local_ai_{stamp}.json")
+
+    with open(output_path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+
+    return output_path
+
+# Metrics compared between runs, and whether higher values are better
+COMPARED_METRICS = {
+    "load_seconds": False,
+    "prompt_tokens_per_second": True,
+    "generation_tokens_per_second": True,
+    "time_to_first_token_seconds": False,
+    "structured_overhead_ratio": False,
+    "peak_rss_bytes": False,
+    "cold_call_seconds": False,
+    "warm_call_seconds": False
+}
+
+def _result_key(result: Dict[str, Any]) -> tuple:
+    return (result.get("scenario", "model"), result.get("model"), result.get("chat_format"),
+            result.get("n_ctx"), result.get("n_threads"), result.get("speculative"))
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """Return human-readable lines with the relative change of each metric between two reports"""
+    baseline_results = {_result_key(r): r for r in baseline.get("results", []) if "error" not in r}
+    lines = []
+
+    for result in current.get("results", []):
+        if "error" in result:
+            continue
+        previous = baseline_results.get(_result_key(result))
+        if previous is None:
+            continue
+
+        label = " ".join(str(part) for part in _result_key(result) if part is not None)
+        changes = []
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = previous.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            better = change > 0 if higher_is_better else change < 0
+            marker = "=" if abs(change) < 0.5 else "+" if better else "-"
+            changes.append(f"{metric}: {old} -> {new} ({change:+.1f}%) {marker}")
+
+        if changes:
+            lines.append(label)
+            lines.extend(f"  {change}" for change in changes)
+
+    return lines
@@ -0,0 +1,455 @@
+import fnmatch
+import glob
+import json
+import os
+import platform
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from capri_tools.get_capri_dir import get_capri_dir, get_capri_state_dir
+
+# Name of the registry config file inside the Capri state directory
+REGISTRY_CONFIG_FILE = "local_models.json"
+
+# Name of the per-machine tuning results file inside the Capri state directory
+TUNING_FILE = "local_model_tuning.json"
+
+# Default registry, written to the config file the first time it's needed
+DEFAULT_REGISTRY_CONFIG = {
+    "default_model": "deephermes-3-3b",
+    "search_dirs": [
+        "~/.cache/huggingface/hub",
+        "models"
+    ],
+    "models": {
+        "deephermes-3-3b": {
+            "repo_id": "bartowski/NousResearch_DeepHermes-3-Llama-3-3B-Preview-GGUF",
+            "filename_pattern": "NousResearch_DeepHermes-3-Llama-3-3B-Preview-*.gguf",
+            "default_filename": "NousResearch_DeepHermes-3-Llama-3-3B-Preview-Q8_0.gguf",
+            "chat_format": "chatml",
+            "draft_model": None
+        }
+    },
+    "auto_tune": True,
+    "use_mmap": True,
+    "use_mlock": "auto"
+}
+
+# Quantizations from best to worst quality, used to pick the best one that fits in RAM
+QUANT_PREFERENCE = [
+    "F32", "BF16", "F16", "Q8_0", "Q6_K", "Q5_K_M", "Q5_K_S", "Q5_1", "Q5_0",
+    "Q4_K_M", "Q4_K_S", "IQ4_NL", "IQ4_XS", "Q4_1", "Q4_0", "Q3_K_L", "Q3_K_M",
+    "IQ3_M", "IQ3_S", "Q3_K_S", "IQ3_XS", "IQ3_XXS", "Q2_K", "IQ2_M", "IQ2_S",
+    "IQ2_XS", "IQ2_XXS"
+]
+
+QUANT_PATTERN = re.compile(r"(?<![A-Za-z0-9])(I?Q\d(?:_K)?(?:_[A-Z0-9]+)*|BF16|F16|F32)(?=\.gguf$|[-.])", re.IGNORECASE)
+
+# Headroom on top of the model file size for the KV cache, scratch buffers and the rest of Capri
+MEMORY_HEADROOM = 1.25
+
+# Prompt used for the calibration run; long enough to exercise batched prompt processing
+CALIBRATION_PROMPT = " ".join(["Capri reads quietly by the window while the city wakes up."] * 8)
+CALIBRATION_TOKENS = 16
+
+# Loaded models kept for reuse; each one holds a full copy of its weights in memory, so
+# the least recently used is dropped beyond this
+MAX_LOADED_MODELS = 2
+
+# cache key -> (model, lock held while it generates); the registry lock only guards the
+# dict itself, so models load and generate independently of each other
+_loaded_models: "OrderedDict[Tuple, Tuple[Any, threading.Lock]]" = OrderedDict()
+_loaded_models_lock = threading.Lock()
+
+# cache key -> lock held while that model loads, so concurrent callers load it only once
+_loading_locks: Dict[Tuple, threading.Lock] = {}
+
+class ChatFormatView:
+    """
+    A loaded model used with a particular chat format.
+
+    The chat format only decides how messages are turned into a prompt, so callers that
+    want the same model with different formats (llama-chat uses chatml and
+    chatml-function-calling) share one instance, and one copy of the weights. The format is
+    set on the model at the start of each chat completion, under the model's own lock since
+    a model can only run one generation at a time; everything else is passed through.
+    """
+    def __init__(self, llm, lock: threading.Lock, chat_format: str):
+        self._llm = llm
+        self._lock = lock
+        self._chat_format = chat_format
+
+    def create_chat_completion(self, *args, **kwargs):
+        with self._lock:
+            self._llm.chat_format = self._chat_format
+            return self._llm.create_chat_completion(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._llm, name)
+
+class LocalModel:
+    """A GGUF model file picked from the registry, together with the settings to load it with"""
+    def __init__(self, name: str, model_path: Optional[str], chat_format: str, quantization: Optional[str],
+                 size_bytes: int, repo_id: Optional[str] = None, filename: Optional[str] = None):
+        self.name = name
+        self.model_path = model_path
+        self.chat_format = chat_format
+        self.quantization = quantization
+        self.size_bytes = size_bytes
+        self.repo_id = repo_id
+        self.filename = filename
+
+def load_registry_config() -> Dict[str, Any]:
+    """Load the model registry config, creating it with the defaults if it doesn't exist"""
+    config_path = os.path.join(get_capri_state_dir(), REGISTRY_CONFIG_FILE)
+
+    if not os.path.exists(config_path):
+        with open(config_path, 'w', encoding='utf-8') as file:
+            json.dump(DEFAULT_REGISTRY_CONFIG, file, indent=2)
+        return json.loads(json.dumps(DEFAULT_REGISTRY_CONFIG))
+
+    with open(config_path, 'r', encoding='utf-8') as file:
+        config = json.load(file)
+
+    # Fill in any keys missing from an older config
+    for key, value in DEFAULT_REGISTRY_CONFIG.items():
+        config.setdefault(key, value)
+
+    return config
+
+def get_available_memory() -> int:
+    """Return the memory available for a new model in bytes"""
+    # Linux: MemAvailable accounts for reclaimable page cache
+    try:
+        with open("/proc/meminfo", 'r') as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        pass
+
+    # macOS has no SC_AVPHYS_PAGES; fall back to half of physical memory
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 2
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+def parse_quantization(filename: str) -> Optional[str]:
+    """Extract the quantization type (e.g. Q4_K_M) from a GGUF filename"""
+    matches = QUANT_PATTERN.findall(os.path.basename(filename))
+    return matches[-1].upper() if matches else None
+
+def discover_gguf_files(search_dirs: List[str]) -> List[str]:
+    """Find all GGUF files in the given directories (relative dirs are resolved against the Capri directory)"""
+    found = []
+    seen = set()
+
+    for search_dir in search_dirs:
+        directory = os.path.expanduser(search_dir)
+        if not os.path.isabs(directory):
+            directory = os.path.join(get_capri_dir(), directory)
+
+        if not os.path.isdir(directory):
+            continue
+
+        for path in glob.iglob(os.path.join(directory, "**", "*.gguf"), recursive=True):
+            # Hugging Face snapshots are symlinks into the blob store; dedupe by the real file
+            real_path = os.path.realpath(path)
+            if real_path in seen or not os.path.isfile(real_path):
+                continue
+            seen.add(real_path)
+            found.append(path)
+
+    return found
+
+def _quant_rank(quantization: Optional[str]) -> int:
+    if quantization in QUANT_PREFERENCE:
+        return QUANT_PREFERENCE.index(quantization)
+    return len(QUANT_PREFERENCE)
+
+def _entry_candidates(config: Dict[str, Any], entry: Dict[str, Any]) -> List[str]:
+    pattern = entry.get("filename_pattern", "*.gguf")
+    return [
+        path for path in discover_gguf_files(config["search_dirs"])
+        if fnmatch.fnmatch(os.path.basename(path), pattern)
+    ]
+
+def list_local_model_files(name: Optional[str] = None) -> List[LocalModel]:
+    """Return every local file (one per quantization) available for a registry entry"""
+    config = load_registry_config()
+    name = name or config["default_model"]
+
+    entry = config["models"].get(name)
+    if entry is None:
+        raise ValueError(f"Unknown local model: {name}")
+
+    chat_format = entry.get("chat_format", "chatml")
+    if entry.get("model_path"):
+        paths = [os.path.expanduser(entry["model_path"])]
+    else:
+        paths = _entry_candidates(config, entry)
+
+    return [
+        LocalModel(name, path, chat_format, parse_quantization(path), os.path.getsize(path))
+        for path in sorted(paths, key=lambda path: _quant_rank(parse_quantization(path)))
+    ]
+
+def resolve_local_model(name: Optional[str] = None) -> LocalModel:
+    """
+    Pick the model file to use for a registry entry.
+
+    All local GGUF files matching the entry's filename pattern are considered, and the
+    highest-quality quantization that fits in the available memory is chosen. If none
+    fits, the smallest one is used. If no file is found locally, the entry's default
+    file is downloaded from its Hugging Face repo on load.
+    """
+    config = load_registry_config()
+    name = name or config["default_model"]
+
+    entry = config["models"].get(name)
+    if entry is None:
+        raise ValueError(f"Unknown local model: {name}")
+
+    chat_format = entry.get("chat_format", "chatml")
+
+    # An explicit path in the config always wins
+    if entry.get("model_path"):
+        model_path = os.path.expanduser(entry["model_path"])
+        return LocalModel(name, model_path, chat_format, parse_quantization(model_path), os.path.getsize(model_path))
+
+    candidates = _entry_candidates(config, entry)
+
+    if not candidates:
+        return LocalModel(name, None, chat_format, parse_quantization(entry.get("default_filename", "")), 0,
+                          repo_id=entry.get("repo_id"), filename=entry.get("default_filename"))
+
+    available = get_available_memory()
+    ranked = sorted(candidates, key=lambda path: (_quant_rank(parse_quantization(path)), -os.path.getsize(path)))
+
+    chosen = None
+    for path in ranked:
+        if not available or os.path.getsize(path) * MEMORY_HEADROOM <= available:
+            chosen = path
+            break
+
+    if chosen is None:
+        chosen = min(candidates, key=os.path.getsize)
+
+    return LocalModel(name, chosen, chat_format, parse_quantization(chosen), os.path.getsize(chosen))
+
+def get_machine_key() -> str:
+    """Identify this machine for the persisted tuning results"""
+    return f"{platform.node()}|{platform.system()}|{platform.machine()}|{os.cpu_count()}"
+
+def _model_key(model: LocalModel) -> str:
+    return os.path.basename(model.model_path or model.filename or model.name)
+
+def load_tuned_settings(model: LocalModel) -> Optional[Dict[str, Any]]:
+    """Return the persisted n_threads/n_batch for this model on this machine, if it has been tuned"""
+    tuning_path = os.path.join(get_capri_state_dir(), TUNING_FILE)
+    if not os.path.exists(tuning_path):
+        return None
+
+    try:
+        with open(tuning_path, 'r', encoding='utf-8') as file:
+            tuning = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    return tuning.get(get_machine_key(), {}).get(_model_key(model))
+
+def save_tuned_settings(model: LocalModel, settings: Dict[str, Any]) -> None:
+    """Persist the tuning result for this model on this machine"""
+    tuning_path = os.path.join(get_capri_state_dir(), TUNING_FILE)
+    tuning: Dict[str, Any] = {}
+
+    if os.path.exists(tuning_path):
+        try:
+            with open(tuning_path, 'r', encoding='utf-8') as file:
+                tuning = json.load(file)
+        except (OSError, ValueError):
+            tuning = {}
+
+    tuning.setdefault(get_machine_key(), {})[_model_key(model)] = settings
+
+    temp_path = tuning_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(tuning, file, indent=2)
+    os.replace(temp_path, tuning_path)
+
+def default_thread_candidates() -> List[int]:
+    """Thread counts worth trying: around the physical core count, which is usually the sweet spot"""
+    logical = os.cpu_count() or 1
+    physical = max(1, logical // 2)
+    return sorted({max(1, physical // 2), physical, max(1, (physical + logical) // 2), logical})
+
+def default_settings() -> Dict[str, Any]:
+    """Settings used before (or instead of) a calibration run"""
+    return {"n_threads": max(1, (os.cpu_count() or 1) // 2), "n_batch": 512}
+
+def build_llama(model: LocalModel, chat_format: str, n_ctx: int, settings: Dict[str, Any], config: Dict[str, Any], **kwargs):
+    """Create a Llama instance for a model with explicit settings (no tuning, no reuse)"""
+    from llama_cpp import Llama
+
+    use_mlock = config.get("use_mlock", "auto")
+    if use_mlock == "auto":
+        # Only pin the model when it leaves plenty of room for everything else
+        available = get_available_memory()
+        use_mlock = bool(model.size_bytes and available and model.size_bytes * 2 <= available)
+
+    load_args = {
+        "chat_format": chat_format,
+        "n_ctx": n_ctx,
+        "n_threads": settings["n_threads"],
+        "n_threads_batch": settings.get("n_threads_batch", settings["n_threads"]),
+        "n_batch": min(settings["n_batch"], n_ctx),
+        "use_mmap": bool(config.get("use_mmap", True)),
+        "use_mlock": bool(use_mlock),
+        "verbose": False,
+    }
+    load_args.update(kwargs)
+
+    if model.model_path:
+        return Llama(model_path=model.model_path, **load_args)
+
+    if not model.repo_id or not model.filename:
+        raise ValueError(f"No local GGUF file found for model '{model.name}' and no repo configured to download it from")
+
+    llm = Llama.from_pretrained(repo_id=model.repo_id, filename=model.filename, **load_args)
+
+    # Remember where the download landed so later calls can measure and reuse it
+    model.model_path = llm.model_path
+    model.size_bytes = os.path.getsize(llm.model_path)
+    return llm
+
+def _measure(model: LocalModel, settings: Dict[str, Any], config: Dict[str, Any]) -> float:
+    """Run a short prompt + generation and return tokens per second (prompt and generated tokens combined)"""
+    llm = build_llama(model, model.chat_format, 512, settings, config)
+    try:
+        tokens = llm.tokenize(CALIBRATION_PROMPT.encode("utf-8"))
+        start = time.perf_counter()
+        llm.create_completion(CALIBRATION_PROMPT, max_tokens=CALIBRATION_TOKENS, temperature=0.0)
+        elapsed = time.perf_counter() - start
+        return (len(tokens) + CALIBRATION_TOKENS) / elapsed if elapsed > 0 else 0.0
+    finally:
+        # Free the calibration model right away instead of waiting for the garbage collector
+        if hasattr(llm, "close"):
+            llm.close()
+
+def calibrate(model: LocalModel, thread_candidates: Optional[List[int]] = None,
+              batch_candidates: Optional[List[int]] = None) -> Dict[str, Any]:
+    """
+    Find the fastest n_threads and n_batch for a model on this machine and persist them.
+
+    Threads are tuned first with a fixed batch size, then the batch size is tuned with the
+    best thread count, which keeps the calibration to a handful of short runs.
+    """
+    config = load_registry_config()
+    thread_candidates = thread_candidates or default_thread_candidates()
+    batch_candidates = batch_candidates or [128, 256, 512]
+
+    best = default_settings()
+    best_speed = 0.0
+
+    for n_threads in thread_candidates:
+        settings = {"n_threads": n_threads, "n_batch": best["n_batch"]}
+        speed = _measure(model, settings, config)
+        if speed > best_speed:
+            best, best_speed = settings, speed
+
+    for n_batch in batch_candidates:
+        if n_batch == best["n_batch"]:
+            continue
+        settings = {"n_threads": best["n_threads"], "n_batch": n_batch}
+        speed = _measure(model, settings, config)
+        if speed > best_speed:
+            best, best_speed = settings, speed
+
+    result = dict(best)
+    result["tokens_per_second"] = round(best_speed, 2)
+    result["tuned_at"] = datetime.now().isoformat(timespec="seconds")
+    save_tuned_settings(model, result)
+    return result
+
+def load_local_model(name: Optional[str] = None, chat_format: Optional[str] = None, n_ctx: int = 2048,
+                     speculative: Optional[str] = None, draft_model: Optional[str] = None, **kwargs):
+    """
+    Load a registry model with tuned settings. Loaded models are kept and reused for
+    identical (model, context size, speculative mode) requests, whatever the chat format;
+    at most MAX_LOADED_MODELS stay loaded.
+
+    speculative is one of "none", "prompt_lookup" or "draft_model" (see speculative_decoding);
+    draft_model defaults to the registry entry's "draft_model". Extra keyword arguments are
+    passed through to Llama and override the tuned settings.
+    """
+    config = load_registry_config()
+    model = resolve_local_model(name)
+    chat_format = chat_format or model.chat_format
+
+    speculative = speculative if speculative and speculative != "none" else None
+    if speculative == "draft_model" and not draft_model:
+        draft_model = config["models"][model.name].get("draft_model")
+
+    cache_key = (model.model_path or model.filename, n_ctx, speculative, draft_model,
+                 tuple(sorted((k, repr(v)) for k, v in kwargs.items())))
+    with _loaded_models_lock:
+        cached = _get_loaded(cache_key)
+        if cached is not None:
+            return ChatFormatView(*cached, chat_format)
+        loading_lock = _loading_locks.setdefault(cache_key, threading.Lock())
+
+    with loading_lock:
+        # Another caller may have loaded it while this one waited
+        with _loaded_models_lock:
+            cached = _get_loaded(cache_key)
+        if cached is not None:
+            return ChatFormatView(*cached, chat_format)
+
+        try:
+            settings = None
+            if model.model_path:
+                settings = load_tuned_settings(model)
+                if settings is None and config.get("auto_tune", True):
+                    settings = calibrate(model)
+
+            settings = dict(settings or default_settings())
+            for key in ("n_threads", "n_threads_batch", "n_batch"):
+                if key in kwargs:
+                    settings[key] = kwargs.pop(key)
+
+            if speculative:
+                from capri_tools.speculative_decoding import create_draft_model
+                kwargs["draft_model"] = create_draft_model(speculative, n_ctx=n_ctx, draft_model_name=draft_model)
+
+            llm = build_llama(model, chat_format, n_ctx, settings, config, **kwargs)
+
+            # A draft model with a different vocabulary would propose meaningless token ids
+            draft_llm = getattr(kwargs.get("draft_model"), "llm", None)
+            if draft_llm is not None and draft_llm.n_vocab() != llm.n_vocab():
+                raise ValueError(f"Draft model '{draft_model}' doesn't share the vocabulary of '{model.name}'")
+
+            loaded = (llm, threading.Lock())
+            with _loaded_models_lock:
+                _loaded_models[cache_key] = loaded
+                while len(_loaded_models) > MAX_LOADED_MODELS:
+                    # Callers still holding an evicted model keep it alive until they let go
+                    _loaded_models.popitem(last=False)
+        finally:
+            with _loaded_models_lock:
+                _loading_locks.pop(cache_key, None)
+    return ChatFormatView(*loaded, chat_format)
+
+def _get_loaded(cache_key: Tuple) -> Optional[Tuple[Any, threading.Lock]]:
+    """A loaded model and its generation lock, marked as most recently used; call with _loaded_models_lock held"""
+    loaded = _loaded_models.get(cache_key)
+    if loaded is not None:
+        _loaded_models.move_to_end(cache_key)
+    return loaded
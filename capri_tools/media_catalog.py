@@ -0,0 +1,438 @@
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from capri_tools.get_capri_dir import get_capri_dir, get_capri_state_dir
+from capri_tools.progress import ProgressReporter
+from capri_tools.tool_metrics import register_metrics
+
+# Name of the media catalog database inside the Capri state directory
+CATALOG_DATABASE_FILE = "media_catalog.sqlite3"
+
+VIDEO_EXTENSIONS = {"mp4", "mov", "mkv", "webm", "avi", "m4v", "mpg", "mpeg", "ts", "mts", "m2ts", "flv", "wmv", "3gp"}
+AUDIO_EXTENSIONS = {"mp3", "wav", "m4a", "aac", "flac", "ogg", "opus", "wma"}
+IMAGE_EXTENSIONS = {"png", "jpg", "jpeg", "bmp", "tiff", "tif", "webp", "gif", "heic"}
+MEDIA_EXTENSIONS = VIDEO_EXTENSIONS | AUDIO_EXTENSIONS | IMAGE_EXTENSIONS
+
+# Files that ffprobe couldn't read are remembered with this kind, so they aren't probed
+# again until they change
+UNREADABLE = "unreadable"
+
+# ffprobe processes run at once; each mostly waits on its own I/O and parsing
+PROBE_WORKERS = min(16, 2 * (os.cpu_count() or 1))
+
+# Probe results written per transaction during a catalog update
+WRITE_BATCH_SIZE = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    kind TEXT NOT NULL,
+    format TEXT,
+    duration REAL,
+    width INTEGER,
+    height INTEGER,
+    frame_rate REAL,
+    video_codec TEXT,
+    audio_codec TEXT,
+    has_audio INTEGER NOT NULL DEFAULT 0,
+    bit_rate INTEGER,
+    streams TEXT,
+    keyframes TEXT
+);
+CREATE INDEX IF NOT EXISTS media_kind_duration ON media(kind, duration);
+CREATE INDEX IF NOT EXISTS media_resolution ON media(height, width);
+"""
+
+COLUMNS = ("path", "size", "mtime", "kind", "format", "duration", "width", "height", "frame_rate",
+           "video_codec", "audio_codec", "has_audio", "bit_rate", "streams", "keyframes")
+
+class MediaProbeError(Exception):
+    pass
+
+class MediaInfo:
+    """What ffprobe reported about one media file, as stored in the catalog"""
+    def __init__(self, row: Tuple[Any, ...]):
+        values = dict(zip(COLUMNS, row))
+        self.relative_path: str = values["path"]
+        self.size: int = values["size"]
+        self.mtime: float = values["mtime"]
+        self.kind: str = values["kind"]
+        self.format: Optional[str] = values["format"]
+        self.duration: Optional[float] = values["duration"]
+        self.width: Optional[int] = values["width"]
+        self.height: Optional[int] = values["height"]
+        self.frame_rate: Optional[float] = values["frame_rate"]
+        self.video_codec: Optional[str] = values["video_codec"]
+        self.audio_codec: Optional[str] = values["audio_codec"]
+        self.has_audio: bool = bool(values["has_audio"])
+        self.bit_rate: Optional[int] = values["bit_rate"]
+        self.streams: List[Dict[str, Any]] = json.loads(values["streams"]) if values["streams"] else []
+        self.keyframes: Optional[List[float]] = json.loads(values["keyframes"]) if values["keyframes"] is not None else None
+
+    @property
+    def readable(self) -> bool:
+        return self.kind != UNREADABLE
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {
+            "path": self.relative_path,
+            "kind": self.kind,
+            "size": self.size,
+            "format": self.format,
+            "duration": self.duration,
+            "width": self.width,
+            "height": self.height,
+            "frame_rate": self.frame_rate,
+            "video_codec": self.video_codec,
+            "audio_codec": self.audio_codec,
+            "has_audio": self.has_audio,
+            "bit_rate": self.bit_rate
+        }
+        return {key: value for key, value in result.items() if value is not None}
+
+def media_kind(path: str) -> Optional[str]:
+    """'video', 'audio' or 'image' from the file extension, None for anything else"""
+    extension = os.path.splitext(path)[1][1:].lower()
+    if extension in VIDEO_EXTENSIONS:
+        return "video"
+    if extension in AUDIO_EXTENSIONS:
+        return "audio"
+    if extension in IMAGE_EXTENSIONS:
+        return "image"
+    return None
+
+def _parse_rate(rate: Optional[str]) -> Optional[float]:
+    """ffprobe frame rates are fractions like '30000/1001'; '0/0' means unknown"""
+    if not rate:
+        return None
+    numerator, _, denominator = rate.partition("/")
+    try:
+        value = float(numerator) / float(denominator or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return round(value, 3) if value > 0 else None
+
+def _number(value: Any, convert=float) -> Optional[Any]:
+    try:
+        return convert(value) if value not in (None, "N/A") else None
+    except ValueError:
+        return None
+
+def run_ffprobe(path: str) -> Dict[str, Any]:
+    """Container and stream information of one file"""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_format", "-show_streams", "-of", "json", path],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise MediaProbeError(result.stderr.strip() or f"ffprobe failed on {path}")
+    return json.loads(result.stdout or "{}")
+
+def probe_keyframes(path: str) -> List[float]:
+    """
+    Timestamps (seconds) of the keyframes of the first video stream.
+
+    Read from the packet flags, which only needs the file to be demuxed, not decoded.
+    """
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise MediaProbeError(result.stderr.strip() or f"ffprobe failed on {path}")
+
+    keyframes = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags:
+            timestamp = _number(pts_time)
+            if timestamp is not None:
+                keyframes.append(round(timestamp, 6))
+    keyframes.sort()
+    return keyframes
+
+def describe_probe(path: str, probe: Dict[str, Any]) -> Dict[str, Any]:
+    """The catalog columns for one ffprobe result"""
+    streams = probe.get("streams", [])
+    container = probe.get("format", {})
+    video = next((stream for stream in streams if stream.get("codec_type") == "video"
+                  and not stream.get("disposition", {}).get("attached_pic")), None)
+    audio = next((stream for stream in streams if stream.get("codec_type") == "audio"), None)
+
+    kind = media_kind(path)
+    if kind is None or (kind == "video" and video is None):
+        kind = "video" if video is not None else "audio" if audio is not None else UNREADABLE
+
+    summary = []
+    for stream in streams:
+        entry = {"index": stream.get("index"), "type": stream.get("codec_type"), "codec": stream.get("codec_name")}
+        if stream.get("codec_type") == "video":
+            entry.update(width=stream.get("width"), height=stream.get("height"),
+                         frame_rate=_parse_rate(stream.get("avg_frame_rate")) or _parse_rate(stream.get("r_frame_rate")))
+        elif stream.get("codec_type") == "audio":
+            entry.update(sample_rate=_number(stream.get("sample_rate"), int), channels=stream.get("channels"))
+        summary.append({key: value for key, value in entry.items() if value is not None})
+
+    duration = _number(container.get("duration"))
+    if duration is None and video is not None:
+        duration = _number(video.get("duration"))
+
+    return {
+        "kind": kind,
+        "format": container.get("format_name"),
+        "duration": None if kind == "image" else duration,
+        "width": video.get("width") if video else None,
+        "height": video.get("height") if video else None,
+        "frame_rate": None if kind == "image" or video is None else
+                      _parse_rate(video.get("avg_frame_rate")) or _parse_rate(video.get("r_frame_rate")),
+        "video_codec": video.get("codec_name") if video else None,
+        "audio_codec": audio.get("codec_name") if audio else None,
+        "has_audio": int(audio is not None),
+        "bit_rate": _number(container.get("bit_rate"), int),
+        "streams": json.dumps(summary, separators=(",", ":"))
+    }
+
+class MediaCatalog:
+    """
+    Probe results of the media files in the Capri data directory, cached in SQLite.
+
+    An entry is keyed by the file's relative path and stays valid while its size and mtime
+    are unchanged, so every media tool can ask for dimensions, durations or audio streams
+    without running ffprobe again. Keyframe positions are costlier to read and are only
+    probed when a tool asks for them.
+    """
+    def __init__(self, root: Optional[str] = None, database_path: Optional[str] = None):
+        self.root = root or get_capri_dir()
+        self.database_path = database_path or os.path.join(get_capri_state_dir(), CATALOG_DATABASE_FILE)
+        self.cache_hits = 0
+        self.probes = 0
+        self.keyframe_probes = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+        connection = self.connect()
+        try:
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.database_path, timeout=30, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def relative_path(self, path: str) -> str:
+        return os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, "/")
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _probe_row(self, path: str, relative_path: str, size: int, mtime: float, keyframes: bool,
+                   previous: Optional[Tuple[Any, ...]] = None) -> Tuple[Tuple[Any, ...], bool]:
+        """
+        Catalog row for a file, reusing a still-valid row and only adding what it lacks, and
+        whether the row may be cached (not when the file couldn't be read or run through ffprobe
+        right now, so it's probed again next time)
+        """
+        cacheable = True
+        if previous is not None:
+            values = dict(zip(COLUMNS, previous))
+        else:
+            self._count("probes")
+            try:
+                values = describe_probe(path, run_ffprobe(path))
+            except (ValueError, MediaProbeError):
+                self._count("failures")
+                values = {"kind": UNREADABLE}
+            except OSError:
+                self._count("failures")
+                values = {"kind": UNREADABLE}
+                cacheable = False
+            values["keyframes"] = None
+
+        if keyframes and values["keyframes"] is None and values["kind"] == "video":
+            self._count("keyframe_probes")
+            try:
+                values["keyframes"] = json.dumps(probe_keyframes(path), separators=(",", ":"))
+            except (OSError, MediaProbeError):
+                self._count("failures")
+
+        values.update(path=relative_path, size=size, mtime=mtime)
+        return tuple(values.get(column, 0 if column == "has_audio" else None) for column in COLUMNS), cacheable
+
+    def _write(self, connection: sqlite3.Connection, rows: List[Tuple[Any, ...]]) -> None:
+        connection.executemany(
+            f"INSERT OR REPLACE INTO media ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows
+        )
+        connection.commit()
+
+    def probe_many(self, files: Iterable[Tuple[str, int, float]], keyframes: bool = False,
+                   workers: int = PROBE_WORKERS, progress_output=None) -> Dict[str, MediaInfo]:
+        """
+        Catalog entries for (full path, size, mtime) triples, keyed by full path.
+
+        Entries still valid in the catalog are read in one pass; the rest are probed on a
+        thread pool (one ffprobe process per file) and written back in batches.
+        """
+        files = list(files)
+        connection = self.connect()
+        try:
+            cached: Dict[str, Tuple[Any, ...]] = {}
+            relative_paths = [self.relative_path(path) for path, _size, _mtime in files]
+            # Looked up in slices to stay under SQLite's variable limit
+            for start in range(0, len(relative_paths), 500):
+                chunk = relative_paths[start:start + 500]
+                for row in connection.execute(f"SELECT {', '.join(COLUMNS)} FROM media WHERE path IN ({', '.join('?' * len(chunk))})", chunk):
+                    cached[row[0]] = row
+
+            results: Dict[str, MediaInfo] = {}
+            pending = []
+            for (path, size, mtime), relative_path in zip(files, relative_paths):
+                row = cached.get(relative_path)
+                if row is not None and (row[1], row[2]) == (size, mtime):
+                    if not keyframes or row[-1] is not None or row[3] != "video":
+                        self._count("cache_hits")
+                        results[path] = MediaInfo(row)
+                        continue
+                    pending.append((path, relative_path, size, mtime, row))
+                else:
+                    pending.append((path, relative_path, size, mtime, None))
+
+            if pending:
+                if shutil.which("ffprobe") is None:
+                    raise MediaProbeError("ffprobe was not found; install FFmpeg to read media files")
+                progress = ProgressReporter("Probing media", total_items=len(pending), output=progress_output)
+
+                def probe(item):
+                    row, cacheable = self._probe_row(item[0], item[1], item[2], item[3], keyframes, item[4])
+                    progress.advance(items=1)
+                    return item[0], row, cacheable
+
+                batch = []
+                with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="capri-probe") as executor:
+                    for path, row, cacheable in executor.map(probe, pending):
+                        results[path] = MediaInfo(row)
+                        if not cacheable:
+                            continue
+                        batch.append(row)
+                        if len(batch) >= WRITE_BATCH_SIZE:
+                            self._write(connection, batch)
+                            batch = []
+                if batch:
+                    self._write(connection, batch)
+                progress.finish()
+            return results
+        finally:
+            connection.close()
+
+    def probe(self, path: str, keyframes: bool = False) -> MediaInfo:
+        """Catalog entry for one file, probing it if it's new or changed since it was cataloged"""
+        stat = os.stat(path)
+        return self.probe_many([(path, stat.st_size, stat.st_mtime)], keyframes=keyframes)[path]
+
+    def probe_paths(self, paths: Iterable[str], keyframes: bool = False, progress_output=None) -> Dict[str, MediaInfo]:
+        """Like probe_many, for paths that still need a stat; files that can't be read are left out"""
+        files = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((path, stat.st_size, stat.st_mtime))
+        return self.probe_many(files, keyframes=keyframes, progress_output=progress_output)
+
+    def update(self, directory: str = "", progress_output=print) -> int:
+        """
+        Bring the catalog up to date for the media files below directory (relative).
+
+        The file list, sizes and mtimes come from the file index, so only new and changed
+        files are touched. Entries of files that are gone are removed. Returns the number of
+        media files seen.
+        """
+        # Imported here: the file index starts a background watcher, which only tools that
+        # update the catalog need
+        from capri_tools.file_index import get_file_index
+
+        if shutil.which("ffprobe") is None:
+            raise MediaProbeError("ffprobe was not found; install FFmpeg to catalog media files")
+
+        index = get_file_index()
+        index.wait_until_ready()
+
+        prefix = directory.strip("/").replace(os.sep, "/")
+        extensions = sorted(MEDIA_EXTENSIONS)
+        query = f"SELECT path, size, mtime FROM files WHERE is_dir = 0 AND extension IN ({', '.join('?' * len(extensions))})"
+        parameters: List[Any] = list(extensions)
+        if prefix:
+            query += " AND path >= ? AND path < ?"
+            parameters.extend([prefix + "/", prefix + "0"])
+
+        connection = index.connect()
+        try:
+            listed = connection.execute(query, parameters).fetchall()
+        finally:
+            connection.close()
+
+        self.probe_many(
+            [(os.path.join(self.root, path), size, mtime) for path, size, mtime in listed],
+            progress_output=progress_output
+        )
+
+        seen = {path for path, _size, _mtime in listed}
+        connection = self.connect()
+        try:
+            if prefix:
+                rows = connection.execute("SELECT path FROM media WHERE path >= ? AND path < ?", (prefix + "/", prefix + "0"))
+            else:
+                rows = connection.execute("SELECT path FROM media")
+            gone = [(path,) for (path,) in rows if path not in seen]
+            connection.executemany("DELETE FROM media WHERE path = ?", gone)
+            connection.commit()
+        finally:
+            connection.close()
+        return len(listed)
+
+    def query(self, where: str, parameters: List[Any], order: str, limit: int) -> Tuple[List[MediaInfo], int]:
+        """Entries matching a WHERE clause over the media table, and the total number of matches"""
+        connection = self.connect()
+        try:
+            total = connection.execute(f"SELECT COUNT(*) FROM media{where}", parameters).fetchone()[0]
+            rows = connection.execute(f"SELECT {', '.join(COLUMNS)} FROM media{where}{order} LIMIT ?", parameters + [limit]).fetchall()
+        finally:
+            connection.close()
+        return [MediaInfo(row) for row in rows], total
+
+    def stats(self) -> Dict[str, int]:
+        connection = self.connect()
+        try:
+            entries = connection.execute("SELECT COUNT(*) FROM media").fetchone()[0]
+        finally:
+            connection.close()
+        return {
+            "entries": entries,
+            "cache_hits": self.cache_hits,
+            "probes": self.probes,
+            "keyframe_probes": self.keyframe_probes,
+            "failures": self.failures
+        }
+
+_media_catalog: Optional[MediaCatalog] = None
+_media_catalog_lock = threading.Lock()
+
+def get_media_catalog() -> MediaCatalog:
+    """Return the shared media catalog of the Capri data directory"""
+    global _media_catalog
+    with _media_catalog_lock:
+        if _media_catalog is None:
+            _media_catalog = MediaCatalog()
+            register_metrics("media_catalog", _media_catalog.stats)
+        return _media_catalog
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+from capri_tools.atomic_write import atomic_write
+from capri_tools.copy_engine import CopyStats, copy_path, DEFAULT_WORKERS
+from capri_tools.get_capri_dir import get_capri_state_dir
+from capri_tools.trash import is_cross_device, remove_tree
+
+# Phases recorded in a move's journal; a move interrupted in either one continues from it
+PHASE_COPYING = "copying"
+PHASE_DELETING = "deleting"
+
+class MoveResult:
+    """How a move was done: "rename" (same filesystem) or "copy" (copied, verified, source deleted)"""
+    def __init__(self, method: str, resumed: bool = False, stats: Optional[CopyStats] = None):
+        self.method = method
+        self.resumed = resumed
+        self.stats = stats
+
+    @property
+    def complete(self) -> bool:
+        return self.stats is None or not self.stats.errors
+
+class MoveJournal:
+    """
+    Record of a cross-device move in progress, kept in .capri/moves until the source is gone.
+
+    The journal is what makes a move resumable: while it exists, the destination is known to
+    be a partial copy made by this move rather than something the user put there.
+    """
+    def __init__(self, source: str, destination: str):
+        self.source = os.path.abspath(source)
+        self.destination = os.path.abspath(destination)
+        key = hashlib.blake2b(f"{self.source}\0{self.destination}".encode("utf-8"), digest_size=8).hexdigest()
+        self.path = os.path.join(get_capri_state_dir("moves"), f"{key}.json")
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, phase: str, started_at: Optional[float] = None) -> None:
+        with atomic_write(self.path) as file:
+            json.dump({
+                "source": self.source,
+                "destination": self.destination,
+                "phase": phase,
+                "started_at": started_at or time.time()
+            }, file)
+
+    def remove(self) -> None:
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+def pending_moves() -> List[Dict[str, Any]]:
+    """Cross-device moves that were interrupted, oldest first"""
+    directory = get_capri_state_dir("moves")
+    moves = []
+    for name in os.listdir(directory):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name), "r", encoding="utf-8") as file:
+                moves.append(json.load(file))
+        except (OSError, ValueError):
+            continue
+    moves.sort(key=lambda move: move.get("started_at", 0))
+    return moves
+
+def has_pending_move(source: str, destination: str) -> bool:
+    return MoveJournal(source, destination).load() is not None
+
+def move_path(source: str, destination: str, workers: int = DEFAULT_WORKERS, progress_output=print) -> MoveResult:
+    """
+    Move a file or directory tree to destination.
+
+    Within one filesystem this is a single rename, whatever the size of the tree. Across
+    filesystems the tree is copied in parallel, every file is read back and compared with
+    its source, and only then is the source deleted. Each phase is journaled, so calling
+    move_path again after an interruption continues where it stopped: files already copied
+    are checked by content and skipped, a partially copied file continues from its .part
+    file, and a partially deleted source is finished off. If some files fail to copy, the
+    source is left in place and the returned result lists the errors.
+    """
+    journal = MoveJournal(source, destination)
+    state = journal.load()
+
+    if state is None:
+        try:
+            os.rename(source, destination)
+            return MoveResult("rename")
+        except OSError as e:
+            if not is_cross_device(e):
+                raise
+        if os.path.isdir(destination) and not os.path.islink(destination):
+            raise FileExistsError(f"Destination already exists: {destination}")
+
+    resumed = state is not None
+    started_at = state.get("started_at") if state else None
+    stats = None
+
+    if state is None or state.get("phase") == PHASE_COPYING:
+        journal.save(PHASE_COPYING, started_at)
+        if os.path.islink(source):
+            if os.path.lexists(destination):
+                os.remove(destination)
+            os.symlink(os.readlink(source), destination)
+        else:
+            # After an interruption, files already at the destination are trusted only if
+            # their contents match
+            stats = copy_path(source, destination, incremental=resumed, checksum=resumed, workers=workers,
+                              progress_output=progress_output, verify=True, label="Moving")
+            if stats.errors:
+                return MoveResult("copy", resumed, stats)
+
+    journal.save(PHASE_DELETING, started_at)
+    if os.path.isdir(source) and not os.path.islink(source):
+        remove_tree(source)
+    elif os.path.lexists(source):
+        os.unlink(source)
+    journal.remove()
+    return MoveResult("copy", resumed, stats)
@@ -1,9 +1,11 @@
 import json
 import os
-import shutil
 from typing import Tuple, Optional
 from capri_tools.tool_definition import ToolDefinition
 from capri_tools.get_capri_dir import get_capri_dir
+from capri_tools.file_cache import invalidate_path
+from capri_tools.move_engine import move_path, has_pending_move
+from capri_tools.copy_file_or_directory import describe_copy
 
 # Schema for move_file_or_directory tool
 move_file_or_directory_schema = {
@@ -41,24 +43,42 @@ def move_file_or_directory_function(input_bytes: bytes) -> Tuple[str, Optional[E
         full_source_path = os.path.join(capri_dir, source_path)
         full_destination_path = os.path.join(capri_dir, destination_path)
         
-        # Check if source exists
-        if not os.path.exists(full_source_path):
+        # Moving onto an existing directory puts the source inside it, like mv; an
+        # interrupted move already knows its final destination
+        if not has_pending_move(full_source_path, full_destination_path) and os.path.isdir(full_destination_path):
+            full_destination_path = os.path.join(full_destination_path, os.path.basename(os.path.normpath(full_source_path)))
+        
+        resuming = has_pending_move(full_source_path, full_destination_path)
+        
+        # Check if source exists (an interrupted move may already have deleted part or all of it)
+        if not os.path.lexists(full_source_path) and not resuming:
             return "", Exception(f"Source not found: {source_path}")
         
-        # Move the file or directory
-        shutil.move(full_source_path, full_destination_path)
+        # Move the file or directory: a rename on the same drive, a verified copy across drives
+        result = move_path(full_source_path, full_destination_path)
+        invalidate_path(full_source_path)
+        invalidate_path(full_destination_path)
         
         # Determine what was moved
         source_type = "directory" if os.path.isdir(full_destination_path) else "file"
+        details = ""
+        if result.method == "copy":
+            details = f" across drives{describe_copy(result.stats) if result.stats else ''}"
+            if result.resumed:
+                details += ", resuming an interrupted move"
+        
+        if not result.complete:
+            failed = "\n".join(f"{os.path.relpath(path, capri_dir)}: {error}" for path, error in result.stats.errors[:20])
+            return "", Exception(f"Moving {source_type} from {source_path} to {destination_path}{details} failed for {len(result.stats.errors)} file(s); the source was left in place and running the same move again resumes it\n{failed}")
         
-        return f"Successfully moved {source_type} from {source_path} to {destination_path}", None
+        return f"Successfully moved {source_type} from {source_path} to {destination_path}{details}", None
     except Exception as e:
         return "", e
 
 # Create the tool definition
 move_file_or_directory_tool = ToolDefinition(
     name="move_file_or_directory",
-    description="Move a file or directory from one location to another within the Capri data directory. Automatically detects whether the source is a file or directory.",
+    description="Move a file or directory from one location to another within the Capri data directory. Automatically detects whether the source is a file or directory. Moves on the same drive are instant; moves to another drive copy in parallel, verify the copy and then delete the source, and an interrupted move resumes when it is run again.",
     input_schema=move_file_or_directory_schema,
     function=move_file_or_directory_function
 )
\ No newline at end of file
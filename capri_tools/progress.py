@@ -0,0 +1,70 @@
+import threading
+import time
+from typing import Callable, Optional
+
+# Seconds between progress lines
+DEFAULT_INTERVAL = 1.0
+
+def format_bytes(size: float) -> str:
+    """Human-readable size, e.g. 1.5 GB"""
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if abs(size) < 1024 or unit == "TB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+class ProgressReporter:
+    """
+    Thread-safe progress counter for long-running tools, printing at most one line per interval.
+
+    Workers call advance() as items finish; totals can grow while work is being discovered.
+    """
+    def __init__(self, label: str, unit: str = "files", total_items: int = 0, total_bytes: int = 0,
+                 interval: float = DEFAULT_INTERVAL, output: Optional[Callable[[str], None]] = print):
+        self.label = label
+        self.unit = unit
+        self.total_items = total_items
+        self.total_bytes = total_bytes
+        self.items = 0
+        self.bytes = 0
+        self.interval = interval
+        self.output = output
+        self.started = time.monotonic()
+        self._last_report = self.started
+        self._lock = threading.Lock()
+
+    def add_total(self, items: int = 0, size: int = 0) -> None:
+        with self._lock:
+            self.total_items += items
+            self.total_bytes += size
+
+    def advance(self, items: int = 0, size: int = 0) -> None:
+        with self._lock:
+            self.items += items
+            self.bytes += size
+            now = time.monotonic()
+            if self.output is None or now - self._last_report < self.interval:
+                return
+            self._last_report = now
+            line = self._line(now)
+        self.output(line)
+
+    def _line(self, now: float) -> str:
+        line = f"{self.label}: {self.items}/{self.total_items} {self.unit}"
+        if self.total_bytes:
+            elapsed = max(now - self.started, 1e-6)
+            percent = 100 * self.bytes / self.total_bytes
+            line += f", {format_bytes(self.bytes)}/{format_bytes(self.total_bytes)} ({percent:.0f}%), {format_bytes(self.bytes / elapsed)}/s"
+        return line
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def finish(self) -> None:
+        """Print the final state if anything was reported along the way"""
+        with self._lock:
+            if self.output is None or self._last_report == self.started:
+                return
+            line = self._line(time.monotonic())
+        self.output(line)
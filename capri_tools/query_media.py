@@ -0,0 +1,268 @@
+import json
+import os
+import re
+from typing import Tuple, Optional, List, Any
+from capri_tools.tool_definition import ToolDefinition
+from capri_tools.find_files import parse_size
+from capri_tools.media_catalog import get_media_catalog, MediaInfo, UNREADABLE
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 5000
+
+SORT_COLUMNS = {
+    "path": "path",
+    "duration": "duration",
+    "size": "size",
+    "resolution": "width * height",
+    "frame_rate": "frame_rate"
+}
+
+# Named resolutions, as the minimum length of the shorter side (so portrait clips count too)
+RESOLUTIONS = {"480p": 480, "720p": 720, "1080p": 1080, "1440p": 1440, "2k": 1440, "2160p": 2160, "4k": 2160, "4320p": 4320, "8k": 4320}
+
+DURATION_PATTERN = re.compile(r"^\s*(?:(\d+(?:\.\d+)?)\s*h)?\s*(?:(\d+(?:\.\d+)?)\s*m(?:in)?)?\s*(?:(\d+(?:\.\d+)?)\s*s)?\s*$", re.IGNORECASE)
+
+# Schema for query_media tool
+query_media_schema = {
+    "type": "object",
+    "properties": {
+        "path": {
+            "type": "string",
+            "description": "Optional. Only media below this directory (relative to the Capri data directory)."
+        },
+        "kind": {
+            "type": "string",
+            "enum": ["video", "audio", "image", "any"],
+            "description": "Optional. Kind of media to find (default: any)."
+        },
+        "name": {
+            "type": "string",
+            "description": "Optional. Text the relative path must contain (case-insensitive)."
+        },
+        "resolution": {
+            "type": "string",
+            "enum": list(RESOLUTIONS),
+            "description": "Optional. Minimum resolution, e.g. '4k' or '1080p' (measured on the shorter side)."
+        },
+        "min_width": {
+            "type": "integer",
+            "description": "Optional. Minimum width in pixels."
+        },
+        "min_height": {
+            "type": "integer",
+            "description": "Optional. Minimum height in pixels."
+        },
+        "max_width": {
+            "type": "integer",
+            "description": "Optional. Maximum width in pixels."
+        },
+        "max_height": {
+            "type": "integer",
+            "description": "Optional. Maximum height in pixels."
+        },
+        "min_duration": {
+            "type": "string",
+            "description": "Optional. Minimum duration, in seconds or like '10m', '1h30m' or '00:10:00'."
+        },
+        "max_duration": {
+            "type": "string",
+            "description": "Optional. Maximum duration, in the same formats as min_duration."
+        },
+        "min_frame_rate": {
+            "type": "number",
+            "description": "Optional. Minimum frame rate, e.g. 50."
+        },
+        "max_frame_rate": {
+            "type": "number",
+            "description": "Optional. Maximum frame rate."
+        },
+        "codec": {
+            "type": "string",
+            "description": "Optional. Video or audio codec name as reported by ffprobe, e.g. 'h264', 'hevc', 'aac'."
+        },
+        "has_audio": {
+            "type": "boolean",
+            "description": "Optional. Only media with (true) or without (false) an audio stream."
+        },
+        "min_size": {
+            "type": "string",
+            "description": "Optional. Minimum file size, in bytes or with a unit, e.g. '500MB'."
+        },
+        "max_size": {
+            "type": "string",
+            "description": "Optional. Maximum file size, in bytes or with a unit."
+        },
+        "sort": {
+            "type": "string",
+            "enum": list(SORT_COLUMNS),
+            "description": "Optional. Sort by path (default), duration, size, resolution or frame_rate."
+        },
+        "reverse": {
+            "type": "boolean",
+            "description": "Optional. Reverse the sort order, e.g. longest or largest first (default: false)."
+        },
+        "format": {
+            "type": "string",
+            "enum": ["json", "compact"],
+            "description": "Optional. 'json' (default) or 'compact': one 'path<TAB>kind<TAB>WxH<TAB>duration<TAB>codecs' line per file."
+        },
+        "limit": {
+            "type": "integer",
+            "description": f"Optional. Maximum number of results (default: {DEFAULT_LIMIT}, max: {MAX_LIMIT})."
+        },
+        "refresh": {
+            "type": "boolean",
+            "description": "Optional. Catalog new and changed files before answering (default: true). With false, only what is already cataloged is searched."
+        }
+    }
+}
+
+def parse_duration(value: Any) -> float:
+    """Parse a duration given in seconds or as a string like '10m', '1h30m', '90s' or '01:30:00'"""
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    text = str(value).strip()
+    if ":" in text:
+        try:
+            seconds = 0.0
+            for part in text.split(":"):
+                seconds = seconds * 60 + float(part)
+            return seconds
+        except ValueError:
+            raise ValueError(f"Invalid duration: {value}")
+
+    try:
+        return float(text)
+    except ValueError:
+        pass
+
+    match = DURATION_PATTERN.match(text)
+    if not match or not any(match.groups()):
+        raise ValueError(f"Invalid duration: {value}. Use seconds, '10m', '1h30m' or 'HH:MM:SS'")
+    hours, minutes, seconds = (float(group) if group else 0.0 for group in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+def build_media_query(input_data: dict) -> Tuple[str, List[Any]]:
+    """Turn query_media arguments into a WHERE clause over the media catalog and its parameters"""
+    conditions: List[str] = ["kind != ?"]
+    parameters: List[Any] = [UNREADABLE]
+
+    kind = input_data.get("kind") or "any"
+    if kind in ("video", "audio", "image"):
+        conditions.append("kind = ?")
+        parameters.append(kind)
+    elif kind != "any":
+        raise ValueError(f"Invalid kind: {kind}. Use 'video', 'audio', 'image' or 'any'")
+
+    path = (input_data.get("path") or "").strip("/").replace(os.sep, "/")
+    if path:
+        # Range on the primary key: everything below path/ sorts between 'path/' and 'path0'
+        conditions.append("path >= ? AND path < ?")
+        parameters.extend([path + "/", path + "0"])
+
+    name = input_data.get("name")
+    if name:
+        conditions.append("path LIKE ? ESCAPE '\\'")
+        parameters.append("%" + name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+
+    resolution = input_data.get("resolution")
+    if resolution:
+        if resolution.lower() not in RESOLUTIONS:
+            raise ValueError(f"Invalid resolution: {resolution}. Use one of: {', '.join(RESOLUTIONS)}")
+        conditions.append("MIN(width, height) >= ?")
+        parameters.append(RESOLUTIONS[resolution.lower()])
+
+    for key, condition in (("min_width", "width >= ?"), ("min_height", "height >= ?"),
+                           ("max_width", "width <= ?"), ("max_height", "height <= ?"),
+                           ("min_frame_rate", "frame_rate >= ?"), ("max_frame_rate", "frame_rate <= ?")):
+        if input_data.get(key) is not None:
+            conditions.append(condition)
+            parameters.append(input_data[key])
+
+    if input_data.get("min_duration") is not None:
+        conditions.append("duration >= ?")
+        parameters.append(parse_duration(input_data["min_duration"]))
+
+    if input_data.get("max_duration") is not None:
+        conditions.append("duration <= ?")
+        parameters.append(parse_duration(input_data["max_duration"]))
+
+    codec = input_data.get("codec")
+    if codec:
+        conditions.append("(video_codec = ? OR audio_codec = ?)")
+        parameters.extend([codec.lower(), codec.lower()])
+
+    if input_data.get("has_audio") is not None:
+        conditions.append("has_audio = ?")
+        parameters.append(int(bool(input_data["has_audio"])))
+
+    if input_data.get("min_size") is not None:
+        conditions.append("size >= ?")
+        parameters.append(parse_size(input_data["min_size"]))
+
+    if input_data.get("max_size") is not None:
+        conditions.append("size <= ?")
+        parameters.append(parse_size(input_data["max_size"]))
+
+    return " WHERE " + " AND ".join(conditions), parameters
+
+def _compact_line(info: MediaInfo) -> str:
+    dimensions = f"{info.width}x{info.height}" if info.width and info.height else "-"
+    duration = f"{info.duration:.1f}s" if info.duration is not None else "-"
+    codecs = "/".join(codec for codec in (info.video_codec, info.audio_codec) if codec) or "-"
+    return f"{info.relative_path}\t{info.kind}\t{dimensions}\t{duration}\t{codecs}"
+
+def query_media_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
+    """Find media files in the Capri data directory by their properties, using the media catalog"""
+    try:
+        input_data = json.loads(input_bytes)
+        sort = input_data.get("sort") or "path"
+        reverse = input_data.get("reverse", False)
+        output_format = input_data.get("format") or "json"
+        limit = max(1, min(int(input_data.get("limit") or DEFAULT_LIMIT), MAX_LIMIT))
+        refresh = input_data.get("refresh", True)
+
+        if sort not in SORT_COLUMNS:
+            return "", Exception(f"Invalid sort: {sort}. Use one of: {', '.join(SORT_COLUMNS)}")
+
+        if output_format not in ("json", "compact"):
+            return "", Exception(f"Invalid format: {output_format}. Use 'json' or 'compact'")
+
+        try:
+            where, parameters = build_media_query(input_data)
+        except ValueError as e:
+            return "", Exception(str(e))
+
+        catalog = get_media_catalog()
+        if refresh:
+            # Only files that are new or changed since they were cataloged get probed
+            catalog.update(input_data.get("path") or "")
+
+        # Unknown values (e.g. no duration) sort last either way
+        order = f" ORDER BY {SORT_COLUMNS[sort]} IS NULL, {SORT_COLUMNS[sort]}{' DESC' if reverse else ''}, path"
+        results, total = catalog.query(where, parameters, order, limit)
+
+        if output_format == "compact":
+            lines = [_compact_line(info) for info in results]
+            if total > len(results):
+                lines.append(f"[{len(results)} of {total} matches shown]")
+            return "\n".join(lines) if lines else "No matching media files", None
+
+        result = {
+            "results": [info.to_dict() for info in results],
+            "total": total,
+            "truncated": total > len(results)
+        }
+        return json.dumps(result, separators=(",", ":"), ensure_ascii=False), None
+
+    except Exception as e:
+        return "", e
+
+# Create the tool definition
+query_media_tool = ToolDefinition(
+    name="query_media",
+    description="Find videos, audio files and images in the Capri data directory by their properties: resolution (e.g. '4k'), duration, frame rate, codec, audio presence or size. Answers from a catalog of probe results, so only new or changed files are ever opened.",
+    input_schema=query_media_schema,
+    function=query_media_function
+)
@@ -3,6 +3,11 @@ import os
 from typing import Tuple, Optional
 from capri_tools.tool_definition import ToolDefinition
 from capri_tools.get_capri_dir import get_capri_dir
+from capri_tools.file_cache import file_cache
+from capri_tools.line_index import read_line_range, read_head, read_tail, read_byte_range, count_lines
+
+# Largest amount of text returned by a single read; bigger files have to be paged
+MAX_READ_BYTES = 1024 * 1024
 
 # Schema for read_file tool
 read_file_schema = {
@@ -11,16 +16,54 @@ read_file_schema = {
         "path": {
             "type": "string",
             "description": "The relative path of a file in the Capri data directory."
+        },
+        "start_line": {
+            "type": "integer",
+            "description": "Optional. First line to read (1-based). Use with end_line to page through large files."
+        },
+        "end_line": {
+            "type": "integer",
+            "description": "Optional. Last line to read (inclusive). Defaults to the end of the file when start_line is given."
+        },
+        "head": {
+            "type": "integer",
+            "description": "Optional. Read only the first N lines."
+        },
+        "tail": {
+            "type": "integer",
+            "description": "Optional. Read only the last N lines (e.g. the end of a log)."
+        },
+        "byte_offset": {
+            "type": "integer",
+            "description": "Optional. Read from this byte offset (negative values count from the end of the file)."
+        },
+        "byte_length": {
+            "type": "integer",
+            "description": "Optional. Number of bytes to read from byte_offset."
         }
     },
     "required": ["path"]
 }
 
+def _decode(data: bytes) -> Tuple[str, bool]:
+    """Decode at most MAX_READ_BYTES of data, cutting on a line boundary where possible"""
+    truncated = len(data) > MAX_READ_BYTES
+    if truncated:
+        cut = data.rfind(b"\n", 0, MAX_READ_BYTES)
+        data = data[:cut + 1] if cut > 0 else data[:MAX_READ_BYTES]
+    return data.decode("utf-8", errors="replace"), truncated
+
 def read_file_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
-    """Read the contents of a given file path from the Capri data directory"""
+    """Read the contents (or a range of lines or bytes) of a given file path from the Capri data directory"""
     try:
         input_data = json.loads(input_bytes)
         path = input_data.get("path", "")
+        start_line = input_data.get("start_line")
+        end_line = input_data.get("end_line")
+        head = input_data.get("head")
+        tail = input_data.get("tail")
+        byte_offset = input_data.get("byte_offset")
+        byte_length = input_data.get("byte_length")
         
         if not path:
             return "", Exception("No file path provided")
@@ -30,9 +73,51 @@ def read_file_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
         
         # Join the Capri directory with the provided file path
         full_path = os.path.join(capri_dir, path)
-            
-        with open(full_path, 'r') as file:
-            content = file.read()
+        
+        # Ranged reads copy at most one byte past the limit, so truncation can be detected
+        # without touching the rest of the file
+        limit = MAX_READ_BYTES + 1
+        
+        if head is not None:
+            content, truncated = _decode(read_head(full_path, head, limit))
+        elif tail is not None:
+            data = read_tail(full_path, tail, limit)
+            truncated = len(data) > MAX_READ_BYTES
+            if truncated:
+                # Keep the end of the file, which is what a tail read is for
+                data = data[-MAX_READ_BYTES:]
+                data = data[data.find(b"\n") + 1:]
+            content, _ = _decode(data)
+        elif byte_offset is not None or byte_length is not None:
+            length = limit if byte_length is None else min(byte_length, limit)
+            data, size = read_byte_range(full_path, byte_offset or 0, length)
+            content, truncated = _decode(data)
+        elif start_line is not None or end_line is not None:
+            data, first, last, total = read_line_range(full_path, start_line or 1, end_line, limit)
+            content, truncated = _decode(data)
+            if truncated:
+                last = first + content.count("\n") - 1
+            content += f"\n[Lines {first}-{last} of {total}]"
+            truncated = False
+        elif os.path.getsize(full_path) > MAX_READ_BYTES:
+            # Don't load a huge file whole; return the first page and say how to get the rest
+            content, _ = _decode(read_head(full_path, MAX_READ_BYTES, limit))
+            last = content.count("\n")
+            total = count_lines(full_path)
+            content += f"\n[Lines 1-{last} of {total}. The file is too large to read at once; use start_line/end_line, head or tail to read the rest]"
+            truncated = False
+        else:
+            # Files read repeatedly in a session come from the content cache
+            content = file_cache.get(full_path)
+            if content is None:
+                with open(full_path, 'r') as file:
+                    stat = os.fstat(file.fileno())
+                    content = file.read()
+                file_cache.put(full_path, content, stat)
+            truncated = False
+        
+        if truncated:
+            content += f"\n[Output truncated to {MAX_READ_BYTES} bytes; read a smaller range]"
         
         return content, None
     except FileNotFoundError:
@@ -43,7 +128,7 @@ def read_file_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
 # Create the tool definition
 read_file_tool = ToolDefinition(
     name="read_file",
-    description="Read the contents of a file from the Capri data directory. Use this when you want to see what's inside a file.",
+    description="Read the contents of a file from the Capri data directory. Use this when you want to see what's inside a file. For large files, read a range with start_line/end_line, head, tail or byte_offset/byte_length.",
     input_schema=read_file_schema,
     function=read_file_function
-)
\ No newline at end of file
+)
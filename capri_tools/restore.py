@@ -0,0 +1,73 @@
+import json
+import os
+from datetime import datetime
+from typing import Tuple, Optional
+from capri_tools.tool_definition import ToolDefinition
+from capri_tools.get_capri_dir import get_capri_dir
+from capri_tools.file_cache import invalidate_path
+from capri_tools.trash import get_trash
+from capri_tools.progress import format_bytes
+
+# Schema for restore tool
+restore_schema = {
+    "type": "object",
+    "properties": {
+        "path": {
+            "type": "string",
+            "description": "Optional. The original relative path of a deleted directory to bring back (the most recent deletion of that path). Leave out both path and trash_id to list what can be restored."
+        },
+        "trash_id": {
+            "type": "string",
+            "description": "Optional. The trash id of the deletion to undo, as returned by delete_directory or the listing."
+        },
+        "destination_path": {
+            "type": "string",
+            "description": "Optional. Restore to this relative path instead of the original one."
+        }
+    }
+}
+
+def restore_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
+    """Restore a directory deleted with delete_directory, or list the restorable ones"""
+    try:
+        input_data = json.loads(input_bytes)
+        path = input_data.get("path", "")
+        trash_id = input_data.get("trash_id", "")
+        destination_path = input_data.get("destination_path", "")
+        
+        trash = get_trash()
+        
+        # List the trash
+        if not path and not trash_id:
+            entries = trash.list_entries()
+            if not entries:
+                return "The trash is empty", None
+            lines = [
+                f"{entry['id']}: {entry['original_path']} (deleted {datetime.fromtimestamp(entry['deleted_at']).isoformat(timespec='seconds')}"
+                + (f", {format_bytes(entry['size'])})" if entry.get("size") is not None else ")")
+                for entry in entries
+            ]
+            return "\n".join(lines), None
+        
+        if not trash_id:
+            trash_id = trash.find_entry(path)
+            if trash_id is None:
+                return "", Exception(f"No deleted directory found for path: {path}")
+        
+        try:
+            target = trash.restore(trash_id, destination_path or None)
+        except (FileNotFoundError, FileExistsError) as e:
+            return "", Exception(str(e))
+        invalidate_path(target)
+        
+        return f"Directory restored successfully: {os.path.relpath(target, get_capri_dir())}", None
+    except Exception as e:
+        return "", e
+
+# Create the tool definition
+restore_tool = ToolDefinition(
+    name="restore",
+    description="Bring back a directory deleted with delete_directory, by its original path or trash id. Call without arguments to list the deleted directories that can still be restored.",
+    input_schema=restore_schema,
+    function=restore_function
+)
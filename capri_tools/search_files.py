@@ -0,0 +1,330 @@
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Tuple, Optional, List, Dict, Any
+from capri_tools.tool_definition import ToolDefinition
+from capri_tools.get_capri_dir import get_capri_dir
+from capri_tools.file_index import get_file_index
+from capri_tools.find_files import build_query
+from capri_tools.trigram_index import get_trigram_index, required_trigrams, is_binary
+
+DEFAULT_MAX_RESULTS = 100
+MAX_RESULTS_LIMIT = 2000
+MAX_CONTEXT_LINES = 10
+
+# Longer lines are cut in the output (minified files would otherwise flood the context)
+MAX_LINE_CHARS = 300
+
+# Files are searched in batches of at most this many files / bytes per worker task
+BATCH_FILES = 64
+BATCH_BYTES = 8 * 1024 * 1024
+
+# Above this many bytes to search, worker processes are used: the regex engine holds the GIL,
+# so threads only overlap I/O. Below it, starting processes would cost more than it saves.
+PROCESS_POOL_MIN_BYTES = 32 * 1024 * 1024
+
+# Schema for search_files tool
+search_files_schema = {
+    "type": "object",
+    "properties": {
+        "query": {
+            "type": "string",
+            "description": "Text to search for, or a regular expression if regex is true."
+        },
+        "regex": {
+            "type": "boolean",
+            "description": "Optional. Treat query as a Python regular expression (default: false)."
+        },
+        "case_sensitive": {
+            "type": "boolean",
+            "description": "Optional. Match case exactly (default: false)."
+        },
+        "path": {
+            "type": "string",
+            "description": "Optional. Only search below this directory (relative to the Capri data directory)."
+        },
+        "include": {
+            "type": "string",
+            "description": "Optional. Only search files matching this glob, e.g. '*.srt' or 'notes/*.md'."
+        },
+        "extensions": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "Optional. Only search files with these extensions, e.g. ['txt', 'md']."
+        },
+        "include_hidden": {
+            "type": "boolean",
+            "description": "Optional. Also search files and directories whose name starts with '.' (default: false)."
+        },
+        "context": {
+            "type": "integer",
+            "description": f"Optional. Lines of context to show before and after each match (default: 0, max: {MAX_CONTEXT_LINES})."
+        },
+        "max_results": {
+            "type": "integer",
+            "description": f"Optional. Stop after this many matching lines (default: {DEFAULT_MAX_RESULTS}, max: {MAX_RESULTS_LIMIT})."
+        },
+        "use_index": {
+            "type": "boolean",
+            "description": "Optional. Keep a trigram index of the searched files and only read files that can match. Makes repeated searches over large text collections much faster (default: false)."
+        }
+    },
+    "required": ["query"]
+}
+
+def _line_text(data: bytes) -> str:
+    text = data.decode("utf-8", errors="replace").rstrip("\r")
+    if len(text) > MAX_LINE_CHARS:
+        text = text[:MAX_LINE_CHARS] + "..."
+    return text
+
+def search_file(full_path: str, pattern: bytes, flags: int, context: int, limit: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Search one file through a memory map, one match per line. Returns None for binary or
+    unreadable files, otherwise up to limit matches as {line, text, before, after}.
+    """
+    regex = re.compile(pattern, flags)
+    try:
+        with open(full_path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size == 0:
+                return []
+
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if is_binary(mm):
+                    return None
+
+                matches = []
+                position = 0
+                counted_to = 0
+                line_number = 1
+                while position <= size and len(matches) < limit:
+                    match = regex.search(mm, position)
+                    if match is None:
+                        break
+
+                    line_start = mm.rfind(b"\n", 0, match.start()) + 1
+                    line_end = mm.find(b"\n", match.start())
+                    if line_end == -1:
+                        line_end = size
+
+                    line_number += mm[counted_to:line_start].count(b"\n")
+                    counted_to = line_start
+
+                    before = []
+                    start = line_start
+                    for offset in range(1, context + 1):
+                        if start == 0:
+                            break
+                        previous_start = mm.rfind(b"\n", 0, start - 1) + 1
+                        before.append((line_number - offset, _line_text(mm[previous_start:start - 1])))
+                        start = previous_start
+                    before.reverse()
+
+                    after = []
+                    end = line_end
+                    for offset in range(1, context + 1):
+                        if end + 1 >= size:
+                            break
+                        next_end = mm.find(b"\n", end + 1)
+                        if next_end == -1:
+                            next_end = size
+                        after.append((line_number + offset, _line_text(mm[end + 1:next_end])))
+                        end = next_end
+
+                    matches.append({
+                        "line": line_number,
+                        "text": _line_text(mm[line_start:line_end]),
+                        "before": before,
+                        "after": after
+                    })
+
+                    # One match per line: continue on the next line
+                    position = line_end + 1
+
+                return matches
+    except (OSError, ValueError):
+        return None
+
+def search_batch(root: str, paths: List[str], pattern: bytes, flags: int, context: int, limit: int) -> List[Tuple[str, Optional[List[Dict[str, Any]]]]]:
+    """Search a batch of files (one worker task), stopping once limit matches were found"""
+    results = []
+    found = 0
+    for path in paths:
+        matches = search_file(os.path.join(root, path), pattern, flags, context, limit - found)
+        results.append((path, matches))
+        found += len(matches or [])
+        if found >= limit:
+            break
+    return results
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """Worker processes are kept between searches; spawn (not fork) so they don't inherit loaded models or threads"""
+    global _process_pool
+    with _pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=multiprocessing.get_context("spawn"))
+        return _process_pool
+
+def _get_thread_pool() -> ThreadPoolExecutor:
+    global _thread_pool
+    with _pool_lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) + 4), thread_name_prefix="capri-search")
+        return _thread_pool
+
+def _batches(files: List[Tuple[str, int, float]]) -> List[List[str]]:
+    batches: List[List[str]] = []
+    current: List[str] = []
+    current_bytes = 0
+    for path, size, _mtime in files:
+        if current and (len(current) >= BATCH_FILES or current_bytes + size > BATCH_BYTES):
+            batches.append(current)
+            current, current_bytes = [], 0
+        current.append(path)
+        current_bytes += size
+    if current:
+        batches.append(current)
+    return batches
+
+def _candidate_files(input_data: Dict[str, Any]) -> Tuple[List[Tuple[str, int, float]], List[str]]:
+    """Return (files matching the path/include/extension filters, every indexed file path) from the file index"""
+    where, parameters = build_query({
+        "type": "file",
+        "path": input_data.get("path"),
+        "pattern": input_data.get("include"),
+        "extensions": input_data.get("extensions")
+    })
+    if not input_data.get("include_hidden", False):
+        where += " AND path NOT GLOB '.*' AND path NOT GLOB '*/.*'"
+
+    index = get_file_index()
+    index.wait_until_ready()
+    connection = index.connect()
+    try:
+        files = connection.execute(f"SELECT path, size, mtime FROM files{where} ORDER BY path", parameters).fetchall()
+        all_paths = [path for (path,) in connection.execute("SELECT path FROM files WHERE is_dir = 0")] if input_data.get("use_index") else []
+    finally:
+        connection.close()
+    return files, all_paths
+
+def _format_results(results: List[Tuple[str, List[Dict[str, Any]]]]) -> str:
+    """grep-style output: 'path:line:text' for matches, 'path-line-text' for context, '--' between groups"""
+    lines = []
+    for path, matches in results:
+        shown: Dict[int, Tuple[str, str]] = {}
+        for match in matches:
+            for number, text in match["before"] + match["after"]:
+                shown.setdefault(number, ("-", text))
+            shown[match["line"]] = (":", match["text"])
+
+        previous = None
+        for number in sorted(shown):
+            if previous is not None and number > previous + 1:
+                lines.append("--")
+            separator, text = shown[number]
+            lines.append(f"{path}{separator}{number}{separator}{text}")
+            previous = number
+        if lines and lines[-1] != "--":
+            lines.append("--")
+
+    if lines:
+        lines.pop()
+    return "\n".join(lines)
+
+def search_files_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
+    """Search the contents of text files in the Capri data directory"""
+    try:
+        input_data = json.loads(input_bytes)
+        query = input_data.get("query", "")
+        use_regex = input_data.get("regex", False)
+        case_sensitive = input_data.get("case_sensitive", False)
+        context = max(0, min(int(input_data.get("context") or 0), MAX_CONTEXT_LINES))
+        max_results = max(1, min(int(input_data.get("max_results") or DEFAULT_MAX_RESULTS), MAX_RESULTS_LIMIT))
+
+        if not query:
+            return "", Exception("No query provided")
+
+        pattern = query.encode("utf-8") if use_regex else re.escape(query.encode("utf-8"))
+        flags = re.MULTILINE | (0 if case_sensitive else re.IGNORECASE)
+        try:
+            re.compile(pattern, flags)
+        except re.error as e:
+            return "", Exception(f"Invalid regular expression: {str(e)}")
+
+        try:
+            files, all_paths = _candidate_files(input_data)
+        except ValueError as e:
+            return "", Exception(str(e))
+
+        root = get_capri_dir()
+        candidates = len(files)
+        total_bytes = sum(size for _path, size, _mtime in files)
+        executor = _get_process_pool() if total_bytes >= PROCESS_POOL_MIN_BYTES else _get_thread_pool()
+
+        if input_data.get("use_index"):
+            trigram_index = get_trigram_index()
+            trigram_index.prune(all_paths)
+            trigram_index.update(files, lambda function, paths: executor.map(function, paths, chunksize=16))
+
+            trigrams = required_trigrams(query, use_regex)
+            if trigrams:
+                wanted = set(trigram_index.candidates([path for path, _size, _mtime in files], trigrams))
+                files = [file for file in files if file[0] in wanted]
+
+        # Files actually read; with the index, the others were ruled out without reading them
+        searched = f"searched {len(files)} files"
+        if len(files) < candidates:
+            searched = f"searched {len(files)} of {candidates} files, the rest ruled out by the index"
+
+        # Batches are submitted in path order and collected in that order, so output is stable
+        futures = [
+            executor.submit(search_batch, root, batch, pattern, flags, context, max_results)
+            for batch in _batches(files)
+        ]
+
+        results = []
+        found = 0
+        truncated = False
+        for index, future in enumerate(futures):
+            for path, matches in future.result():
+                if not matches:
+                    continue
+                if found + len(matches) > max_results:
+                    matches = matches[:max_results - found]
+                results.append((path, matches))
+                found += len(matches)
+                if found >= max_results:
+                    break
+
+            if found >= max_results:
+                truncated = True
+                for pending in futures[index + 1:]:
+                    pending.cancel()
+                break
+
+        if not results:
+            return f"No matches found ({searched})", None
+
+        summary = f"[{found} matching lines in {len(results)} files"
+        summary += f"; stopped at max_results={max_results}]" if truncated else f"; {searched}]"
+        return f"{_format_results(results)}\n{summary}", None
+
+    except Exception as e:
+        return "", e
+
+# Create the tool definition
+search_files_tool = ToolDefinition(
+    name="search_files",
+    description="Search the contents of text files in the Capri data directory for text or a regular expression. Returns matching lines as 'path:line:text', with optional context lines. Binary files are skipped. Use this instead of reading files one by one.",
+    input_schema=search_files_schema,
+    function=search_files_function
+)
@@ -0,0 +1,257 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from capri_tools.media_catalog import MediaInfo, run_ffprobe
+from capri_tools.progress import ProgressReporter
+
+# Encoder and quality settings used to re-encode the partial GOPs at cut points, by the
+# source's video codec. The quality is kept high: these frames sit between untouched ones
+VIDEO_ENCODERS = {
+    "h264": ["-c:v", "libx264", "-crf", "16", "-preset", "medium"],
+    "hevc": ["-c:v", "libx265", "-crf", "18", "-preset", "medium"],
+    "mpeg4": ["-c:v", "mpeg4", "-q:v", "2"],
+    "mpeg2video": ["-c:v", "mpeg2video", "-q:v", "2"],
+    "vp8": ["-c:v", "libvpx", "-crf", "10", "-b:v", "0"],
+    "vp9": ["-c:v", "libvpx-vp9", "-crf", "20", "-b:v", "0"],
+    "av1": ["-c:v", "libaom-av1", "-crf", "24", "-b:v", "0", "-cpu-used", "6"]
+}
+
+# Container for the intermediate pieces. MPEG-TS carries H.264/HEVC parameter sets in-band
+# at every keyframe, so copied and re-encoded pieces (whose encoder settings differ) can be
+# joined and still decode; the VPx and AV1 bitstreams carry theirs in-band anyway
+PIECE_FORMATS = {
+    "h264": ("mpegts", ".ts"), "hevc": ("mpegts", ".ts"), "mpeg4": ("mpegts", ".ts"), "mpeg2video": ("mpegts", ".ts"),
+    "vp8": ("matroska", ".mkv"), "vp9": ("matroska", ".mkv"), "av1": ("matroska", ".mkv")
+}
+
+# Seeks land this far after a keyframe, so rounding never sends a stream copy back to the
+# keyframe before it
+SEEK_EPSILON = 0.001
+
+# In formats that don't seek by presentation time (Matroska, for one), ffmpeg seeks 3/23 s
+# earlier than asked when the video has B-frames, which would start a stream copy at the
+# keyframe before the wanted one; copies seek this far past their keyframe instead
+COPY_SEEK_OFFSET = 0.15
+
+# Stream copies read this many seconds past their end, so the keyframe closing the piece is
+# always reached whatever the decoder delay
+COPY_READ_AHEAD = 2.0
+
+# Pieces (rendered at once): stream copies are I/O bound, the short re-encodes CPU bound
+RENDER_WORKERS = os.cpu_count() or 1
+
+class SmartRenderError(Exception):
+    pass
+
+class Piece:
+    """
+    Part of a kept segment: copied as-is from a keyframe, or re-encoded; end None means to
+    the end of the file. seek is where the input is read from (past the keyframe for copies).
+    """
+    def __init__(self, start: float, end: Optional[float], copy: bool, seek: Optional[float] = None):
+        self.start = start
+        self.end = end
+        self.copy = copy
+        self.seek = start if seek is None else seek
+
+    def duration(self, total: Optional[float]) -> float:
+        end = self.end if self.end is not None else total
+        return max(0.0, (end or self.start) - self.start)
+
+class RenderStats:
+    """Seconds of video stream-copied and re-encoded by a smart render"""
+    def __init__(self, pieces: List[Piece], duration: Optional[float]):
+        self.pieces = pieces
+        self.copied_seconds = sum(piece.duration(duration) for piece in pieces if piece.copy)
+        self.encoded_seconds = sum(piece.duration(duration) for piece in pieces if not piece.copy)
+
+def unsupported_reason(info: MediaInfo) -> Optional[str]:
+    """Why a file can't be smart-rendered, or None if it can"""
+    if info.kind != "video" or not info.video_codec:
+        return "the file has no video stream"
+    if info.video_codec not in VIDEO_ENCODERS:
+        return f"{info.video_codec} video isn't supported"
+    if not info.keyframes:
+        return "its keyframes could not be read"
+    return None
+
+def plan_pieces(segments: Sequence[Tuple[float, float]], keyframes: Sequence[float], min_piece: float,
+                duration: Optional[float] = None) -> List[Piece]:
+    """
+    Split kept segments into pieces at keyframes (times relative to the start of the file).
+
+    Each segment is copied from its first to its last keyframe, and only the partial GOPs
+    before the first and after the last are re-encoded. A segment running to the end of the
+    file is copied to the end. A segment without two keyframes in it is re-encoded whole.
+    Pieces shorter than min_piece (about a frame) are dropped.
+    """
+    pieces = []
+    for start, end in segments:
+        first = bisect_left(keyframes, start - SEEK_EPSILON)
+        last = bisect_right(keyframes, end + SEEK_EPSILON) - 1
+        to_end = duration is not None and end >= duration - min_piece
+
+        if first >= len(keyframes) or last < first or (not to_end and keyframes[last] - keyframes[first] < min_piece):
+            pieces.append(Piece(start, end, False))
+            continue
+
+        copy_start = keyframes[first]
+        # Seek past the keyframe, but not as far as the next one
+        next_keyframe = keyframes[first + 1] if first + 1 < len(keyframes) else None
+        offset = COPY_SEEK_OFFSET if next_keyframe is None or next_keyframe - copy_start > 2 * COPY_SEEK_OFFSET else SEEK_EPSILON
+        if copy_start - start >= min_piece:
+            pieces.append(Piece(start, copy_start, False))
+        if to_end:
+            pieces.append(Piece(copy_start, None, True, copy_start + offset))
+            continue
+        copy_end = keyframes[last]
+        pieces.append(Piece(copy_start, copy_end, True, copy_start + offset))
+        if end - copy_end >= min_piece:
+            pieces.append(Piece(copy_end, end, False))
+    return pieces
+
+def _video_stream(probe: Dict[str, Any]) -> Dict[str, Any]:
+    for stream in probe.get("streams", []):
+        if stream.get("codec_type") == "video" and not stream.get("disposition", {}).get("attached_pic"):
+            return stream
+    raise SmartRenderError("No video stream found")
+
+def _piece_command(input_path: str, piece: Piece, piece_path: str, piece_format: str, codec: str,
+                   pix_fmt: Optional[str], min_piece: float) -> Tuple[List[str], str]:
+    """The ffmpeg command rendering a piece, and the file the piece ends up in"""
+    cmd = ["ffmpeg", "-v", "error"]
+    if not piece.copy:
+        # Input seeking when decoding is frame-accurate
+        cmd += ["-ss", f"{piece.start:.6f}", "-i", input_path, "-t", f"{piece.end - piece.start:.6f}", "-map", "0:v:0"]
+        cmd += VIDEO_ENCODERS[codec]
+        if pix_fmt:
+            cmd += ["-pix_fmt", pix_fmt]
+        return cmd + ["-an", "-sn", "-dn", "-f", piece_format, "-y", piece_path], piece_path
+
+    # Input seeking with stream copy starts at the keyframe at or before the position
+    cmd += ["-ss", f"{piece.seek:.6f}"]
+    if piece.end is None:
+        return cmd + ["-i", input_path, "-map", "0:v:0", "-c", "copy", "-an", "-sn", "-dn", "-f", piece_format, "-y", piece_path], piece_path
+
+    # -to stops on decode timestamps, which lets B-frames of the next GOP through; the segment
+    # muxer splits exactly at the keyframe that ends the piece, and what follows it (read
+    # until -to) goes to a second file that is ignored
+    base, extension = os.path.splitext(piece_path)
+    cmd += ["-to", f"{piece.end + COPY_READ_AHEAD:.6f}", "-i", input_path, "-map", "0:v:0", "-c", "copy", "-an", "-sn", "-dn",
+            "-f", "segment", "-segment_format", piece_format, "-reset_timestamps", "1",
+            "-segment_times", f"{piece.end - piece.start - min_piece / 2:.6f}", "-y", f"{base}_%d{extension}"]
+    return cmd, f"{base}_0{extension}"
+
+def _video_span(path: str) -> Optional[float]:
+    """Seconds of video in a rendered piece, from its packet timestamps"""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time,duration_time", "-of", "csv=p=0", path],
+        capture_output=True, text=True
+    )
+    starts, ends = [], []
+    for line in result.stdout.splitlines():
+        fields = line.strip().strip(",").split(",")
+        try:
+            pts = float(fields[0])
+            starts.append(pts)
+            ends.append(pts + (float(fields[1]) if len(fields) > 1 and fields[1] not in ("", "N/A") else 0.0))
+        except ValueError:
+            continue
+    return max(ends) - min(starts) if starts else None
+
+def _check_piece(piece: Piece, path: str, duration: Optional[float], min_piece: float) -> Optional[str]:
+    """
+    Why a rendered piece doesn't match the plan, or None if it does. A copy that started at
+    the wrong keyframe is a whole GOP too long; a piece running to the end of the file is
+    only checked for that, since the video may stop a little before the file does.
+    """
+    expected = piece.duration(duration)
+    span = _video_span(path)
+    tolerance = 1.5 * min_piece
+    if span is None:
+        return "a rendered piece has no video"
+    if span > expected + tolerance or (piece.end is not None and span < expected - tolerance):
+        return f"a piece came out {span:.2f}s long instead of {expected:.2f}s"
+    return None
+
+def _concat_entry(path: str) -> str:
+    # Single quotes in concat list paths are closed, escaped and reopened
+    return "file '" + path.replace("'", "'\\''") + "'"
+
+def smart_render(input_path: str, output_path: str, segments: Sequence[Tuple[float, float]], info: MediaInfo,
+                 workers: int = RENDER_WORKERS, progress_output=print) -> RenderStats:
+    """
+    Keep segments of a video by stream-copying whole GOPs and re-encoding only the partial
+    GOPs at the cut points ("smart render"), then joining the pieces with the concat demuxer.
+
+    Most of the kept video is copied at disk speed and is bit-identical to the source; only
+    a few frames around each cut are encoded. Audio is cut sample-accurately and re-encoded
+    in the final step (cheap next to video), so it stays in sync across the joins.
+    info must be the catalog entry of input_path with its keyframes.
+    """
+    probe = run_ffprobe(input_path)
+    stream = _video_stream(probe)
+    codec = stream.get("codec_name")
+    if codec not in VIDEO_ENCODERS:
+        raise SmartRenderError(f"{codec} video isn't supported")
+
+    # Keyframe times are stream timestamps; seeks are relative to the start of the file
+    try:
+        offset = float(probe.get("format", {}).get("start_time") or 0)
+    except ValueError:
+        offset = 0.0
+    keyframes = sorted(keyframe - offset for keyframe in info.keyframes or [])
+    min_piece = 1 / info.frame_rate if info.frame_rate else 0.04
+    pieces = plan_pieces(segments, keyframes, min_piece, info.duration)
+
+    piece_format, extension = PIECE_FORMATS[codec]
+    work_dir = tempfile.mkdtemp(prefix=".capri-segments-", dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        commands = [
+            _piece_command(input_path, piece, os.path.join(work_dir, f"piece{i:05d}{extension}"), piece_format, codec,
+                           stream.get("pix_fmt"), min_piece)
+            for i, piece in enumerate(pieces)
+        ]
+        progress = ProgressReporter("Rendering segments", unit="pieces", total_items=len(pieces), output=progress_output)
+
+        def render(i: int) -> Optional[str]:
+            cmd, piece_path = commands[i]
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            progress.advance(items=1)
+            if result.returncode != 0:
+                return result.stderr.strip() or "ffmpeg failed"
+            # Checked before joining: a misplaced cut would otherwise put the video out of
+            # sync with the separately trimmed audio without failing
+            return _check_piece(pieces[i], piece_path, info.duration, min_piece)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pieces))), thread_name_prefix="capri-render") as executor:
+            errors = [error for error in executor.map(render, range(len(pieces))) if error]
+        progress.finish()
+        if errors:
+            raise SmartRenderError(errors[0])
+        piece_paths = [piece_path for _cmd, piece_path in commands]
+
+        list_path = os.path.join(work_dir, "pieces.txt")
+        with open(list_path, "w", encoding="utf-8") as file:
+            file.write("\n".join(_concat_entry(piece_path) for piece_path in piece_paths) + "\n")
+
+        cmd = ["ffmpeg", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_path]
+        if info.has_audio:
+            trims = [f"[1:a]atrim=start={start}:end={end},asetpts=PTS-STARTPTS[a{i}]" for i, (start, end) in enumerate(segments)]
+            audio = "".join(f"[a{i}]" for i in range(len(segments)))
+            cmd += ["-i", input_path, "-filter_complex", "; ".join(trims + [f"{audio}concat=n={len(segments)}:v=0:a=1[outa]"]),
+                    "-map", "0:v", "-map", "[outa]"]
+        else:
+            cmd += ["-map", "0:v"]
+        cmd += ["-c:v", "copy", "-y", output_path]
+
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise SmartRenderError(result.stderr.strip() or "ffmpeg failed to join the pieces")
+        return RenderStats(pieces, info.duration)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,67 @@
+from typing import Optional
+import numpy as np
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+# Speculative decoding modes accepted by call_local_ai and load_local_model
+SPECULATIVE_MODES = ["none", "prompt_lookup", "draft_model"]
+
+# Tokens drafted per verification step. Extraction output copies long spans of the
+# prompt, so prompt lookup can afford to guess further ahead than a draft model
+PROMPT_LOOKUP_PRED_TOKENS = 10
+PROMPT_LOOKUP_MAX_NGRAM = 3
+DRAFT_MODEL_PRED_TOKENS = 6
+
+class SmallModelDraft(LlamaDraftModel):
+    """
+    A small Llama (same tokenizer as the target) used as a llama.cpp draft model.
+
+    The small model greedily proposes the next few tokens; the target model verifies
+    them in one batch and keeps the longest prefix it agrees with. With greedy decoding
+    (temperature 0) the output is the same as plain decoding; when sampling, it follows the
+    same distribution but not the same tokens. The draft model's KV cache is reused between steps, so each
+    call only evaluates the tokens accepted since the previous one.
+    """
+    def __init__(self, llm, num_pred_tokens: int = DRAFT_MODEL_PRED_TOKENS):
+        self.llm = llm
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids, **kwargs):
+        tokens = input_ids.tolist()
+
+        # Leave room for the drafted tokens in the draft model's own context
+        if len(tokens) + self.num_pred_tokens >= self.llm.n_ctx():
+            return np.array([], dtype=np.intc)
+
+        drafted = []
+        for token in self.llm.generate(tokens, top_k=1, temp=0.0):
+            if token == self.llm.token_eos():
+                break
+            drafted.append(token)
+            if len(drafted) >= self.num_pred_tokens:
+                break
+
+        return np.array(drafted, dtype=np.intc)
+
+def create_draft_model(mode: Optional[str], n_ctx: int = 2048, draft_model_name: Optional[str] = None):
+    """
+    Build the draft_model argument for Llama for a speculative decoding mode.
+
+    "prompt_lookup" drafts by matching the last n-gram against the prompt, which costs
+    nothing and suits extraction; "draft_model" uses a small model from the registry.
+    Returns None for "none".
+    """
+    if not mode or mode == "none":
+        return None
+
+    if mode == "prompt_lookup":
+        return LlamaPromptLookupDecoding(max_ngram_size=PROMPT_LOOKUP_MAX_NGRAM, num_pred_tokens=PROMPT_LOOKUP_PRED_TOKENS)
+
+    if mode == "draft_model":
+        if not draft_model_name:
+            raise ValueError("Speculative mode 'draft_model' needs a draft model (set 'draft_model' in the registry entry)")
+
+        # Imported here to avoid a circular import with the registry
+        from capri_tools.local_model_registry import load_local_model
+        return SmallModelDraft(load_local_model(draft_model_name, n_ctx=n_ctx))
+
+    raise ValueError(f"Unknown speculative mode: {mode}. Use one of: {', '.join(SPECULATIVE_MODES)}")
@@ -0,0 +1,71 @@
+import re
+from typing import List, Optional, TextIO
+
+# Characters read per step; memory use is about this plus the longest search string
+CHUNK_SIZE = 1024 * 1024
+
+class Edit:
+    """One replacement: old_str -> new_str, at most count times (all occurrences if count is None)"""
+    def __init__(self, old_str: str, new_str: str, count: Optional[int] = None):
+        self.old_str = old_str
+        self.new_str = new_str
+        self.count = count
+        self.replaced = 0
+
+    @property
+    def exhausted(self) -> bool:
+        return self.count is not None and self.replaced >= self.count
+
+def _build_pattern(edits: List[Edit]):
+    active = [i for i, edit in enumerate(edits) if not edit.exhausted]
+    if not active:
+        return None, [], 0
+
+    # Longest first, so of two search strings matching at the same position the longer one wins
+    active.sort(key=lambda i: len(edits[i].old_str), reverse=True)
+    pattern = re.compile("|".join(f"({re.escape(edits[i].old_str)})" for i in active))
+    return pattern, active, max(len(edits[i].old_str) for i in active)
+
+def stream_replace(source: TextIO, destination: TextIO, edits: List[Edit], chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Copy source to destination, applying all edits in a single pass. Returns the number of replacements.
+
+    All edits are matched against the original text (a replacement is never searched again),
+    scanning left to right. Matches spanning chunk boundaries are found by holding back the
+    last len(longest old_str) - 1 characters of each chunk until the next one is read.
+    """
+    pattern, active, max_len = _build_pattern(edits)
+    buffer = ""
+    total = 0
+
+    while True:
+        chunk = source.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+
+        # A match must start before this point to be certain no longer match was cut off
+        safe = len(buffer) if eof else len(buffer) - (max_len - 1)
+        position = 0
+
+        while pattern is not None and position < safe:
+            match = pattern.search(buffer, position)
+            if match is None or match.start() >= safe:
+                break
+
+            edit = edits[active[match.lastindex - 1]]
+            destination.write(buffer[position:match.start()])
+            destination.write(edit.new_str)
+            edit.replaced += 1
+            total += 1
+            position = match.end()
+
+            if edit.exhausted:
+                pattern, active, max_len = _build_pattern(edits)
+                safe = len(buffer) if eof else len(buffer) - (max_len - 1)
+
+        emit_to = len(buffer) if eof or pattern is None else max(position, safe)
+        destination.write(buffer[position:emit_to])
+        buffer = buffer[emit_to:]
+
+        if eof:
+            return total
@@ -1,10 +1,29 @@
+import functools
+import time
 from typing import Callable, Dict, Any, Tuple, Optional
 
 class ToolDefinition:
     """Definition for a tool that Claude can use"""
-    def __init__(self, name: str, description: str, input_schema: Dict[str, Any], 
+    def __init__(self, name: str, description: str, input_schema: Dict[str, Any],
                  function: Callable[[bytes], Tuple[str, Optional[Exception]]]):
         self.name = name
         self.description = description
         self.input_schema = input_schema
-        self.function = function
+        self.function = self._record_calls(function)
+
+    def _record_calls(self, function: Callable[[bytes], Tuple[str, Optional[Exception]]]):
+        """Wrap the tool function so its calls and timings show up in the tool metrics"""
+        @functools.wraps(function)
+        def wrapper(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
+            # Imported here because tool_metrics itself defines a tool
+            from capri_tools.tool_metrics import record_tool_call
+
+            start = time.perf_counter()
+            failed = True
+            try:
+                result, error = function(input_bytes)
+                failed = error is not None
+                return result, error
+            finally:
+                record_tool_call(self.name, time.perf_counter() - start, failed)
+        return wrapper
@@ -0,0 +1,61 @@
+import json
+import threading
+from typing import Callable, Dict, Any, Tuple, Optional
+from capri_tools.tool_definition import ToolDefinition
+
+# Functions returning a dict of statistics, keyed by the component they describe
+_providers: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+# Per-tool call counters filled in by ToolDefinition
+_tool_calls: Dict[str, Dict[str, Any]] = {}
+_lock = threading.Lock()
+
+def register_metrics(name: str, provider: Callable[[], Dict[str, Any]]) -> None:
+    """Register a function whose statistics (e.g. cache hit rates) are included in the tool metrics"""
+    _providers[name] = provider
+
+def record_tool_call(name: str, seconds: float, failed: bool) -> None:
+    """Record one call of a tool"""
+    with _lock:
+        calls = _tool_calls.setdefault(name, {"calls": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        calls["calls"] += 1
+        calls["errors"] += 1 if failed else 0
+        calls["total_seconds"] += seconds
+        calls["max_seconds"] = max(calls["max_seconds"], seconds)
+
+def get_tool_metrics() -> Dict[str, Any]:
+    """Return tool call counts and the statistics of every registered component"""
+    with _lock:
+        tools = {
+            name: dict(calls, total_seconds=round(calls["total_seconds"], 4), max_seconds=round(calls["max_seconds"], 4))
+            for name, calls in _tool_calls.items()
+        }
+
+    metrics: Dict[str, Any] = {"tools": tools}
+    for name, provider in _providers.items():
+        try:
+            metrics[name] = provider()
+        except Exception as e:
+            metrics[name] = {"error": str(e)}
+    return metrics
+
+# Schema for tool_metrics tool
+tool_metrics_schema = {
+    "type": "object",
+    "properties": {}
+}
+
+def tool_metrics_function(input_bytes: bytes) -> Tuple[str, Optional[Exception]]:
+    """Return tool call counts and cache statistics as JSON"""
+    try:
+        return json.dumps(get_tool_metrics(), indent=2), None
+    except Exception as e:
+        return "", e
+
+# Create the tool definition
+tool_metrics_tool = ToolDefinition(
+    name="tool_metrics",
+    description="Show tool call counts and timings, and cache hit rates (file content cache, grammar cache).",
+    input_schema=tool_metrics_schema,
+    function=tool_metrics_function
+)
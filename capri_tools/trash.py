@@ -0,0 +1,335 @@
+import errno
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from capri_tools.get_capri_dir import get_capri_dir, get_capri_state_dir
+from capri_tools.tool_metrics import register_metrics
+
+# Environment variables controlling how long deleted directories can be restored
+RETENTION_ENV = "CAPRI_TRASH_RETENTION_HOURS"
+MAX_SIZE_ENV = "CAPRI_TRASH_MAX_GB"
+
+DEFAULT_RETENTION_HOURS = 72
+DEFAULT_MAX_GB = 20
+
+# Seconds between reaper passes (a delete also wakes it up)
+REAP_INTERVAL = 60
+
+# Threads unlinking files when the space is reclaimed
+REAP_WORKERS = 8
+
+# Name of the metadata file stored next to each trashed item
+INFO_FILE = "info.json"
+
+# Trash entries being reclaimed get this prefix, so they can no longer be restored
+REAPING_PREFIX = ".reaping-"
+
+# Entries are assembled under this prefix and renamed into place once complete, so the
+# reaper never sees one without its item or info
+PENDING_PREFIX = ".pending-"
+
+# Seconds before a pending entry left empty by a crash is reclaimed
+PENDING_GRACE = 3600
+
+def trash_retention_seconds() -> float:
+    return float(os.environ.get(RETENTION_ENV, DEFAULT_RETENTION_HOURS)) * 3600
+
+def trash_max_bytes() -> int:
+    return int(float(os.environ.get(MAX_SIZE_ENV, DEFAULT_MAX_GB)) * 1024 ** 3)
+
+def tree_size(path: str) -> int:
+    """Total size of the files below path, without following symlinks"""
+    total = 0
+    stack = [path]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as iterator:
+                for entry in iterator:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            total += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+    return total
+
+def remove_tree(path: str, workers: int = REAP_WORKERS) -> None:
+    """
+    Delete a directory tree, unlinking files on a thread pool.
+
+    Unlinks are independent metadata operations, so issuing them in parallel keeps the
+    filesystem busy where rmtree would wait on each one in turn. Directories are removed
+    deepest first once their files are gone.
+    """
+    files: List[str] = []
+    directories: List[str] = []
+    stack = [path]
+    while stack:
+        directory = stack.pop()
+        directories.append(directory)
+        try:
+            with os.scandir(directory) as iterator:
+                for entry in iterator:
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        stack.append(entry.path)
+                    else:
+                        files.append(entry.path)
+        except OSError:
+            pass
+
+    def unlink(file_path: str) -> None:
+        try:
+            os.unlink(file_path)
+        except FileNotFoundError:
+            pass
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="capri-reaper") as executor:
+        list(executor.map(unlink, files, chunksize=64))
+
+    # Parents were listed before their children
+    for directory in reversed(directories):
+        try:
+            os.rmdir(directory)
+        except FileNotFoundError:
+            pass
+
+    # Anything left over (permissions changed, files created meanwhile) goes the slow way
+    if os.path.lexists(path):
+        shutil.rmtree(path, ignore_errors=True)
+
+class Trash:
+    """
+    Directories deleted by Capri, kept under .capri/trash until the reaper reclaims them.
+
+    Each entry is trash/<id>/item (the renamed directory) plus trash/<id>/info.json with its
+    original path and deletion time. A rename within one filesystem is O(1) whatever the size
+    of the tree, so deleting returns at once and stays undoable until the entry is older than
+    the retention time or the trash grows past its size limit (oldest entries go first).
+    """
+    def __init__(self):
+        self.directory = get_capri_state_dir("trash")
+        self.reclaimed_entries = 0
+        self.reclaimed_bytes = 0
+        # Error of the last reaper pass, reported in the stats (None once a pass succeeds)
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._reap_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _read_info(self, trash_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.directory, trash_id, INFO_FILE), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_info(self, trash_id: str, info: Dict[str, Any]) -> None:
+        with open(os.path.join(self.directory, trash_id, INFO_FILE), "w", encoding="utf-8") as file:
+            json.dump(info, file)
+
+    def move_to_trash(self, full_path: str, permanent: bool = False) -> str:
+        """
+        Move a directory into the trash and return its trash id.
+
+        With permanent, the entry is reclaimed on the reaper's next pass instead of being kept.
+        Raises OSError(EXDEV) if the directory is on another filesystem than the trash.
+        """
+        capri_dir = get_capri_dir()
+        trash_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        pending_id = PENDING_PREFIX + trash_id
+        pending_directory = os.path.join(self.directory, pending_id)
+
+        os.makedirs(pending_directory)
+        try:
+            os.rename(full_path, os.path.join(pending_directory, "item"))
+        except OSError:
+            os.rmdir(pending_directory)
+            raise
+
+        self._write_info(pending_id, {
+            "original_path": os.path.relpath(full_path, capri_dir),
+            "deleted_at": time.time(),
+            "permanent": permanent,
+            "size": None
+        })
+        os.rename(pending_directory, os.path.join(self.directory, trash_id))
+
+        self.start_reaper()
+        self._wake.set()
+        return trash_id
+
+    def list_entries(self) -> List[Dict[str, Any]]:
+        """Restorable entries, newest first"""
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return entries
+
+        for trash_id in names:
+            if trash_id.startswith((REAPING_PREFIX, PENDING_PREFIX)):
+                continue
+            info = self._read_info(trash_id)
+            if info is None or info.get("permanent"):
+                continue
+            entries.append(dict(info, id=trash_id))
+
+        entries.sort(key=lambda entry: entry["deleted_at"], reverse=True)
+        return entries
+
+    def restore(self, trash_id: str, destination: Optional[str] = None) -> str:
+        """Move a trashed directory back to its original path (or destination); returns the restored path"""
+        capri_dir = get_capri_dir()
+        with self._lock:
+            info = self._read_info(trash_id)
+            if info is None or info.get("permanent"):
+                raise FileNotFoundError(f"No restorable trash entry: {trash_id}")
+
+            target = os.path.join(capri_dir, destination or info["original_path"])
+            if os.path.exists(target):
+                raise FileExistsError(f"Restore target already exists: {os.path.relpath(target, capri_dir)}")
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.rename(os.path.join(self.directory, trash_id, "item"), target)
+            shutil.rmtree(os.path.join(self.directory, trash_id), ignore_errors=True)
+            return target
+
+    def find_entry(self, original_path: str) -> Optional[str]:
+        """Id of the newest restorable entry deleted from original_path"""
+        wanted = os.path.normpath(original_path)
+        for entry in self.list_entries():
+            if os.path.normpath(entry["original_path"]) == wanted:
+                return entry["id"]
+        return None
+
+    def start_reaper(self) -> None:
+        """Start the background thread that reclaims expired trash entries (once)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run_reaper, name="capri-trash-reaper", daemon=True)
+            self._thread.start()
+
+    def _run_reaper(self) -> None:
+        while True:
+            try:
+                self.reap()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"Error reclaiming trash: {e}"
+            self._wake.wait(REAP_INTERVAL)
+            self._wake.clear()
+
+    def reap(self) -> None:
+        """Reclaim permanent and expired entries, then the oldest ones while the trash is over its size limit"""
+        with self._reap_lock:
+            self._reap()
+
+    def _reap(self) -> None:
+        now = time.time()
+        retention = trash_retention_seconds()
+        max_bytes = trash_max_bytes()
+
+        entries = []
+        for trash_id in os.listdir(self.directory):
+            if trash_id.startswith(REAPING_PREFIX):
+                # Left over from an interrupted reclaim
+                entries.append((0.0, trash_id, 0, True))
+                continue
+
+            if trash_id.startswith(PENDING_PREFIX):
+                # Still being moved in; one left by a crash is only reclaimed if nothing got into it
+                entry_directory = os.path.join(self.directory, trash_id)
+                try:
+                    abandoned = now - os.stat(entry_directory).st_mtime >= PENDING_GRACE
+                except FileNotFoundError:
+                    continue
+                if abandoned and not os.path.isdir(os.path.join(entry_directory, "item")):
+                    entries.append((0.0, trash_id, 0, True))
+                continue
+
+            info = self._read_info(trash_id)
+            if info is None:
+                if os.path.isdir(os.path.join(self.directory, trash_id, "item")):
+                    continue
+                entries.append((0.0, trash_id, 0, True))
+                continue
+
+            if info.get("size") is None:
+                info["size"] = tree_size(os.path.join(self.directory, trash_id, "item"))
+                try:
+                    self._write_info(trash_id, info)
+                except FileNotFoundError:
+                    # Restored meanwhile
+                    continue
+
+            expired = info.get("permanent") or now - info["deleted_at"] >= retention
+            entries.append((info["deleted_at"], trash_id, info["size"], expired))
+
+        # Oldest first: these are the ones that go when the trash is too big
+        entries.sort()
+        total = sum(size for _deleted_at, _trash_id, size, _expired in entries)
+        for _deleted_at, trash_id, size, expired in entries:
+            if not expired and total <= max_bytes:
+                continue
+            self._reclaim(trash_id, size)
+            total -= size
+
+    def _reclaim(self, trash_id: str, size: int) -> None:
+        with self._lock:
+            source = os.path.join(self.directory, trash_id)
+            if trash_id.startswith(REAPING_PREFIX):
+                reaping = source
+            else:
+                # Renamed under the lock, so a concurrent restore can't pick it up halfway through
+                reaping = os.path.join(self.directory, REAPING_PREFIX + trash_id)
+                try:
+                    os.rename(source, reaping)
+                except FileNotFoundError:
+                    return
+
+        remove_tree(reaping)
+        self.reclaimed_entries += 1
+        self.reclaimed_bytes += size
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self.list_entries()
+        return {
+            "entries": len(entries),
+            "bytes": sum(entry.get("size") or 0 for entry in entries),
+            "reclaimed_entries": self.reclaimed_entries,
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "retention_hours": trash_retention_seconds() / 3600,
+            "max_bytes": trash_max_bytes(),
+            "last_error": self.last_error
+        }
+
+_trash: Optional[Trash] = None
+_trash_lock = threading.Lock()
+
+def get_trash() -> Trash:
+    """Return the shared trash of the Capri data directory, starting its reaper on first use"""
+    global _trash
+    with _trash_lock:
+        if _trash is None:
+            _trash = Trash()
+            register_metrics("trash", _trash.stats)
+    _trash.start_reaper()
+    return _trash
+
+def is_cross_device(error: OSError) -> bool:
+    return error.errno == errno.EXDEV
@@ -0,0 +1,231 @@
+import mmap
+import os
+import sqlite3
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from capri_tools.get_capri_dir import get_capri_dir, get_capri_state_dir
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+# Name of the trigram index database inside the Capri state directory
+TRIGRAM_DATABASE_FILE = "search_index.sqlite3"
+
+# Bigger files aren't indexed (they're always searched); their trigram sets would dominate the database
+MAX_INDEXED_FILE_SIZE = 16 * 1024 * 1024
+
+# Bytes looked at to decide whether a file is binary
+BINARY_SNIFF_BYTES = 8192
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    indexed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    trigram BLOB NOT NULL,
+    document_id INTEGER NOT NULL,
+    PRIMARY KEY (trigram, document_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_document ON postings(document_id);
+"""
+
+def is_binary(data) -> bool:
+    """A NUL byte near the start of a file is the usual sign of a binary file"""
+    return b"\0" in data[:BINARY_SNIFF_BYTES]
+
+def file_trigrams(full_path: str) -> Optional[Set[bytes]]:
+    """
+    Return the set of lowercased byte trigrams of a text file, or None for binary,
+    unreadable or too large files (which the index can't rule out and are always searched).
+    """
+    try:
+        with open(full_path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size == 0:
+                return set()
+            if size > MAX_INDEXED_FILE_SIZE:
+                return None
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if is_binary(mm):
+                    return None
+                data = mm[:].lower()
+    except (OSError, ValueError):
+        return None
+
+    # zip over three shifted views is about twice as fast as slicing at every offset
+    return {bytes(trigram) for trigram in set(zip(data, data[1:], data[2:]))}
+
+def _literal_runs(parsed, runs: List[str], current: List[str]) -> None:
+    """Collect runs of literal characters every match must contain (top-level sequence only)"""
+    for op, value in parsed:
+        if op is sre_constants.LITERAL:
+            current.append(chr(value))
+            continue
+
+        # A group that must match exactly once is still part of the sequence
+        if op is sre_constants.SUBPATTERN:
+            _literal_runs(value[-1], runs, current)
+            continue
+
+        if current:
+            runs.append("".join(current))
+            current.clear()
+
+def required_trigrams(query: str, regex: bool) -> Optional[Set[bytes]]:
+    """
+    Trigrams every matching file must contain, or None if the query can't narrow the search
+    (too short, or a regex without a literal run of three or more characters).
+    """
+    if regex:
+        try:
+            parsed = sre_parse.parse(query)
+        except Exception:
+            return None
+        literals: List[str] = []
+        current: List[str] = []
+        _literal_runs(parsed, literals, current)
+        if current:
+            literals.append("".join(current))
+    else:
+        literals = [query]
+
+    trigrams = set()
+    for literal in literals:
+        encoded = literal.encode("utf-8").lower()
+        trigrams.update(encoded[i:i + 3] for i in range(len(encoded) - 2))
+    return trigrams or None
+
+class TrigramIndex:
+    """
+    Inverted index from lowercased byte trigrams to the text files that contain them.
+
+    Files are re-indexed only when their size or mtime changed, so keeping it current costs
+    one query plus the changed files. A search then only reads files holding every trigram
+    of the query. Case is folded for ASCII, so the same index serves case-insensitive searches.
+    """
+    def __init__(self, root: Optional[str] = None, database_path: Optional[str] = None):
+        self.root = root or get_capri_dir()
+        self.database_path = database_path or os.path.join(get_capri_state_dir(), TRIGRAM_DATABASE_FILE)
+        self._lock = threading.Lock()
+
+        connection = self.connect()
+        try:
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.database_path, timeout=30, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def update(self, files: List[Tuple[str, int, float]], map_function: Callable = map) -> int:
+        """
+        Bring the index up to date for these (relative path, size, mtime) files.
+
+        Trigram extraction runs through map_function (e.g. a process pool's map). Returns the
+        number of files (re)indexed.
+        """
+        with self._lock:
+            connection = self.connect()
+            try:
+                known: Dict[str, Tuple[int, int, float]] = {
+                    path: (document_id, size, mtime)
+                    for document_id, path, size, mtime in connection.execute("SELECT id, path, size, mtime FROM documents")
+                }
+
+                stale = []
+                for path, size, mtime in files:
+                    document = known.get(path)
+                    if document is None or document[1:] != (size, mtime):
+                        stale.append((path, size, mtime))
+
+                if not stale:
+                    return 0
+
+                full_paths = [os.path.join(self.root, path) for path, _size, _mtime in stale]
+                for (path, size, mtime), trigrams in zip(stale, map_function(file_trigrams, full_paths)):
+                    document = known.get(path)
+                    if document is not None:
+                        connection.execute("DELETE FROM postings WHERE document_id = ?", (document[0],))
+                        connection.execute("DELETE FROM documents WHERE id = ?", (document[0],))
+
+                    cursor = connection.execute(
+                        "INSERT INTO documents (path, size, mtime, indexed) VALUES (?, ?, ?, ?)",
+                        (path, size, mtime, int(trigrams is not None))
+                    )
+                    if trigrams:
+                        document_id = cursor.lastrowid
+                        connection.executemany(
+                            "INSERT OR IGNORE INTO postings (trigram, document_id) VALUES (?, ?)",
+                            ((trigram, document_id) for trigram in trigrams)
+                        )
+
+                connection.commit()
+                return len(stale)
+            finally:
+                connection.close()
+
+    def prune(self, existing_paths: Iterable[str]) -> None:
+        """Drop documents for files that are gone"""
+        existing = set(existing_paths)
+        with self._lock:
+            connection = self.connect()
+            try:
+                gone = [
+                    document_id for document_id, path in connection.execute("SELECT id, path FROM documents")
+                    if path not in existing
+                ]
+                connection.executemany("DELETE FROM postings WHERE document_id = ?", ((document_id,) for document_id in gone))
+                connection.executemany("DELETE FROM documents WHERE id = ?", ((document_id,) for document_id in gone))
+                connection.commit()
+            finally:
+                connection.close()
+
+    def candidates(self, paths: List[str], trigrams: Set[bytes]) -> List[str]:
+        """Return the paths (in the given order) that may contain all trigrams"""
+        connection = self.connect()
+        try:
+            placeholders = ", ".join("?" * len(trigrams))
+            possible = {
+                path for (path,) in connection.execute(
+                    f"SELECT d.path FROM postings p JOIN documents d ON d.id = p.document_id "
+                    f"WHERE p.trigram IN ({placeholders}) GROUP BY p.document_id HAVING COUNT(*) = ?",
+                    [*trigrams, len(trigrams)]
+                )
+            }
+            # Files that couldn't be indexed (too large, binary) have to be searched anyway
+            possible.update(path for (path,) in connection.execute("SELECT path FROM documents WHERE indexed = 0"))
+        finally:
+            connection.close()
+
+        return [path for path in paths if path in possible]
+
+    def stats(self) -> Dict[str, int]:
+        connection = self.connect()
+        try:
+            documents, indexed = connection.execute("SELECT COUNT(*), COALESCE(SUM(indexed), 0) FROM documents").fetchone()
+            postings = connection.execute("SELECT COUNT(*) FROM postings").fetchone()[0]
+        finally:
+            connection.close()
+        return {"documents": documents, "indexed": indexed, "postings": postings}
+
+_trigram_index: Optional[TrigramIndex] = None
+_trigram_index_lock = threading.Lock()
+
+def get_trigram_index() -> TrigramIndex:
+    """Return the shared trigram index of the Capri data directory"""
+    global _trigram_index
+    with _trigram_index_lock:
+        if _trigram_index is None:
+            _trigram_index = TrigramIndex()
+        return _trigram_index
@@ -3,8 +3,10 @@ import json
 import argparse
 import readline
 from typing import Dict, List, Optional, Any, Union, Tuple
-from llama_cpp import Llama
-from tools import get_all_tools
+from capri_tools import get_all_tools
+from capri_tools.local_model_registry import load_local_model
+from capri_tools.grammar_cache import grammar_cache, grammar_cache_stats
+from capri_tools.chat_context import ChatContext
 
 class TerminalChat:
     def __init__(self):
@@ -12,16 +14,8 @@ class TerminalChat:
         # self.model_regular = Llama(model_path=model_path, chat_format="chatml")
         # self.model_function = Llama(model_path=model_path, chat_format="chatml-function-calling")
 
-        self.model_regular  = Llama.from_pretrained(
-            repo_id="bartowski/NousResearch_DeepHermes-3-Llama-3-3B-Preview-GGUF",
-            filename="NousResearch_DeepHermes-3-Llama-3-3B-Preview-Q8_0.gguf",
-            chat_format="chatml"
-        )
-        self.model_function  = Llama.from_pretrained(
-            repo_id="bartowski/NousResearch_DeepHermes-3-Llama-3-3B-Preview-GGUF",
-            filename="NousResearch_DeepHermes-3-Llama-3-3B-Preview-Q8_0.gguf",
-            chat_format="chatml-function-calling"
-        )
+        self.model_regular = load_local_model(chat_format="chatml")
+        self.model_function = load_local_model(chat_format="chatml-function-calling")
 
         # Verbose mode for debugging
         self.verbose = False
@@ -38,6 +32,9 @@ class TerminalChat:
         self.tool_objects = get_all_tools()
         self.tools = self._convert_tools_to_llama_format()
         
+        # Keep the history inside the context window (system prompt and tools stay pinned)
+        self.context = ChatContext(self.model_regular, tools=self.tools)
+        
     def _convert_tools_to_llama_format(self) -> List[Dict[str, Any]]:
         """Convert ToolDefinition objects to llama.cpp format"""
         llama_tools = []
@@ -87,7 +84,7 @@ class TerminalChat:
                     return {
                         "role": "tool",
                         "name": function_name,
-                        "content": json.dumps({"result": result})
+                        "content": json.dumps({"result": self.context.cap_tool_result(result)})
                     }
             except Exception as e:
                 return {
@@ -168,10 +165,7 @@ class TerminalChat:
         try:
             decision = self.model_regular.create_chat_completion(
                 messages=tool_decision_messages,
-                response_format={
-                    "type": "json_object",
-                    "schema": tools_schema
-                },
+                grammar=grammar_cache.get(tools_schema),
                 temperature=0.1
             )
             
@@ -229,6 +223,7 @@ class TerminalChat:
                     continue
                 elif user_input.lower() == '/clear':
                     self.messages = [self.messages[0]]  # Keep only the system message
+                    self.context.reset()
                     print("Conversation history cleared")
                     continue
                 elif user_input.lower() == '/help':
@@ -238,8 +233,15 @@ class TerminalChat:
                     print("/functions off - Disable function calling")
                     print("/clear - Reset conversation history")
                     print("/tools - List available tools")
+                    print("/stats - Show local inference cache statistics")
                     print("/help - Show this help message\n")
                     continue
+                elif user_input.lower() == '/stats':
+                    print("\n=== Grammar Cache ===")
+                    for key, value in grammar_cache_stats().items():
+                        print(f"{key}: {value}")
+                    print("")
+                    continue
                 elif user_input.lower() == '/tools':
                     print("\n=== Available Tools ===")
                     for i, tool in enumerate(self.tool_objects):
@@ -249,6 +251,7 @@ class TerminalChat:
                 
                 # Add user message to history
                 self.messages.append({"role": "user", "content": user_input})
+                self.messages = self.context.fit(self.messages)
                 
                 # Check if there's an appropriate tool to use
                 tool_name, tool_args = self.identify_appropriate_tool(user_input) if use_functions else (None, None)
@@ -315,6 +318,8 @@ class TerminalChat:
                         self.messages.append(tool_response)
                         print(f"Function {tool_call['function']['name']} result: {tool_response['content']}")
                     
+                    self.messages = self.context.fit(self.messages)
+                    
                     # Get final response after function calls
                     final_response = self.model_function.create_chat_completion(
                         messages=self.messages,